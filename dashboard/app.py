@@ -1,29 +1,48 @@
+import time
+STARTUP_BEGAN = time.perf_counter()
+
+import os
+import sys
 import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash import dcc, html, Patch
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import plotly.express as px
-import plotly.graph_objects as go
-import pandas as pd
+
+# Share the data loading helpers with the main dashboard in scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from dashboard_data import (DataStore, DataNotReady, StartupReport, files_fingerprint,
+                            load_time_metrics, register_health_routes)
+from time_index import TimeIndex
+from callback_metrics import instrument_callbacks
+from figure_compaction import compact_figure, enable_response_compression
+
+startup_report = StartupReport(started=STARTUP_BEGAN)
+startup_report.mark('imports')
 
 # Initialize the Dash app
 app = dash.Dash(__name__)
+# Record latency, payload size and figure points of every callback declared below; see /metrics
+instrument_callbacks(app)
 
-# Load the data
-df = pd.read_csv('../data/processed/time_metrics.csv')
-df['policy_date'] = pd.to_datetime(df['policy_date'])
+# Load the data in the background; health checks are answered immediately
+# and the data is reloaded whenever time_metrics.csv changes
+data_store = DataStore(
+    lambda report: load_time_metrics('../data/processed', report=report),
+    report=startup_report,
+    fingerprint=lambda: files_fingerprint('../data/processed', ['time_metrics.csv'])
+).start()
+register_health_routes(app.server, data_store)
+enable_response_compression(app.server)
 
 # Define the layout
 app.layout = html.Div([
     html.H1('Insurance Analytics Dashboard'),
     
-    # Time range selector
-    dcc.DatePickerRange(
-        id='date-range',
-        min_date_allowed=df['policy_date'].min(),
-        max_date_allowed=df['policy_date'].max(),
-        start_date=df['policy_date'].min(),
-        end_date=df['policy_date'].max()
-    ),
+    # Time range selector, filled in once the data has loaded
+    dcc.DatePickerRange(id='date-range'),
+    dcc.Interval(id='data-ready-poll', interval=1000),
+    dcc.Store(id='figure-version'),
     
     # KPI Cards
     html.Div([
@@ -55,6 +74,49 @@ app.layout = html.Div([
 ])
 
 # Callbacks
+@app.callback(
+    [Output('date-range', 'min_date_allowed'),
+     Output('date-range', 'max_date_allowed'),
+     Output('date-range', 'start_date'),
+     Output('date-range', 'end_date'),
+     Output('data-ready-poll', 'disabled')],
+    [Input('data-ready-poll', 'n_intervals')]
+)
+def initialize_date_range(n_intervals):
+    try:
+        df = data_store.get().time_metrics
+    except DataNotReady:
+        raise PreventUpdate
+
+    start, end = df['policy_date'].min(), df['policy_date'].max()
+    return start, end, start, end, True
+
+# Each trend is drawn once per data version over the full history; changing
+# the date range only patches the axis ranges of the figures already shown.
+TRENDS = [
+    ('monthly_premium', 'Monthly Premium Trends'),
+    ('monthly_claims', 'Monthly Claims Trends'),
+    ('monthly_fraud_cases', 'Monthly Fraud Cases'),
+    ('new_policies', 'New Policies Over Time')
+]
+
+def build_time_index(df):
+    return TimeIndex(df, 'policy_date', [column for column, _ in TRENDS])
+
+def build_trend_figures(df):
+    return [compact_figure(px.line(df, x='policy_date', y=column, title=title))
+            for column, title in TRENDS]
+
+def axis_ranges(index, column, start_date, end_date):
+    """The x and y ranges that frame column over the selected dates."""
+    x_range = {'range': [start_date, end_date], 'autorange': False}
+    extent = index.extent(column, start_date, end_date)
+    if extent is None:
+        return x_range, {'autorange': True}
+    low, high = extent
+    pad = (high - low) * 0.05 or max(abs(high) * 0.05, 1)
+    return x_range, {'range': [low - pad, high + pad], 'autorange': False}
+
 @app.callback(
     [Output('total-premium', 'children'),
      Output('total-claims', 'children'),
@@ -63,33 +125,48 @@ app.layout = html.Div([
      Output('premium-trend', 'figure'),
      Output('claims-trend', 'figure'),
      Output('fraud-trend', 'figure'),
-     Output('policies-trend', 'figure')],
+     Output('policies-trend', 'figure'),
+     Output('figure-version', 'data')],
     [Input('date-range', 'start_date'),
-     Input('date-range', 'end_date')]
+     Input('date-range', 'end_date')],
+    [State('figure-version', 'data')]
 )
-def update_dashboard(start_date, end_date):
-    # Filter data based on date range
-    mask = (df['policy_date'] >= start_date) & (df['policy_date'] <= end_date)
-    filtered_df = df.loc[mask]
-    
-    # Calculate KPIs
-    total_premium = f"${filtered_df['monthly_premium'].sum():,.2f}"
-    total_claims = f"${filtered_df['monthly_claims'].sum():,.2f}"
-    fraud_cases = f"{filtered_df['monthly_fraud_cases'].sum():,}"
-    new_policies = f"{filtered_df['new_policies'].sum():,}"
-    
-    # Create figures
-    premium_fig = px.line(filtered_df, x='policy_date', y='monthly_premium',
-                         title='Monthly Premium Trends')
-    claims_fig = px.line(filtered_df, x='policy_date', y='monthly_claims',
-                        title='Monthly Claims Trends')
-    fraud_fig = px.line(filtered_df, x='policy_date', y='monthly_fraud_cases',
-                       title='Monthly Fraud Cases')
-    policies_fig = px.line(filtered_df, x='policy_date', y='new_policies',
-                          title='New Policies Over Time')
-    
+def update_dashboard(start_date, end_date, figure_version):
+    if start_date is None or end_date is None:
+        raise PreventUpdate
+    data = data_store.get()
+    index = data.memo('time_index', lambda: build_time_index(data.time_metrics))
+
+    # Calculate KPIs from the prefix sums
+    totals = index.totals(start_date, end_date)
+    total_premium = f"${totals['monthly_premium']:,.2f}"
+    total_claims = f"${totals['monthly_claims']:,.2f}"
+    fraud_cases = f"{int(totals['monthly_fraud_cases']):,}"
+    new_policies = f"{int(totals['new_policies']):,}"
+
+    # Send whole figures only when the browser has none for this data version
+    full_figures = data.version is None or figure_version != data.version
+    if full_figures:
+        base_figures = data.memo('trend_figures', lambda: build_trend_figures(data.time_metrics))
+
+    figures = []
+    for i, (column, _) in enumerate(TRENDS):
+        x_range, y_range = axis_ranges(index, column, start_date, end_date)
+        if full_figures:
+            layout = dict(base_figures[i]['layout'])
+            layout['xaxis'] = {**layout.get('xaxis', {}), **x_range}
+            layout['yaxis'] = {**layout.get('yaxis', {}), **y_range}
+            figures.append({'data': base_figures[i]['data'], 'layout': layout})
+        else:
+            patch = Patch()
+            patch['layout']['xaxis'].update(x_range)
+            patch['layout']['yaxis'].update(y_range)
+            figures.append(patch)
+
     return (total_premium, total_claims, fraud_cases, new_policies,
-            premium_fig, claims_fig, fraud_fig, policies_fig)
+            *figures, data.version)
+
+startup_report.mark('app ready')
 
 if __name__ == '__main__':
     app.run_server(debug=True) 
\ No newline at end of file
@@ -0,0 +1,439 @@
+"""
+Approximate answers for the dashboard, with error bounds.
+For very large books the KPI cards and charts can be estimated instead of
+computed exactly, at a cost that doesn't grow with the number of policies:
+
+- sums, means, rates and counts come from the stratified bottom-k reservoir
+  (see sampling.py) weighted by each stratum's true size, with 95% normal
+  confidence intervals from the stratified variance,
+- quantiles come from mergeable relative-error quantile sketches (DDSketch)
+  kept per customer_segment x region stratum and merged for any filter;
+  a sketch quantile is within SKETCH_ACCURACY of the true value, relatively.
+
+The sketches are built in one streaming pass over insurance_data.csv:
+    python scripts/approximate.py [--data-dir data/processed]
+"""
+
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from dashboard_data import data_version
+from dataset_schema import load_table
+from sampling import STRATA, stratum_labels
+
+SKETCH_FILE = 'sketches.json'
+SOURCE_FILE = 'insurance_data.csv'
+SKETCH_FORMAT = 1
+SKETCH_ACCURACY = 0.01
+SKETCH_COLUMNS = ['annual_premium', 'claim_amount', 'risk_score']
+SKETCH_CHUNK_ROWS = 500000
+CONFIDENCE_Z = 1.96
+HISTOGRAM_BINS = 30
+ALL = 'All'
+
+
+class QuantileSketch:
+    """Relative-error quantile sketch with logarithmic buckets; sketches of disjoint data merge exactly."""
+
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=SKETCH_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _add_buckets(self, store, values):
+        indexes, counts = np.unique(np.ceil(np.log(values) / self.log_gamma).astype(np.int64),
+                                    return_counts=True)
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            store[index] = store.get(index, 0) + count
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return self
+        self._add_buckets(self.positive, values[values > self.MIN_VALUE])
+        self._add_buckets(self.negative, -values[values < -self.MIN_VALUE])
+        self.zero += int(np.count_nonzero(np.abs(values) <= self.MIN_VALUE))
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        return self
+
+    def merge(self, other):
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_store.items():
+                store[index] = store.get(index, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        if not self.count:
+            return np.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return max(-self._value(index), self.min)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.sum / self.count if self.count else np.nan
+
+    def to_dict(self):
+        return {'relative_accuracy': self.relative_accuracy, 'count': self.count, 'sum': self.sum,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None,
+                'zero': self.zero, 'positive': sorted(self.positive.items()),
+                'negative': sorted(self.negative.items())}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state['relative_accuracy'])
+        sketch.positive = {int(index): count for index, count in state['positive']}
+        sketch.negative = {int(index): count for index, count in state['negative']}
+        sketch.zero, sketch.count, sketch.sum = state['zero'], state['count'], state['sum']
+        if sketch.count:
+            sketch.min, sketch.max = state['min'], state['max']
+        return sketch
+
+
+def _with_risk_score(df):
+    if 'risk_score' in df:
+        return df
+    from features import risk_score
+    return df.assign(risk_score=risk_score(df))
+
+
+def build_sketches(df, sketches=None):
+    """Fold a frame into {stratum: {column: QuantileSketch}}."""
+    sketches = sketches if sketches is not None else {}
+    df = _with_risk_score(df)
+    labels = stratum_labels(df)
+    values = {column: df[column].to_numpy(dtype=np.float64) for column in SKETCH_COLUMNS}
+    for stratum, positions in df.groupby(labels, sort=False).indices.items():
+        columns = sketches.setdefault(stratum, {})
+        for column in SKETCH_COLUMNS:
+            columns.setdefault(column, QuantileSketch()).add(values[column][positions])
+    return sketches
+
+
+def write_sketches(data_dir='data/processed'):
+    """Build the per-stratum sketches for the current data in one chunked pass."""
+    from features import FEATURES
+
+    source = os.path.join(data_dir, SOURCE_FILE)
+    version = data_version(source)
+    sketches, period_end = {}, None
+    columns = STRATA + ['policy_date', 'annual_premium', 'claim_amount']
+    for chunk in load_table(data_dir, 'insurance_data', usecols=columns, ignore=FEATURES,
+                            chunksize=SKETCH_CHUNK_ROWS):
+        build_sketches(chunk, sketches)
+        latest = chunk['policy_date'].max()
+        period_end = latest if period_end is None else max(period_end, latest)
+
+    state = {'format': SKETCH_FORMAT, 'data_version': version,
+             'period_end': period_end.date().isoformat() if period_end is not None else None,
+             'sketches': {stratum: {column: sketch.to_dict() for column, sketch in columns.items()}
+                          for stratum, columns in sorted(sketches.items())}}
+    path = os.path.join(data_dir, SKETCH_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+    print(f"Quantile sketches written for data version {version}: {len(sketches)} strata")
+    return version
+
+
+def load_sketches(data_dir='data/processed', version=None):
+    """Read the stored sketches as (sketches, period_end), or None if they don't match the data."""
+    path = os.path.join(data_dir, SKETCH_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    if state['format'] != SKETCH_FORMAT or state['data_version'] != (
+            version or data_version(os.path.join(data_dir, SOURCE_FILE))):
+        return None
+    sketches = {stratum: {column: QuantileSketch.from_dict(sketch) for column, sketch in columns.items()}
+                for stratum, columns in state['sketches'].items()}
+    return sketches, state['period_end']
+
+
+def load_approximate(data_dir='data/processed', expected_rows=None, version=None):
+    """The ApproximateBackend for the stored reservoir and sketches, or None if either is missing or stale."""
+    from sampling import load_reservoir
+    version = version or data_version(os.path.join(data_dir, SOURCE_FILE))
+    stored = load_sketches(data_dir, version=version)
+    reservoir = load_reservoir(data_dir, expected_rows=expected_rows, version=version)
+    if stored is None or reservoir is None:
+        return None
+    sketches, period_end = stored
+    return ApproximateBackend(*reservoir, sketches, period_end)
+
+
+class ApproximateBackend:
+    """Answer the dashboard's aggregate queries from the reservoir and the sketches.
+
+    Row-level queries (explorer pages, customer lookups) are passed on to
+    the exact backend set with attach().
+    """
+
+    def __init__(self, reservoir, counts, sketches, period_end=None):
+        self.population = pd.Series(counts, dtype='int64')
+        self.sketches = sketches
+        self.period_end = pd.Timestamp(period_end) if period_end else None
+        self.exact = None
+
+        reservoir = _with_risk_score(reservoir).reset_index(drop=True)
+        reservoir['risk_score'] = reservoir['risk_score'].replace([np.inf, -np.inf], np.nan)
+        # premium_category is defined by premium quartiles; take them from the sketches
+        from features import PREMIUM_CATEGORIES
+        premium = self.sketch('annual_premium')
+        edges = [-np.inf] + [premium.quantile(q) for q in (0.25, 0.5, 0.75)] + [np.inf]
+        reservoir['premium_category'] = pd.cut(reservoir['annual_premium'], edges, labels=PREMIUM_CATEGORIES)
+        self.reservoir = reservoir
+        self.strata = stratum_labels(reservoir).to_numpy()
+        sampled = pd.Series(self.strata).value_counts()
+        self.weights = (self.population / sampled).reindex(self.strata).to_numpy()
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build the reservoir and sketches from a loaded frame."""
+        from sampling import RESERVOIR_SIZE, bottom_k
+        dates = pd.to_datetime(df['policy_date'])
+        return cls(bottom_k(df, RESERVOIR_SIZE), stratum_labels(df).value_counts(),
+                   build_sketches(df), dates.max())
+
+    def attach(self, exact):
+        self.exact = exact
+        return self
+
+    def __getattr__(self, name):
+        exact = self.__dict__.get('exact')
+        if exact is None:
+            raise AttributeError(name)
+        return getattr(exact, name)
+
+    def _strata(self, customer_segment=ALL, region=ALL):
+        return [stratum for stratum in self.population.index
+                if (customer_segment == ALL or stratum.split('|')[0] == customer_segment)
+                and (region == ALL or stratum.split('|')[1] == region)]
+
+    def sketch(self, column, strata=None):
+        """The merged sketch of column over the given strata (all by default)."""
+        merged = QuantileSketch()
+        for stratum in strata if strata is not None else self.sketches:
+            if stratum in self.sketches:
+                merged.merge(self.sketches[stratum][column])
+        return merged
+
+    def total(self, values, strata=None):
+        """Stratified estimate of a population total, as (estimate, standard error)."""
+        frame = pd.DataFrame({'stratum': self.strata, 'y': np.asarray(values, dtype=np.float64)})
+        if strata is not None:
+            frame = frame[frame['stratum'].isin(strata)]
+        grouped = frame.groupby('stratum')['y']
+        n, mean, var = grouped.count(), grouped.mean(), grouped.var(ddof=1).fillna(0)
+        population = self.population.reindex(n.index)
+        estimate = float((population * mean).sum())
+        variance = float((population ** 2 * (1 - n / population) * var / n).sum())
+        return estimate, math.sqrt(max(variance, 0.0))
+
+    def ratio(self, numerator, denominator, strata=None):
+        """Estimate of total(numerator) / total(denominator) with a linearized standard error."""
+        numerator = np.nan_to_num(np.asarray(numerator, dtype=np.float64))
+        denominator = np.asarray(denominator, dtype=np.float64)
+        bottom, _ = self.total(denominator, strata)
+        if not bottom:
+            return np.nan, np.nan
+        ratio = self.total(numerator, strata)[0] / bottom
+        _, error = self.total(numerator - ratio * denominator, strata)
+        return ratio, error / abs(bottom)
+
+    def count_above(self, column, q, strata=None):
+        """Estimated rows above the q-th quantile of column, with a 95% interval.
+
+        The interval also covers the sketch's relative error in the quantile itself.
+        """
+        threshold = self.sketch(column).quantile(q)
+        values = self.reservoir[column].to_numpy(dtype=np.float64)
+        estimate, error = self.total(values > threshold, strata)
+        slack = abs(threshold) * SKETCH_ACCURACY
+        low = self.total(values > threshold + slack, strata)
+        high = self.total(values > threshold - slack, strata)
+        return int(round(estimate)), (low[0] - CONFIDENCE_Z * low[1], high[0] + CONFIDENCE_Z * high[1])
+
+    @staticmethod
+    def interval(estimate, error):
+        return (estimate - CONFIDENCE_Z * error, estimate + CONFIDENCE_Z * error)
+
+    def kpis(self, customer_segment=ALL, region=ALL):
+        """KPI card values like kpi_snapshot.py's, with 95% intervals under 'ci'."""
+        strata = self._strata(customer_segment, region)
+        df = self.reservoir
+        ones = np.ones(len(df))
+        policies = int(self.population.reindex(strata).sum())
+        premium, claims = df['annual_premium'].to_numpy(), df['claim_amount'].to_numpy()
+        fraud = df['fraud_reported'].to_numpy(dtype=np.float64)
+        risk = df['risk_score'].to_numpy()
+
+        estimates = {
+            'total_premium': self.total(premium, strata),
+            'total_claims': self.total(claims, strata),
+            'avg_premium': self.ratio(premium, ones, strata),
+            'fraud_count': self.total(fraud, strata),
+            'fraud_rate': self.ratio(fraud, ones, strata),
+            'avg_risk_score': self.ratio(risk, ~np.isnan(risk), strata),
+        }
+        kpis = {name: estimate for name, (estimate, _) in estimates.items()}
+        kpis['ci'] = {name: self.interval(*estimate) for name, estimate in estimates.items()}
+        # Both are counts above the overall 75th percentile, taken from the sketches
+        for name, column in (('high_risk_customers', 'risk_score'), ('premium_customers', 'annual_premium')):
+            kpis[name], kpis['ci'][name] = self.count_above(column, 0.75, strata)
+        kpis['fraud_count'] = int(round(kpis['fraud_count']))
+
+        by_region = {name: self.total(premium, [s for s in strata if s.split('|')[1] == name])[0]
+                     for name in sorted({s.split('|')[1] for s in strata})}
+        top_region = max(by_region, key=by_region.get)
+        kpis.update(policies=policies, segments=len({s.split('|')[0] for s in strata}),
+                    regions=len(by_region), top_region=top_region,
+                    customer_segment=customer_segment, region=region,
+                    **self._year_over_year(strata, top_region))
+        return kpis
+
+    def _year_over_year(self, strata, top_region):
+        changes = dict.fromkeys(['premium_yoy', 'claims_yoy', 'policies_yoy', 'fraud_rate_yoy',
+                                 'top_region_premium_yoy'])
+        if self.period_end is None:
+            return changes
+        df = self.reservoir
+        dates = pd.to_datetime(df['policy_date'])
+        current = (dates > self.period_end - pd.DateOffset(years=1)).to_numpy()
+        prior = (dates > self.period_end - pd.DateOffset(years=2)).to_numpy() & ~current
+        premium, claims = df['annual_premium'].to_numpy(), df['claim_amount'].to_numpy()
+        fraud = df['fraud_reported'].to_numpy(dtype=np.float64)
+
+        def change(values, within=strata):
+            now, before = self.total(values * current, within)[0], self.total(values * prior, within)[0]
+            return now / before - 1 if before else None
+
+        top = [s for s in strata if s.split('|')[1] == top_region]
+        changes.update(premium_yoy=change(premium), claims_yoy=change(claims),
+                       policies_yoy=change(np.ones(len(df))), top_region_premium_yoy=change(premium, top))
+        current_rate = self.ratio(fraud * current, current, strata)[0]
+        prior_rate = self.ratio(fraud * prior, prior, strata)[0]
+        difference = current_rate - prior_rate
+        changes['fraud_rate_yoy'] = difference if np.isfinite(difference) else None
+        return changes
+
+    def _estimated_groups(self, by):
+        """The reservoir's weights and its grouping column by."""
+        column = self.reservoir[by]
+        return pd.DataFrame({by: column, 'weight': self.weights})
+
+    def counts(self, by):
+        if by in STRATA:
+            level = STRATA.index(by)
+            counts = self.population.groupby(lambda stratum: stratum.split('|')[level]).sum()
+            return counts.rename_axis(by).reset_index(name='policies')
+        frame = self._estimated_groups(by)
+        counts = frame.groupby(by, observed=True)['weight'].sum().round().astype('int64')
+        return counts.reset_index(name='policies')
+
+    def means(self, by, columns):
+        frame = self._estimated_groups(by)
+        for column in columns:
+            frame[column] = self.reservoir[column].to_numpy(dtype=np.float64) * self.weights
+        sums = frame.groupby(by, observed=True)[['weight'] + list(columns)].sum()
+        return sums[columns].div(sums['weight'], axis=0).reset_index()
+
+    def histogram(self, column, by, bins=HISTOGRAM_BINS):
+        values = self.reservoir[column].to_numpy(dtype=np.float64)
+        if column in SKETCH_COLUMNS:
+            sketch = self.sketch(column)
+            low, high = sketch.min, sketch.max
+        else:
+            low, high = np.nanmin(values), np.nanmax(values)
+        if not np.isfinite([low, high]).all():
+            return pd.DataFrame(columns=[by, 'bin_start', 'bin_end', 'policies'])
+        width = (high - low) / bins if high > low else 1.0
+        frame = pd.DataFrame({by: self.reservoir[by].astype(str), 'weight': self.weights,
+                              'bin': np.clip((values - low) // width, 0, bins - 1)}).dropna()
+        counts = frame.groupby([by, 'bin'])['weight'].sum().round().astype('int64')
+        counts = counts.reset_index(name='policies')
+        counts['bin_start'] = low + counts['bin'] * width
+        counts['bin_end'] = counts['bin_start'] + width
+        return counts[[by, 'bin_start', 'bin_end', 'policies']]
+
+    def box_stats(self, column, by):
+        from query_backend import _box_from_quartiles
+        if column not in SKETCH_COLUMNS or by not in STRATA:
+            raise ValueError(f"No sketches for {column} by {by}")
+        level = STRATA.index(by)
+        rows = []
+        for name in sorted({stratum.split('|')[level] for stratum in self.sketches}):
+            sketch = self.sketch(column, [s for s in self.sketches if s.split('|')[level] == name])
+            rows.append({by: name, 'policies': sketch.count, 'mean': sketch.mean(),
+                         'min': sketch.min, 'max': sketch.max, 'q1': sketch.quantile(0.25),
+                         'median': sketch.quantile(0.5), 'q3': sketch.quantile(0.75)})
+        return _box_from_quartiles(pd.DataFrame(rows))
+
+
+class ApproximateData:
+    """A view of a DashboardData snapshot whose KPIs and charts are estimated.
+
+    Everything else (time and region metrics, samples, memo) is the snapshot's.
+    """
+
+    def __init__(self, data, backend):
+        self.data = data
+        self.backend = backend.attach(data.queries())
+
+    def __getattr__(self, name):
+        return getattr(self.data, name)
+
+    def kpis(self, customer_segment=ALL, region=ALL):
+        return self.data.memo(('approximate-kpis', customer_segment, region),
+                              lambda: self.backend.kpis(customer_segment, region))
+
+    def queries(self):
+        return self.backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default='data/processed')
+    args = parser.parse_args()
+    write_sketches(args.data_dir)
+
+
+if __name__ == "__main__":
+    main()
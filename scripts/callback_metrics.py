@@ -0,0 +1,278 @@
+"""
+Latency and payload instrumentation for Dash callbacks.
+Every callback registered on an app is wrapped to record wall time, CPU
+time, serialized response size and the number of figure points it returns.
+Points are counted on the callback's return value before Dash serializes
+it, and only for callbacks with an output that can hold a figure.
+The histograms are served in Prometheus text format on /metrics and as a
+JSON summary on /metrics.json (both only to local clients).
+"""
+
+import functools
+import json
+import math
+import threading
+import time
+
+from dash.dependencies import Output
+from dash.development.base_component import Component
+from dash.exceptions import PreventUpdate
+from plotly.basedatatypes import BaseFigure
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7)
+POINT_BUCKETS = (10, 100, 1e3, 1e4, 1e5, 1e6, 1e7)
+
+METRICS = {
+    'wall_seconds': ('dashboard_callback_wall_seconds', 'Callback wall-clock time', LATENCY_BUCKETS),
+    'cpu_seconds': ('dashboard_callback_cpu_seconds', 'Callback CPU time on the request thread', LATENCY_BUCKETS),
+    'response_bytes': ('dashboard_callback_response_bytes', 'Serialized callback response size', SIZE_BUCKETS),
+    'figure_points': ('dashboard_callback_figure_points', 'Data points in figures returned', POINT_BUCKETS),
+}
+
+LOCAL_ADDRESSES = ('127.0.0.1', '::1', 'localhost')
+# Output properties a figure can be returned in, directly or inside a dcc.Graph
+FIGURE_PROPERTIES = ('figure', 'children')
+TRACE_ARRAYS = ('x', 'y', 'z', 'values', 'labels', 'lat', 'lon')
+
+# Figure points counted by the callback running on this thread, for its response's metrics
+_counted = threading.local()
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus expects it."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket that contains it."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return self.max if math.isinf(bound) else min(bound, self.max)
+        return self.max
+
+
+def count_figure_points(payload):
+    """Count the data points in every figure found in a callback response.
+
+    The response may be the callback's return value (Dash components,
+    plotly figures, dicts and lists) or its parsed JSON.
+    """
+    points = 0
+    stack = [payload]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, BaseFigure):
+            for trace in item.data:
+                points += max((_array_length(trace[key]) for key in TRACE_ARRAYS if key in trace), default=0)
+        elif isinstance(item, Component):
+            stack.extend(item.to_plotly_json()['props'].values())
+        elif isinstance(item, dict):
+            traces = item.get('data')
+            if isinstance(traces, list) and 'layout' in item:
+                for trace in traces:
+                    if isinstance(trace, dict):
+                        points += max((_array_length(trace.get(key)) for key in TRACE_ARRAYS), default=0)
+                continue
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+    return points
+
+
+def _array_length(value):
+    if isinstance(value, (list, tuple)):
+        return len(value)
+    if hasattr(value, 'shape') and hasattr(value, 'size'):
+        # NumPy arrays and pandas objects
+        return int(value.size)
+    if isinstance(value, dict) and 'bdata' in value:
+        # Plotly typed arrays: {'dtype': 'f8', 'bdata': <base64>, 'shape': ...}
+        if 'shape' in value:
+            return math.prod(int(n) for n in str(value['shape']).split(','))
+        itemsize = int(''.join(ch for ch in value.get('dtype', 'f8') if ch.isdigit()) or 8)
+        return len(value['bdata']) * 3 // 4 // itemsize
+    return 0
+
+
+class CallbackMetrics:
+    """Thread-safe per-callback histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._outcomes = {}
+
+    def observe(self, callback, outcome, **values):
+        with self._lock:
+            for metric, value in values.items():
+                key = (metric, callback)
+                if key not in self._histograms:
+                    self._histograms[key] = Histogram(METRICS[metric][2])
+                self._histograms[key].observe(value)
+            outcomes = self._outcomes.setdefault(callback, {})
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            for metric, (name, help_text, _) in METRICS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (observed, callback), histogram in sorted(self._histograms.items()):
+                    if observed != metric:
+                        continue
+                    label = f'callback="{callback}"'
+                    for bound, total in histogram.cumulative():
+                        le = '+Inf' if math.isinf(bound) else repr(float(bound))
+                        lines.append(f'{name}_bucket{{{label},le="{le}"}} {total}')
+                    lines.append(f'{name}_sum{{{label}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{label}}} {histogram.count}')
+            lines.append('# HELP dashboard_callback_calls_total Callback invocations by outcome')
+            lines.append('# TYPE dashboard_callback_calls_total counter')
+            for callback, outcomes in sorted(self._outcomes.items()):
+                for outcome, count in sorted(outcomes.items()):
+                    lines.append(f'dashboard_callback_calls_total{{callback="{callback}",outcome="{outcome}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        summary = {}
+        with self._lock:
+            for (metric, callback), histogram in self._histograms.items():
+                summary.setdefault(callback, {'calls': dict(self._outcomes.get(callback, {}))})[metric] = {
+                    'count': histogram.count,
+                    'mean': histogram.sum / histogram.count if histogram.count else None,
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95),
+                    'p99': histogram.quantile(0.99),
+                    'max': histogram.max,
+                }
+        return summary
+
+
+def _wrap(func, name, metrics):
+    def instrumented(*args, **kwargs):
+        wall_began, cpu_began = time.perf_counter(), time.thread_time()
+        outcome = 'ok'
+        response = None
+        _counted.points = None
+        try:
+            response = func(*args, **kwargs)
+            return response
+        except PreventUpdate:
+            outcome = 'prevented'
+            raise
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            values = {'wall_seconds': time.perf_counter() - wall_began,
+                      'cpu_seconds': time.thread_time() - cpu_began}
+            if response is not None:
+                body = response if isinstance(response, (str, bytes)) else json.dumps(response, default=str)
+                values['response_bytes'] = len(body.encode('utf-8') if isinstance(body, str) else body)
+            if _counted.points is not None:
+                values['figure_points'] = _counted.points
+            metrics.observe(name, outcome, **values)
+
+    instrumented.__name__ = name
+    instrumented.instrumented = True
+    return instrumented
+
+
+def _count_points(func):
+    """Wrap a callback function to count the figure points in what it returns."""
+    @functools.wraps(func)
+    def counted(*args, **kwargs):
+        response = func(*args, **kwargs)
+        _counted.points = count_figure_points(response)
+        return response
+    return counted
+
+
+def _outputs(args):
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            yield from _outputs(arg)
+        elif isinstance(arg, Output):
+            yield arg
+
+
+def _wrap_registered(app, metrics):
+    for output, entry in app.callback_map.items():
+        func = entry.get('callback')
+        # Clientside callbacks have no server function to time
+        if func is None or getattr(func, 'instrumented', False):
+            continue
+        name = getattr(func, '__name__', output)
+        entry['callback'] = _wrap(func, name, metrics)
+
+
+def instrument_callbacks(app, metrics=None):
+    """Wrap every callback declared on app and add the /metrics routes.
+
+    Call this before declaring the callbacks: figure points are counted by
+    wrapping the functions passed to app.callback. Callbacks declared
+    earlier are timed and sized but their points aren't counted. Each
+    worker process keeps its own metrics.
+    """
+    import flask
+
+    metrics = metrics or CallbackMetrics()
+    declare = app.callback
+
+    @functools.wraps(declare)
+    def callback(*args, **kwargs):
+        register = declare(*args, **kwargs)
+        figures = any(output.component_property in FIGURE_PROPERTIES
+                      for output in _outputs([*args, *kwargs.values()]))
+
+        def decorator(func):
+            registered = register(_count_points(func) if figures else func)
+            _wrap_registered(app, metrics)
+            return registered
+        return decorator
+
+    app.callback = callback
+    _wrap_registered(app, metrics)
+
+    def local_only():
+        if flask.request.remote_addr not in LOCAL_ADDRESSES:
+            flask.abort(404)
+
+    @app.server.route('/metrics')
+    def prometheus_metrics():
+        local_only()
+        return flask.Response(metrics.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+    @app.server.route('/metrics.json')
+    def metrics_summary():
+        local_only()
+        return flask.Response(json.dumps(metrics.summary(), indent=2), mimetype='application/json')
+
+    return metrics
@@ -1,39 +1,57 @@
+import time
+STARTUP_BEGAN = time.perf_counter()
+
 import dash
-from dash import dcc, html
+from dash import dcc, html, dash_table
 from dash.dependencies import Input, Output, State
 import plotly.express as px
 import plotly.graph_objects as go
-import pandas as pd
-import numpy as np
 from datetime import datetime
-import plotly.io as pio
-import io
 from dash.exceptions import PreventUpdate
-from fpdf import FPDF
 import os
-import tempfile
-import base64
+import functools
+import secrets
+import threading
+import flask
+from report_export import export_report, build_summary
+from policy_index import QueryError
+from callback_metrics import instrument_callbacks
+from figure_compaction import compact_figure, compact_graphs, enable_response_compression
+from dashboard_data import (DataStore, DataNotReady, StartupReport, files_fingerprint,
+                            load_dashboard_data, register_health_routes)
+
+startup_report = StartupReport(started=STARTUP_BEGAN)
+startup_report.mark('imports')
 
 # Initialize the Dash app
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 app.title = 'Insurance Analytics Dashboard'
+server = app.server
+# Record latency, payload size and figure points of every callback declared below; see /metrics
+instrument_callbacks(app)
+
+# Under a multi-worker server, attach to a dataset published once in shared
+# memory (see shared_dataset.py) instead of loading a copy per worker.
+SHARED_DATASET = os.environ.get('DASHBOARD_SHARED_DATASET')
+# 'exact' or 'approximate' (estimates with error bounds, see approximate.py);
+# the nav bar toggle switches per browser session
+QUERY_MODE = os.environ.get('DASHBOARD_QUERY_MODE', 'exact')
+if SHARED_DATASET:
+    from shared_dataset import attach_dataset, published_version
+    data_loader = functools.partial(attach_dataset, SHARED_DATASET)
+    data_fingerprint = functools.partial(published_version, SHARED_DATASET)
+else:
+    data_loader = load_dashboard_data
+    data_fingerprint = files_fingerprint
+
+# Load data in the background so the server can bind and answer health
+# checks straight away; pages render a placeholder until it is ready.
+# New data is picked up by the store's watcher without a restart.
+data_store = DataStore(data_loader, report=startup_report, fingerprint=data_fingerprint).start()
+register_health_routes(app.server, data_store)
 
-# Load data
-try:
-    df = pd.read_csv('data/processed/insurance_data.csv')
-    time_metrics = pd.read_csv('data/processed/time_metrics.csv')
-    region_metrics = pd.read_csv('data/processed/region_metrics.csv')
-    
-    # Convert date columns
-    time_metrics['policy_date'] = pd.to_datetime(time_metrics['policy_date'])
-    
-    # Calculate additional metrics
-    df['risk_score'] = df['claim_amount'] / df['annual_premium']
-    df['premium_category'] = pd.qcut(df['annual_premium'], q=4, labels=['Low', 'Medium', 'High', 'Premium'])
-    
-except Exception as e:
-    print(f"Error loading data: {e}")
-    raise
+# Figures and callback responses are large; compress them on the way out
+enable_response_compression(app.server)
 
 # Create reports directory if it doesn't exist
 if not os.path.exists('reports'):
@@ -48,18 +66,76 @@ nav_bar = html.Div([
         dcc.Link('Customer Analysis', href='/customer', className='nav-link'),
         dcc.Link('Risk Analysis', href='/risk', className='nav-link'),
         dcc.Link('Regional Analysis', href='/regional', className='nav-link'),
+        dcc.Link('Policy Explorer', href='/policies', className='nav-link'),
+        dcc.Link('Customer Lookup', href='/lookup', className='nav-link'),
     ], className='nav-links'),
     html.Div([
-        html.Button('Download Data (Excel)', id='download-button', className='export-button'),
+        dcc.RadioItems(
+            id='query-mode',
+            options=[
+                {'label': 'Exact', 'value': 'exact'},
+                {'label': 'Approximate', 'value': 'approximate'}
+            ],
+            value=QUERY_MODE,
+            inline=True,
+            className='query-mode'
+        ),
+        dcc.Dropdown(
+            id='export-format',
+            options=[
+                {'label': 'Excel', 'value': 'xlsx'},
+                {'label': 'CSV (zip)', 'value': 'csv'},
+                {'label': 'Parquet (zip)', 'value': 'parquet'}
+            ],
+            value='xlsx',
+            clearable=False,
+            searchable=False,
+            className='export-format'
+        ),
+        html.Button('Download Data', id='download-button', className='export-button'),
         html.Button('Export Dashboard (PDF)', id='export-pdf-button', className='export-button'),
-        dcc.Download(id='download-dataframe'),
+        dcc.Location(id='download-location', refresh=True),
         dcc.Download(id='download-pdf'),
         html.Div(id='pdf-status')
     ], className='nav-buttons')
 ], className='navbar')
 
 # Executive Summary Layout
-def create_executive_summary():
+def yoy_trend(change, suffix='YoY', points=False):
+    """Trend line for a KPI card from a year-over-year change (ratio, or rate points)."""
+    if change is None:
+        return html.P('– No prior year', className='trend-neutral')
+    value = change * 100
+    if abs(value) < 0.05:
+        return html.P('↔ Stable', className='trend-neutral')
+    arrow, className = ('↑', 'trend-up') if value > 0 else ('↓', 'trend-down')
+    unit = ' pts' if points else '%'
+    return html.P(f'{arrow} {abs(value):.1f}{unit} {suffix}', className=className)
+
+def confidence_interval(kpis, key, template):
+    """95% interval line for an approximate KPI value; exact values have none."""
+    interval = (kpis.get('ci') or {}).get(key)
+    if interval is None:
+        return None
+    low, high = interval
+    return html.P(f"95% CI {template.format(low)} – {template.format(high)}", className='metric-subtitle')
+
+# Charts are drawn from aggregates computed by the query backend (see
+# query_backend.py), never from the raw policy rows
+def box_figure(stats, x, title):
+    return go.Figure(go.Box(x=stats[x], q1=stats['q1'], median=stats['median'], q3=stats['q3'],
+                            lowerfence=stats['lowerfence'], upperfence=stats['upperfence'],
+                            mean=stats['mean'], boxpoints=False),
+                     layout=dict(title=title, template='plotly_dark'))
+
+def histogram_figure(bins, x, color, title):
+    bins = bins.assign(**{x: (bins['bin_start'] + bins['bin_end']) / 2})
+    figure = px.bar(bins, x=x, y='policies', color=color, title=title, template='plotly_dark')
+    return figure.update_layout(bargap=0, barmode='stack')
+
+def create_executive_summary(data):
+    queries, time_metrics = data.queries(), data.time_metrics
+    kpis = data.kpis()
     return html.Div([
         html.Div([
             html.H1('Executive Summary', className='dashboard-title'),
@@ -72,32 +148,35 @@ def create_executive_summary():
                 html.Div('💰', className='kpi-icon'),
                 html.H3('Total Premium'),
                 html.Div(className='kpi-separator'),
-                html.H4(f"${df['annual_premium'].sum():,.2f}"),
-                html.P('↑ 15% YoY', className='trend-up')
+                html.H4(f"${kpis['total_premium']:,.2f}"),
+                confidence_interval(kpis, 'total_premium', '${:,.0f}'),
+                yoy_trend(kpis['premium_yoy'])
             ], className='kpi-card'),
             
             html.Div([
                 html.Div('📊', className='kpi-icon'),
                 html.H3('Total Claims'),
                 html.Div(className='kpi-separator'),
-                html.H4(f"${df['claim_amount'].sum():,.2f}"),
-                html.P('↓ 8% YoY', className='trend-down')
+                html.H4(f"${kpis['total_claims']:,.2f}"),
+                confidence_interval(kpis, 'total_claims', '${:,.0f}'),
+                yoy_trend(kpis['claims_yoy'])
             ], className='kpi-card'),
             
             html.Div([
                 html.Div('⚠️', className='kpi-icon'),
                 html.H3('Fraud Rate'),
                 html.Div(className='kpi-separator'),
-                html.H4(f"{df['fraud_reported'].mean()*100:.1f}%"),
-                html.P('↔ Stable', className='trend-neutral')
+                html.H4(f"{kpis['fraud_rate']*100:.1f}%"),
+                confidence_interval(kpis, 'fraud_rate', '{:.1%}'),
+                yoy_trend(kpis['fraud_rate_yoy'], points=True)
             ], className='kpi-card'),
             
             html.Div([
                 html.Div('👥', className='kpi-icon'),
                 html.H3('Active Policies'),
                 html.Div(className='kpi-separator'),
-                html.H4(f"{len(df):,}"),
-                html.P('↑ 12% YoY', className='trend-up')
+                html.H4(f"{kpis['policies']:,}"),
+                yoy_trend(kpis['policies_yoy'])
             ], className='kpi-card'),
         ], className='kpi-row'),
         
@@ -127,8 +206,9 @@ def create_executive_summary():
         html.Div([
             html.Div([
                 dcc.Graph(
-                    figure=px.pie(df, 
+                    figure=px.pie(queries.counts('premium_category'),
                                 names='premium_category',
+                                values='policies',
                                 title='Premium Distribution',
                                 template='plotly_dark',
                                 hole=0.4)
@@ -136,18 +216,17 @@ def create_executive_summary():
             ], className='chart-container'),
             html.Div([
                 dcc.Graph(
-                    figure=px.box(df,
-                                x='customer_segment',
-                                y='annual_premium',
-                                title='Premium by Customer Segment',
-                                template='plotly_dark')
+                    figure=box_figure(queries.box_stats('annual_premium', 'customer_segment'),
+                                      'customer_segment', 'Premium by Customer Segment')
                 )
             ], className='chart-container'),
         ], className='chart-row'),
     ])
 
 # Customer Analysis Layout
-def create_customer_analysis():
+def create_customer_analysis(data):
+    queries = data.queries()
+    kpis = data.kpis()
     return html.Div([
         html.Div([
             html.H1('Customer Analysis', className='dashboard-title'),
@@ -160,7 +239,8 @@ def create_customer_analysis():
                 html.Div('💎', className='kpi-icon'),
                 html.H3('Average Premium'),
                 html.Div(className='kpi-separator'),
-                html.H4(f"${df['annual_premium'].mean():,.2f}"),
+                html.H4(f"${kpis['avg_premium']:,.2f}"),
+                confidence_interval(kpis, 'avg_premium', '${:,.2f}'),
                 html.P('Per Customer', className='metric-subtitle')
             ], className='kpi-card'),
             
@@ -168,7 +248,7 @@ def create_customer_analysis():
                 html.Div('🎯', className='kpi-icon'),
                 html.H3('Customer Segments'),
                 html.Div(className='kpi-separator'),
-                html.H4(f"{len(df['customer_segment'].unique())}"),
+                html.H4(f"{kpis['segments']}"),
                 html.P('Active Segments', className='metric-subtitle')
             ], className='kpi-card'),
             
@@ -176,7 +256,8 @@ def create_customer_analysis():
                 html.Div('👑', className='kpi-icon'),
                 html.H3('Premium Customers'),
                 html.Div(className='kpi-separator'),
-                html.H4(f"{len(df[df['premium_category'] == 'Premium']):,}"),
+                html.H4(f"{kpis['premium_customers']:,}"),
+                confidence_interval(kpis, 'premium_customers', '{:,.0f}'),
                 html.P('Top Tier', className='metric-subtitle')
             ], className='kpi-card'),
         ], className='kpi-row'),
@@ -185,22 +266,17 @@ def create_customer_analysis():
         html.Div([
             html.Div([
                 dcc.Graph(
-                    figure=px.pie(df, 
+                    figure=px.pie(queries.counts('customer_segment'),
                                 names='customer_segment',
+                                values='policies',
                                 title='Customer Segments Distribution',
                                 template='plotly_dark',
                                 hole=0.4)
                 )
             ], className='chart-container'),
             html.Div([
-                dcc.Graph(
-                    figure=px.scatter(df.sample(1000),
-                                    x='annual_premium',
-                                    y='claim_amount',
-                                    color='customer_segment',
-                                    title='Customer Behavior Analysis',
-                                    template='plotly_dark')
-                )
+                # Filled from a stratified sample sized to the viewport
+                dcc.Graph(id='customer-behavior-scatter')
             ], className='chart-container'),
         ], className='chart-row'),
         
@@ -208,27 +284,24 @@ def create_customer_analysis():
         html.Div([
             html.Div([
                 dcc.Graph(
-                    figure=px.histogram(df,
-                                      x='annual_premium',
-                                      color='customer_segment',
-                                      title='Premium Distribution by Segment',
-                                      template='plotly_dark')
+                    figure=histogram_figure(queries.histogram('annual_premium', 'customer_segment'),
+                                            'annual_premium', 'customer_segment',
+                                            'Premium Distribution by Segment')
                 )
             ], className='chart-container'),
             html.Div([
                 dcc.Graph(
-                    figure=px.box(df,
-                                x='customer_segment',
-                                y='claim_amount',
-                                title='Claims by Customer Segment',
-                                template='plotly_dark')
+                    figure=box_figure(queries.box_stats('claim_amount', 'customer_segment'),
+                                      'customer_segment', 'Claims by Customer Segment')
                 )
             ], className='chart-container'),
         ], className='chart-row'),
     ])
 
 # Risk Analysis Layout
-def create_risk_analysis():
+def create_risk_analysis(data):
+    queries, time_metrics = data.queries(), data.time_metrics
+    kpis = data.kpis()
     return html.Div([
         html.Div([
             html.H1('Risk Analysis', className='dashboard-title'),
@@ -241,7 +314,8 @@ def create_risk_analysis():
                 html.Div('📈', className='kpi-icon'),
                 html.H3('Average Risk Score'),
                 html.Div(className='kpi-separator'),
-                html.H4(f"{df['risk_score'].mean():.2f}"),
+                html.H4(f"{kpis['avg_risk_score']:.2f}"),
+                confidence_interval(kpis, 'avg_risk_score', '{:.2f}'),
                 html.P('Overall', className='metric-subtitle')
             ], className='kpi-card'),
             
@@ -249,7 +323,8 @@ def create_risk_analysis():
                 html.Div('⚡', className='kpi-icon'),
                 html.H3('High Risk Cases'),
                 html.Div(className='kpi-separator'),
-                html.H4(f"{len(df[df['risk_score'] > df['risk_score'].quantile(0.75)]):,}"),
+                html.H4(f"{kpis['high_risk_customers']:,}"),
+                confidence_interval(kpis, 'high_risk_customers', '{:,.0f}'),
                 html.P('Top 25%', className='metric-subtitle')
             ], className='kpi-card'),
             
@@ -257,7 +332,8 @@ def create_risk_analysis():
                 html.Div('🚨', className='kpi-icon'),
                 html.H3('Fraud Cases'),
                 html.Div(className='kpi-separator'),
-                html.H4(f"{df['fraud_reported'].sum():,}"),
+                html.H4(f"{kpis['fraud_count']:,}"),
+                confidence_interval(kpis, 'fraud_count', '{:,.0f}'),
                 html.P('Total Reported', className='metric-subtitle')
             ], className='kpi-card'),
         ], className='kpi-row'),
@@ -266,7 +342,7 @@ def create_risk_analysis():
         html.Div([
             html.Div([
                 dcc.Graph(
-                    figure=px.scatter(df,
+                    figure=px.scatter(data.sample(LARGEST_SAMPLE_SIZE),
                                     x='annual_premium',
                                     y='claim_amount',
                                     color='fraud_reported',
@@ -276,11 +352,8 @@ def create_risk_analysis():
             ], className='chart-container'),
             html.Div([
                 dcc.Graph(
-                    figure=px.histogram(df,
-                                      x='risk_score',
-                                      color='fraud_reported',
-                                      title='Risk Score Distribution',
-                                      template='plotly_dark')
+                    figure=histogram_figure(queries.histogram('risk_score', 'fraud_reported'),
+                                            'risk_score', 'fraud_reported', 'Risk Score Distribution')
                 )
             ], className='chart-container'),
         ], className='chart-row'),
@@ -289,11 +362,8 @@ def create_risk_analysis():
         html.Div([
             html.Div([
                 dcc.Graph(
-                    figure=px.box(df,
-                                x='customer_segment',
-                                y='risk_score',
-                                title='Risk by Customer Segment',
-                                template='plotly_dark')
+                    figure=box_figure(queries.box_stats('risk_score', 'customer_segment'),
+                                      'customer_segment', 'Risk by Customer Segment')
                 )
             ], className='chart-container'),
             html.Div([
@@ -309,7 +379,10 @@ def create_risk_analysis():
     ])
 
 # Regional Analysis Layout
-def create_regional_analysis():
+def create_regional_analysis(data):
+    queries, region_metrics = data.queries(), data.region_metrics
+    kpis = data.kpis()
+    region_means = queries.means('region', ['annual_premium', 'claim_amount', 'fraud_reported'])
     return html.Div([
         html.Div([
             html.H1('Regional Analysis', className='dashboard-title'),
@@ -322,7 +395,7 @@ def create_regional_analysis():
                 html.Div('🏆', className='kpi-icon'),
                 html.H3('Top Region'),
                 html.Div(className='kpi-separator'),
-                html.H4(region_metrics.loc[region_metrics['total_premium'].idxmax(), 'region']),
+                html.H4(kpis['top_region']),
                 html.P('By Premium', className='metric-subtitle')
             ], className='kpi-card'),
             
@@ -330,7 +403,7 @@ def create_regional_analysis():
                 html.Div('🌍', className='kpi-icon'),
                 html.H3('Regional Coverage'),
                 html.Div(className='kpi-separator'),
-                html.H4(f"{len(df['region'].unique())}"),
+                html.H4(f"{kpis['regions']}"),
                 html.P('Active Regions', className='metric-subtitle')
             ], className='kpi-card'),
             
@@ -338,8 +411,9 @@ def create_regional_analysis():
                 html.Div('🚀', className='kpi-icon'),
                 html.H3('Regional Growth'),
                 html.Div(className='kpi-separator'),
-                html.H4('15.2%'),
-                html.P('Year over Year', className='metric-subtitle')
+                html.H4(f"{kpis['top_region_premium_yoy']*100:+.1f}%"
+                        if kpis['top_region_premium_yoy'] is not None else 'n/a'),
+                html.P(f"{kpis['top_region']} premium, year over year", className='metric-subtitle')
             ], className='kpi-card'),
         ], className='kpi-row'),
         
@@ -356,7 +430,7 @@ def create_regional_analysis():
             ], className='chart-container'),
             html.Div([
                 dcc.Graph(
-                    figure=px.pie(df.groupby('region')['fraud_reported'].mean().reset_index(),
+                    figure=px.pie(region_means,
                                 values='fraud_reported',
                                 names='region',
                                 title='Fraud Distribution by Region',
@@ -369,20 +443,13 @@ def create_regional_analysis():
         html.Div([
             html.Div([
                 dcc.Graph(
-                    figure=px.box(df,
-                                x='region',
-                                y='annual_premium',
-                                title='Premium Distribution by Region',
-                                template='plotly_dark')
+                    figure=box_figure(queries.box_stats('annual_premium', 'region'),
+                                      'region', 'Premium Distribution by Region')
                 )
             ], className='chart-container'),
             html.Div([
                 dcc.Graph(
-                    figure=px.scatter(df.groupby('region').agg({
-                        'annual_premium': 'mean',
-                        'claim_amount': 'mean',
-                        'fraud_reported': 'mean'
-                    }).reset_index(),
+                    figure=px.scatter(region_means,
                         x='annual_premium',
                         y='claim_amount',
                         size='fraud_reported',
@@ -394,116 +461,325 @@ def create_regional_analysis():
         ], className='chart-row'),
     ])
 
+# Policy explorer: a paged, filterable and sortable table of individual policies
+# Columns shown in the policy explorer, with their display names
+POLICY_COLUMNS = [
+    ('customer_id', 'Customer ID'), ('policy_date', 'Policy Date'), ('customer_segment', 'Segment'),
+    ('region', 'Region'), ('policy_type', 'Policy Type'), ('policy_status', 'Status'),
+    ('age', 'Age'), ('annual_premium', 'Annual Premium'), ('claim_amount', 'Claim Amount'),
+    ('fraud_reported', 'Fraud'), ('risk_score', 'Risk Score'), ('premium_category', 'Premium Category'),
+]
+POLICY_PAGE_SIZE = 25
+
+def create_policy_explorer(data):
+    numeric = data.queries().numeric_columns()
+    return html.Div([
+        html.Div([
+            html.H1('Policy Explorer', className='dashboard-title'),
+            html.P('Browse, filter and sort individual policies', className='dashboard-description')
+        ], className='header'),
+
+        html.Div(id='policy-table-status', className='metric-subtitle'),
+        # Paging, sorting and filtering all run on the server (see policy_index.py
+        # and query_backend.py)
+        dash_table.DataTable(
+            id='policy-table',
+            columns=[{'name': name, 'id': column, 'type': 'numeric' if column in numeric else 'text'}
+                     for column, name in POLICY_COLUMNS],
+            page_current=0,
+            page_size=POLICY_PAGE_SIZE,
+            page_action='custom',
+            sort_action='custom',
+            sort_mode='multi',
+            sort_by=[],
+            filter_action='custom',
+            filter_query='',
+            style_table={'overflowX': 'auto'},
+            style_header={'backgroundColor': '#2c3e50', 'color': 'white', 'fontWeight': 'bold'},
+            style_cell={'backgroundColor': '#1e1e1e', 'color': '#ecf0f1', 'border': '1px solid #444'},
+        ),
+    ], className='chart-container')
+
+CUSTOMER_DETAIL_FIELDS = [
+    ('customer_id', 'Customer ID'), ('age', 'Age'), ('policy_date', 'Policy Date'),
+    ('policy_type', 'Policy Type'), ('policy_status', 'Status'), ('payment_method', 'Payment Method'),
+    ('customer_segment', 'Segment'), ('region', 'Region'), ('customer_tenure', 'Tenure (years)'),
+    ('annual_premium', 'Annual Premium'), ('premium_category', 'Premium Category'),
+    ('claim_amount', 'Claim Amount'), ('previous_claims', 'Previous Claims'),
+    ('fraud_reported', 'Fraud Reported'), ('risk_score', 'Risk Score'),
+]
+
+def create_customer_lookup(data):
+    return html.Div([
+        html.Div([
+            html.H1('Customer Lookup', className='dashboard-title'),
+            html.P('Find a customer by ID, e.g. CUS000123', className='dashboard-description')
+        ], className='header'),
+
+        html.Div([
+            dcc.Input(id='customer-lookup-id', type='text', placeholder='Customer ID',
+                      debounce=True, className='customer-lookup-input'),
+        ], className='kpi-row'),
+        html.Div(id='customer-detail', className='chart-container'),
+    ])
+
+# Placeholder shown while the data is still loading
+def create_loading_page():
+    return html.Div([
+        html.Div([
+            html.H1('Loading Data', className='dashboard-title'),
+            html.P('The dashboard will appear as soon as the data has loaded.',
+                   className='dashboard-description')
+        ], className='header')
+    ])
+
+def create_error_page(message):
+    return html.Div([
+        html.Div([
+            html.H1('Data Unavailable', className='dashboard-title'),
+            html.P(message, className='dashboard-description')
+        ], className='header')
+    ])
+
 # Main App Layout
 app.layout = html.Div([
     nav_bar,
     dcc.Location(id='url', refresh=False),
+    dcc.Interval(id='data-ready-poll', interval=1000),
+    dcc.Store(id='viewport'),
     html.Div(id='page-content', className='content')
 ], className='dashboard-container')
 
 # Callback to handle page routing
 @app.callback(
-    Output('page-content', 'children'),
-    [Input('url', 'pathname')]
+    [Output('page-content', 'children'),
+     Output('data-ready-poll', 'disabled')],
+    [Input('url', 'pathname'),
+     Input('data-ready-poll', 'n_intervals'),
+     Input('query-mode', 'value')]
 )
-def display_page(pathname):
+def display_page(pathname, n_intervals, query_mode):
+    try:
+        data = data_store.get()
+    except DataNotReady as e:
+        # The store retries a failed load only once the files change, so show why and stop polling
+        if data_store.status()['status'] == 'failed':
+            return create_error_page(str(e)), True
+        return create_loading_page(), False
+
     if pathname == '/customer':
-        return create_customer_analysis()
+        page = create_customer_analysis
     elif pathname == '/risk':
-        return create_risk_analysis()
+        page = create_risk_analysis
     elif pathname == '/regional':
-        return create_regional_analysis()
+        page = create_regional_analysis
+    elif pathname == '/policies':
+        page = create_policy_explorer
+    elif pathname == '/lookup':
+        page = create_customer_lookup
     else:
-        return create_executive_summary()
+        page = create_executive_summary
+
+    # Approximate pages answer from samples and sketches, with error bounds
+    view = data.approximate() if query_mode == 'approximate' else data
+
+    # Pages only depend on the data, so build each one once per data version and mode,
+    # with figure arrays trimmed to display precision and binary-encoded
+    return data.memo(('page', page.__name__, query_mode == 'approximate'),
+                     lambda: compact_graphs(page(view))), True
+
+# Scatter plots use a precomputed stratified sample (see sampling.py) sized
+# to the browser window rather than a fresh random sample per render
+SAMPLE_SIZE_BY_WIDTH = [(768, 500), (1280, 1000), (1920, 2000)]
+LARGEST_SAMPLE_SIZE = 5000
+
+def sample_size_for_viewport(viewport):
+    width = (viewport or {}).get('width') or 1280
+    for max_width, size in SAMPLE_SIZE_BY_WIDTH:
+        if width < max_width:
+            return size
+    return LARGEST_SAMPLE_SIZE
+
+app.clientside_callback(
+    """
+    function(pathname) {
+        return {width: window.innerWidth, height: window.innerHeight};
+    }
+    """,
+    Output('viewport', 'data'),
+    Input('url', 'pathname')
+)
 
-# Callback for Excel export
 @app.callback(
-    Output('download-dataframe', 'data'),
+    Output('customer-behavior-scatter', 'figure'),
+    Input('viewport', 'data')
+)
+def update_customer_scatter(viewport):
+    try:
+        data = data_store.get()
+    except DataNotReady:
+        raise PreventUpdate
+
+    size = sample_size_for_viewport(viewport)
+    return data.memo(('customer-scatter', size), lambda: compact_figure(
+        px.scatter(data.sample(size),
+                   x='annual_premium',
+                   y='claim_amount',
+                   color='customer_segment',
+                   title='Customer Behavior Analysis',
+                   template='plotly_dark')))
+
+@app.callback(
+    [Output('policy-table', 'data'),
+     Output('policy-table', 'page_count'),
+     Output('policy-table-status', 'children')],
+    [Input('policy-table', 'page_current'),
+     Input('policy-table', 'page_size'),
+     Input('policy-table', 'sort_by'),
+     Input('policy-table', 'filter_query')]
+)
+def update_policy_table(page_current, page_size, sort_by, filter_query):
+    try:
+        data = data_store.get()
+    except DataNotReady:
+        raise PreventUpdate
+
+    try:
+        page, total = data.queries().page(page_current or 0, page_size, sort_by, filter_query,
+                                          [column for column, _ in POLICY_COLUMNS])
+    except QueryError as e:
+        return [], 0, f"Filter not applied: {e}"
+
+    for column in page.select_dtypes('datetime').columns:
+        page[column] = page[column].dt.strftime('%Y-%m-%d')
+    records = page.astype(object).where(page.notna(), None).to_dict('records')
+    page_count = max(1, -(-total // page_size))
+    return records, page_count, f"{total:,} matching policies"
+
+def format_detail(value):
+    if isinstance(value, float):
+        return f"{value:,.2f}"
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+@app.callback(
+    Output('customer-detail', 'children'),
+    Input('customer-lookup-id', 'value')
+)
+def show_customer_detail(customer_id):
+    if not customer_id:
+        raise PreventUpdate
+    try:
+        data = data_store.get()
+    except DataNotReady:
+        raise PreventUpdate
+
+    # Answered from the customer_id hash index (see customer_index.py), not a table scan
+    customer_id = customer_id.strip().upper()
+    record = data.customer_record(customer_id)
+    if record is None:
+        return html.P(f"No customer with ID {customer_id}", className='metric-subtitle')
+
+    return html.Table([
+        html.Tr([html.Th(label), html.Td(format_detail(record[field]))])
+        for field, label in CUSTOMER_DETAIL_FIELDS if field in record
+    ], className='customer-detail-table')
+
+# Exports are written to temporary files and handed to the browser through
+# a streaming route, so the callback response never carries the file itself.
+EXPORT_TTL_SECONDS = 600
+EXPORT_STREAM_BLOCK = 1024 * 1024
+pending_exports = {}
+pending_exports_lock = threading.Lock()
+
+def remove_export(path):
+    """Delete an export file that is no longer needed, if it is still there."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def expire_pending_exports():
+    """Remove exports that were never downloaded."""
+    cutoff = time.time() - EXPORT_TTL_SECONDS
+    with pending_exports_lock:
+        expired = [token for token, entry in pending_exports.items() if entry['created'] < cutoff]
+        for token in expired:
+            remove_export(pending_exports.pop(token)['path'])
+
+def register_export(path, download_name, mimetype):
+    """Register a finished export file and return its download URL."""
+    token = secrets.token_urlsafe(16)
+    with pending_exports_lock:
+        pending_exports[token] = {
+            'path': path,
+            'download_name': download_name,
+            'mimetype': mimetype,
+            'created': time.time()
+        }
+    return f'/download/{token}'
+
+@app.server.route('/download/<token>')
+def serve_export(token):
+    with pending_exports_lock:
+        entry = pending_exports.pop(token, None)
+    if entry is None or not os.path.exists(entry['path']):
+        flask.abort(404)
+
+    def stream_file(path):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(EXPORT_STREAM_BLOCK), b''):
+                yield block
+
+    response = flask.Response(
+        stream_file(entry['path']),
+        mimetype=entry['mimetype'],
+        headers={
+            'Content-Disposition': f"attachment; filename={entry['download_name']}",
+            'Content-Length': str(os.path.getsize(entry['path']))
+        }
+    )
+    # The token is gone, so the file is removed when the response closes,
+    # whether or not it was streamed
+    response.call_on_close(functools.partial(remove_export, entry['path']))
+    return response
+
+# Callback for data export
+@app.callback(
+    Output('download-location', 'href'),
     Input('download-button', 'n_clicks'),
+    State('export-format', 'value'),
     prevent_initial_call=True
 )
-def download_report(n_clicks):
+def download_report(n_clicks, export_format):
     if n_clicks is None:
         raise PreventUpdate
 
     try:
-        # Create timestamp for filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Create Excel writer
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter', mode='xlsx') as writer:
-            # Write each DataFrame
-            df.to_excel(writer, sheet_name='Insurance Data', index=False)
-            time_metrics.to_excel(writer, sheet_name='Time Series', index=False)
-            region_metrics.to_excel(writer, sheet_name='Regional Data', index=False)
-            
-            # Create summary sheet
-            summary_data = {
-                'Metric': [
-                    'Total Premium',
-                    'Total Claims',
-                    'Fraud Rate',
-                    'Number of Policies',
-                    'Average Premium',
-                    'Average Claim'
-                ],
-                'Value': [
-                    f"${df['annual_premium'].sum():,.2f}",
-                    f"${df['claim_amount'].sum():,.2f}",
-                    f"{df['fraud_reported'].mean()*100:.1f}%",
-                    f"{len(df):,}",
-                    f"${df['annual_premium'].mean():,.2f}",
-                    f"${df['claim_amount'].mean():,.2f}"
-                ]
-            }
-            pd.DataFrame(summary_data).to_excel(writer, sheet_name='Summary', index=False)
-            
-            # Get workbook and format it
-            workbook = writer.book
-            
-            # Add a format for headers
-            header_format = workbook.add_format({
-                'bold': True,
-                'font_color': 'white',
-                'bg_color': '#2c3e50',
-                'border': 1
-            })
-            
-            # Format each worksheet
-            for worksheet in writer.sheets.values():
-                # Set column widths
-                worksheet.set_column('A:Z', 15)
-                
-                # Write the header row with formatting
-                worksheet.set_row(0, None, header_format)
-
-        # Prepare the file for download
-        output.seek(0)
-        
-        return dcc.send_bytes(
-            output.getvalue(),
-            f'insurance_report_{timestamp}.xlsx'
-        )
-        
+        data = data_store.get()
+    except DataNotReady:
+        raise PreventUpdate
+    # With the SQL backend this reads the table out of the database
+    df = data.frame()
+
+    expire_pending_exports()
+    sheets = {
+        'Insurance Data': df,
+        'Time Series': data.time_metrics,
+        'Regional Data': data.region_metrics,
+        'Summary': build_summary(df)
+    }
+
+    try:
+        return register_export(*export_report(sheets, export_format or 'xlsx', directory='temp'))
+
     except Exception as e:
-        print(f"Error in Excel export: {e}")
-        # Fallback to CSV export
+        print(f"Error in {export_format} export: {e}")
+        # Fallback to CSV export of the summary
         try:
-            df_summary = pd.DataFrame({
-                'Metric': ['Total Premium', 'Total Claims', 'Fraud Rate'],
-                'Value': [
-                    f"${df['annual_premium'].sum():,.2f}",
-                    f"${df['claim_amount'].sum():,.2f}",
-                    f"{df['fraud_reported'].mean()*100:.1f}%"
-                ]
-            })
-            return dcc.send_data_frame(
-                df_summary.to_csv,
-                f'insurance_summary_{timestamp}.csv',
-                index=False
-            )
-        except:
+            return register_export(*export_report({'Summary': build_summary(df)}, 'csv', directory='temp'))
+        except Exception:
             print("Failed to generate backup CSV")
             raise PreventUpdate
 
@@ -518,6 +794,15 @@ def export_dashboard_pdf(n_clicks):
         raise PreventUpdate
 
     try:
+        data = data_store.get()
+    except DataNotReady:
+        raise PreventUpdate
+    queries, time_metrics, region_metrics = data.queries(), data.time_metrics, data.region_metrics
+
+    try:
+        # fpdf and the image export stack are only needed here, so load them on first use
+        from fpdf import FPDF
+
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f'dashboard_report_{timestamp}.pdf'
         
@@ -542,12 +827,13 @@ def export_dashboard_pdf(n_clicks):
                    x='policy_date', 
                    y=['monthly_premium', 'monthly_claims'],
                    title='Premium vs Claims Trend'),
-            px.pie(df, 
+            px.pie(queries.counts('customer_segment'),
                   names='customer_segment',
+                  values='policies',
                   title='Customer Segments'),
             
             # Risk Analysis
-            px.scatter(df,
+            px.scatter(data.sample(LARGEST_SAMPLE_SIZE),
                       x='annual_premium',
                       y='claim_amount',
                       color='fraud_reported',
@@ -595,6 +881,8 @@ def export_dashboard_pdf(n_clicks):
         traceback.print_exc()
         raise PreventUpdate
 
+startup_report.mark('app ready')
+
 if __name__ == '__main__':
     print("Starting dashboard server...")
     print("Visit http://127.0.0.1:8050/ in your web browser")
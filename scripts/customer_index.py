@@ -0,0 +1,206 @@
+"""
+Persistent hash index from customer_id to row position.
+Customer ids are hashed into a power-of-two number of buckets laid out in
+CSR form: bucket_offsets[b]:bucket_offsets[b + 1] is the slice of the entry
+arrays for bucket b, holding each entry's hash fingerprint, row position and
+the byte offset of its line in insurance_data.csv. The arrays are stored as
+.npy files and memory-mapped, so a lookup touches a handful of pages instead
+of filtering the table, and a single row can be read from the CSV directly.
+
+Usage:
+    python scripts/customer_index.py [--data-dir data/processed]
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from dashboard_data import data_version
+from dataset_schema import load_table
+
+INDEX_DIR = 'customer_index'
+SOURCE_FILE = 'insurance_data.csv'
+KEY_COLUMN = 'customer_id'
+INDEX_FORMAT = 1
+ARRAYS = ['bucket_offsets', 'fingerprints', 'rows', 'byte_offsets']
+SCAN_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+FNV_OFFSET = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+
+
+def hash_ids(customer_ids):
+    """64-bit FNV-1a hashes of the ids' UTF-8 bytes, vectorized over byte positions."""
+    encoded = np.char.encode(np.asarray(customer_ids, dtype=str), 'utf-8')
+    lengths = np.char.str_len(encoded)
+    width = encoded.dtype.itemsize
+    data = encoded.view(np.uint8).reshape(len(encoded), width) if width else np.empty((len(encoded), 0), np.uint8)
+    hashes = np.full(len(encoded), FNV_OFFSET, dtype=np.uint64)
+    prime = np.uint64(FNV_PRIME)
+    with np.errstate(over='ignore'):
+        for position in range(width):
+            # Bytes past the end of a shorter id are padding and are skipped
+            mixed = (hashes ^ data[:, position]) * prime
+            hashes = np.where(position < lengths, mixed, hashes)
+    return hashes
+
+
+def hash_id(customer_id):
+    """hash_ids() for a single id, without numpy overhead."""
+    value = FNV_OFFSET
+    for byte in customer_id.encode('utf-8'):
+        value = ((value ^ byte) * FNV_PRIME) & 0xFFFFFFFFFFFFFFFF
+    return value
+
+
+def line_offsets(path):
+    """Byte offset of every data line of a CSV (after the header), scanning in blocks.
+
+    Assumes no quoted field contains a newline, which holds for the
+    processed datasets.
+    """
+    starts = []
+    position = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(SCAN_BLOCK_BYTES)
+            if not block:
+                break
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+            starts.append(newlines + position + 1)
+            position += len(block)
+    starts = np.concatenate(starts) if starts else np.empty(0, dtype=np.int64)
+    # The first line is the header; a trailing newline does not start a row
+    return starts[starts < position].astype(np.uint64)
+
+
+def build_arrays(customer_ids, byte_offsets=None):
+    """Lay the ids out as a bucketed CSR hash table."""
+    hashes = hash_ids(customer_ids)
+    n = len(hashes)
+    n_buckets = 1 << max(0, (max(n, 2) // 2 - 1).bit_length())
+    buckets = (hashes & np.uint64(n_buckets - 1)).astype(np.int64)
+    order = np.argsort(buckets, kind='stable')
+
+    bucket_offsets = np.zeros(n_buckets + 1, dtype=np.uint32 if n < 2 ** 32 else np.uint64)
+    bucket_offsets[1:] = np.cumsum(np.bincount(buckets, minlength=n_buckets))
+    return {
+        'bucket_offsets': bucket_offsets,
+        # The low bits already chose the bucket; the high bits tell entries apart
+        'fingerprints': (hashes[order] >> np.uint64(32)).astype(np.uint32),
+        'rows': order.astype(np.uint32 if n < 2 ** 32 else np.uint64),
+        'byte_offsets': (np.asarray(byte_offsets)[order] if byte_offsets is not None
+                         else np.zeros(n, dtype=np.uint64)),
+    }
+
+
+class CustomerIndex:
+    """Look customer ids up in the hash table; ids are verified against the data."""
+
+    def __init__(self, arrays, source=None, rows=None):
+        self.bucket_offsets = arrays['bucket_offsets']
+        self.fingerprints = arrays['fingerprints']
+        self.rows = arrays['rows']
+        self.byte_offsets = arrays['byte_offsets']
+        self.mask = len(self.bucket_offsets) - 2
+        self.source = source
+        self.n_rows = rows if rows is not None else len(self.rows)
+        self._header = None
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build an in-memory index for a loaded frame (no byte offsets)."""
+        return cls(build_arrays(df[KEY_COLUMN].to_numpy()))
+
+    def candidates(self, customer_id):
+        """Row positions whose id hashes like customer_id."""
+        value = hash_id(customer_id)
+        bucket = value & self.mask
+        start, stop = int(self.bucket_offsets[bucket]), int(self.bucket_offsets[bucket + 1])
+        matches = np.flatnonzero(self.fingerprints[start:stop] == np.uint32(value >> 32))
+        return [(int(self.rows[start + i]), int(self.byte_offsets[start + i])) for i in matches]
+
+    def lookup(self, customer_id, ids):
+        """Row position of customer_id, checked against the id column ids, or None."""
+        for row, _ in self.candidates(customer_id):
+            if ids[row] == customer_id:
+                return row
+        return None
+
+    def read_row(self, customer_id):
+        """Read one customer's row straight from the CSV without loading the table."""
+        if self.source is None:
+            raise ValueError("This index was not built from a file")
+        with open(self.source, 'rb') as f:
+            if self._header is None:
+                self._header = next(csv.reader([f.readline().decode('utf-8')]))
+            for _, offset in self.candidates(customer_id):
+                f.seek(offset)
+                values = next(csv.reader([f.readline().decode('utf-8')]))
+                record = dict(zip(self._header, values))
+                if record.get(KEY_COLUMN) == customer_id:
+                    return record
+        return None
+
+
+def write_customer_index(data_dir='data/processed'):
+    """Build the index for the current insurance_data.csv and store it memory-mappable."""
+    from features import FEATURES
+
+    source = os.path.join(data_dir, SOURCE_FILE)
+    version = data_version(source)
+    customer_ids = load_table(data_dir, 'insurance_data', usecols=[KEY_COLUMN], ignore=FEATURES)[KEY_COLUMN]
+    offsets = line_offsets(source)
+    if len(offsets) != len(customer_ids):
+        raise ValueError(f"{SOURCE_FILE} has {len(offsets):,} lines but {len(customer_ids):,} rows; "
+                         "multi-line fields are not supported")
+    if customer_ids.duplicated().any():
+        print(f"Warning: {customer_ids.duplicated().sum():,} duplicate customer ids; lookups return the first")
+
+    index_dir = os.path.join(data_dir, INDEX_DIR)
+    tmp_dir = index_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    arrays = build_arrays(customer_ids.to_numpy(), offsets)
+    for name in ARRAYS:
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), arrays[name])
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump({'format': INDEX_FORMAT, 'data_version': version, 'rows': len(customer_ids),
+                   'buckets': len(arrays['bucket_offsets']) - 1}, f, indent=2)
+
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+    print(f"Customer index written for data version {version}: {len(customer_ids):,} ids")
+    return version
+
+
+def load_customer_index(data_dir='data/processed', version=None):
+    """Memory-map the stored index, or return None if it doesn't match the current data."""
+    index_dir = os.path.join(data_dir, INDEX_DIR)
+    manifest_path = os.path.join(index_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    source = os.path.join(data_dir, SOURCE_FILE)
+    if manifest['format'] != INDEX_FORMAT or manifest['data_version'] != (version or data_version(source)):
+        return None
+    arrays = {name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+    return CustomerIndex(arrays, source=source, rows=manifest['rows'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default='data/processed')
+    args = parser.parse_args()
+    write_customer_index(args.data_dir)
+
+
+if __name__ == "__main__":
+    main()
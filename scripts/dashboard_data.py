@@ -0,0 +1,404 @@
+"""
+Deferred data loading for the dashboards.
+Processed datasets are read on a background thread so the web server can
+bind and answer health checks immediately, while pages wait for readiness.
+A watcher reloads the data when the processed files change and swaps in a
+new versioned snapshot; requests already running keep the one they started on.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DATA_DIR = os.environ.get('INSURANCE_DATA_DIR', 'data/processed')
+DASHBOARD_FILES = ['insurance_data.csv', 'time_metrics.csv', 'region_metrics.csv']
+RELOAD_INTERVAL = float(os.environ.get('DASHBOARD_RELOAD_INTERVAL', 30))
+# 'pandas' loads the policy table into memory; 'sqlite' answers the pages'
+# aggregations from the embedded database built by query_backend.py
+QUERY_BACKEND = os.environ.get('DASHBOARD_QUERY_BACKEND', 'pandas')
+VERSION_BLOCK_BYTES = 1024 * 1024
+
+
+class DataNotReady(Exception):
+    """Raised when the dashboard data has not finished loading."""
+
+
+class StartupReport:
+    """Record how long each startup phase takes, relative to process start."""
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.milestones = {}
+        self.durations = {}
+
+    def mark(self, name):
+        """Record that a startup milestone has been reached."""
+        self.milestones[name] = round(time.perf_counter() - self.started, 3)
+
+    @contextmanager
+    def timed(self, name):
+        """Time a single loading step."""
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = round(time.perf_counter() - began, 3)
+
+    def as_dict(self):
+        return {'milestones': dict(self.milestones), 'durations': dict(self.durations)}
+
+    def print_report(self):
+        print("\nStartup Report:")
+        print("-" * 50)
+        for name, seconds in self.milestones.items():
+            print(f"{name:<30}{seconds:>8.3f}s since start")
+        for name, seconds in self.durations.items():
+            print(f"  {name:<28}{seconds:>8.3f}s")
+
+
+class DashboardData:
+    """An immutable snapshot of the datasets a dashboard renders from.
+
+    Anything derived from the data should be cached with memo() so that it is
+    dropped together with the snapshot when a newer version is swapped in.
+    With an SQL backend df is None and pages query the backend instead.
+    index_dir is where the policy explorer's indexes for this data are kept.
+    """
+
+    def __init__(self, df=None, time_metrics=None, region_metrics=None, version=None, samples=None,
+                 kpi_snapshot=None, customer_index=None, backend=None, approximate_backend=None,
+                 index_dir=None):
+        self.df = df
+        self.index_dir = index_dir
+        self.backend = backend
+        self.approximate_backend = approximate_backend
+        self.time_metrics = time_metrics
+        self.region_metrics = region_metrics
+        self.samples = samples or {}
+        self.kpi_snapshot = kpi_snapshot or {}
+        self.customer_index = customer_index
+        self.version = version
+        self._memo = {}
+        self._memo_lock = threading.RLock()
+
+    def memo(self, key, factory):
+        """Return the cached value for key, computing it once per snapshot."""
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+        with self._memo_lock:
+            if key not in self._memo:
+                self._memo[key] = factory()
+            return self._memo[key]
+
+    def sample(self, size):
+        """The stratified sample of the given size, drawn once if it wasn't stored."""
+        if size in self.samples:
+            return self.samples[size]
+        from sampling import stratified_sample
+        return self.memo(('sample', size), lambda: stratified_sample(self.frame(), size))
+
+    def kpis(self, customer_segment='All', region='All'):
+        """KPI card values for a filter, from the pipeline's snapshot if it matches this data."""
+        key = (customer_segment, region)
+        if key in self.kpi_snapshot:
+            return self.kpi_snapshot[key]
+        from kpi_snapshot import compute_kpi_snapshot, kpi_lookup
+        return self.memo('kpis', lambda: kpi_lookup(compute_kpi_snapshot(self.frame())))[key]
+
+    def queries(self):
+        """The aggregation backend pages query (see query_backend.py)."""
+        if self.backend is not None:
+            return self.backend
+        from query_backend import PandasBackend
+        return self.memo('queries', lambda: PandasBackend(self.df, self.index_dir))
+
+    def approximate(self):
+        """A view of this snapshot whose KPIs and charts are estimated (see approximate.py)."""
+        from approximate import ApproximateBackend, ApproximateData
+
+        def build():
+            backend = self.approximate_backend or ApproximateBackend.from_frame(self.frame())
+            return ApproximateData(self, backend)
+        return self.memo('approximate', build)
+
+    def frame(self):
+        """The whole policy table; with an SQL backend this reads it from the database."""
+        return self.df if self.df is not None else self.backend.read_table()
+
+    def find_customer(self, customer_id):
+        """Row position of a customer via the customer_id hash index, or None."""
+        index = self.customer_index
+        if index is None or index.n_rows != len(self.df):
+            from customer_index import CustomerIndex
+            index = self.memo('customer_index', lambda: CustomerIndex.from_frame(self.df))
+        # Indexing the column's array reads one value, without converting the column
+        return index.lookup(customer_id, self.df['customer_id'].array)
+
+    def customer_record(self, customer_id):
+        """One customer's row as a dict, or None."""
+        if self.df is None:
+            return self.backend.customer(customer_id)
+        row = self.find_customer(customer_id)
+        return None if row is None else self.df.iloc[row].to_dict()
+
+
+def files_fingerprint(data_dir=DATA_DIR, files=DASHBOARD_FILES):
+    """Identify the current version of the data files from their size and mtime.
+
+    If the pipeline has written a manifest.json alongside the data, its
+    content hash is used instead.
+    """
+    manifest = os.path.join(data_dir, 'manifest.json')
+    if os.path.exists(manifest):
+        with open(manifest, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()[:12]
+
+    digest = hashlib.sha1()
+    for name in files:
+        stat = os.stat(os.path.join(data_dir, name))
+        digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()[:12]
+
+
+# (path, size, mtime_ns) -> version, so an unchanged file is hashed once per process
+_data_versions = {}
+_data_versions_lock = threading.Lock()
+
+
+def data_version(path):
+    """Content fingerprint of a data file, hashed in full and again only when its size or mtime changes."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _data_versions_lock:
+        version = _data_versions.get(key)
+    if version is not None:
+        return version
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(VERSION_BLOCK_BYTES), b''):
+            digest.update(block)
+    version = digest.hexdigest()[:12]
+    with _data_versions_lock:
+        _data_versions[key] = version
+    return version
+
+
+def load_dashboard_data(data_dir=DATA_DIR, report=None, backend=None):
+    """Load the processed datasets and derived metrics used by create_dashboard.py."""
+    from dataset_schema import load_table
+    from features import FEATURES, compute_features, load_features
+
+    report = report or StartupReport()
+    backend = backend or QUERY_BACKEND
+
+    # Every table is read with the types declared in the dataset schema (see dataset_schema.py)
+    with report.timed('time_metrics.csv'):
+        time_metrics = load_table(data_dir, 'time_metrics')
+    with report.timed('region_metrics.csv'):
+        region_metrics = load_table(data_dir, 'region_metrics')
+
+    if backend == 'sqlite':
+        from query_backend import open_sql_store
+        from sampling import load_samples
+        from kpi_snapshot import load_kpi_snapshot
+        from approximate import load_approximate
+        with report.timed('sql store'):
+            store = open_sql_store(data_dir)
+        if store is not None:
+            with report.timed('samples'):
+                samples = load_samples(data_dir, expected_rows=store.rows)
+            with report.timed('kpi snapshot'):
+                kpi_snapshot = load_kpi_snapshot(data_dir)
+            with report.timed('reservoir and sketches'):
+                approximate_backend = load_approximate(data_dir, expected_rows=store.rows)
+            return DashboardData(None, time_metrics, region_metrics, samples=samples,
+                                 kpi_snapshot=kpi_snapshot, backend=store,
+                                 approximate_backend=approximate_backend)
+        print("No current SQL store; loading insurance_data.csv into memory instead")
+    elif backend != 'pandas':
+        raise ValueError(f"Unknown query backend: {backend}")
+
+    # Derived columns come from the feature store (see features.py), not the CSV
+    version = data_version(os.path.join(data_dir, DASHBOARD_FILES[0]))
+    with report.timed('insurance_data.csv'):
+        df = load_table(data_dir, 'insurance_data', ignore=FEATURES)
+
+    with report.timed('derived columns'):
+        features = load_features(data_dir, expected_rows=len(df), version=version)
+        if features is None:
+            features = compute_features(df)
+        df = df.assign(**features)
+
+    from policy_index import index_dir
+    return DashboardData(df, time_metrics, region_metrics, index_dir=index_dir(data_dir, version),
+                         **load_stores(data_dir, len(df), report, version=version))
+
+
+def load_stores(data_dir, rows, report, version=None):
+    """Load the precomputed samples, KPIs, customer index and sketches that match the data.
+
+    See sampling.py, kpi_snapshot.py, customer_index.py and approximate.py.
+    version is the data version of the insurance_data.csv the rows were
+    loaded from, by default the current file's. Returns DashboardData keyword
+    arguments.
+    """
+    from sampling import load_samples
+    from kpi_snapshot import load_kpi_snapshot
+    from customer_index import load_customer_index
+    from approximate import load_approximate
+
+    version = version or data_version(os.path.join(data_dir, DASHBOARD_FILES[0]))
+    with report.timed('samples'):
+        samples = load_samples(data_dir, expected_rows=rows, version=version)
+    with report.timed('kpi snapshot'):
+        kpi_snapshot = load_kpi_snapshot(data_dir, version=version)
+    with report.timed('customer index'):
+        customer_index = load_customer_index(data_dir, version=version)
+    with report.timed('reservoir and sketches'):
+        approximate_backend = load_approximate(data_dir, expected_rows=rows, version=version)
+    return {'samples': samples, 'kpi_snapshot': kpi_snapshot, 'customer_index': customer_index,
+            'approximate_backend': approximate_backend}
+
+
+def load_time_metrics(data_dir=DATA_DIR, report=None):
+    """Load only the time metrics used by dashboard/app.py."""
+    from dataset_schema import load_table
+
+    report = report or StartupReport()
+
+    with report.timed('time_metrics.csv'):
+        time_metrics = load_table(data_dir, 'time_metrics')
+
+    return DashboardData(time_metrics=time_metrics)
+
+
+class DataStore:
+    """Hold the current data snapshot, loading and reloading it in the background.
+
+    Callbacks should call get() once and use that snapshot for the whole
+    request; a reload replaces the reference atomically and never mutates a
+    snapshot that is in use.
+    """
+
+    def __init__(self, loader, report=None, fingerprint=None, reload_interval=RELOAD_INTERVAL):
+        self.loader = loader
+        self.report = report or StartupReport()
+        self.fingerprint = fingerprint
+        self.reload_interval = reload_interval
+        self._data = None
+        self._error = None
+        # Fingerprint of the files the last failed load read; they are not retried until they change
+        self._failed = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._reloads = 0
+
+    def start(self):
+        """Start loading in the background; returns immediately."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='dashboard-data-loader', daemon=True)
+            self._thread.start()
+        return self
+
+    def _current_fingerprint(self):
+        if self.fingerprint is None:
+            return None
+        try:
+            return self.fingerprint()
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Unable to check data version: {e}")
+            return None
+
+    def _load(self, version, report):
+        data = self.loader(report=report)
+        if data.version is None:
+            data.version = version
+        return data
+
+    def _run(self):
+        version = self._current_fingerprint()
+        try:
+            self._data = self._load(version, self.report)
+            self.report.mark('data ready')
+            self.report.print_report()
+        except Exception as e:
+            self._error = e
+            self._failed = version
+            print(f"Error loading data: {e}")
+        finally:
+            self._ready.set()
+
+        if self.fingerprint is None or not self.reload_interval:
+            return
+        while True:
+            time.sleep(self.reload_interval)
+            self.reload_if_changed()
+
+    def reload_if_changed(self):
+        """Load a new snapshot if the data has changed since the current one or the last failed load."""
+        version = self._current_fingerprint()
+        current = self._data
+        if version is None or version == self._failed or (current is not None and version == current.version):
+            return False
+
+        began = time.perf_counter()
+        try:
+            data = self._load(version, StartupReport())
+        except Exception as e:
+            print(f"Error reloading data version {version}: {e}")
+            self._failed = version
+            return False
+
+        # Files still being written change again while we load; pick them up next time
+        if self._current_fingerprint() != version:
+            return False
+
+        self._data = data
+        self._error = None
+        self._failed = None
+        self._reloads += 1
+        print(f"Reloaded data version {version} in {time.perf_counter() - began:.2f}s")
+        return True
+
+    def is_ready(self):
+        return self._ready.is_set() and self._error is None
+
+    def get(self, timeout=0):
+        """Return the loaded data, waiting up to timeout seconds for it."""
+        self._ready.wait(timeout)
+        if self._error is not None:
+            raise DataNotReady(f"Data failed to load: {self._error}") from self._error
+        if self._data is None:
+            raise DataNotReady("Data is still loading")
+        return self._data
+
+    def status(self):
+        if self._error is not None:
+            state = 'failed'
+        elif self.is_ready():
+            state = 'ready'
+        else:
+            state = 'loading'
+        version = self._data.version if self._data is not None else None
+        return {'status': state, 'version': version, 'reloads': self._reloads,
+                'startup': self.report.as_dict()}
+
+
+def register_health_routes(server, data_store):
+    """Add /healthz (process is up) and /readyz (data is loaded) routes to a Flask server."""
+    import flask
+
+    @server.route('/healthz')
+    def healthz():
+        return flask.Response('ok', mimetype='text/plain')
+
+    @server.route('/readyz')
+    def readyz():
+        status = data_store.status()
+        code = 200 if status['status'] == 'ready' else 503
+        return flask.Response(json.dumps(status), status=code, mimetype='application/json')
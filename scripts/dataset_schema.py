@@ -0,0 +1,179 @@
+"""
+Typed loading of the processed datasets from the Power BI dataset schema.
+create_dataset_schema() in generate_powerbi_report.py declares every
+table's columns and data types; this module reads the CSV exports with
+exactly those types instead of letting pandas infer them. Text columns load
+as categoricals (key columns as strings), flags as int8, and dates as
+datetime64. A file whose header doesn't have the declared columns, or whose
+values don't parse as their declared types, raises SchemaError before any
+of it is used.
+
+Usage:
+    python scripts/dataset_schema.py [--data-dir data/processed]
+"""
+
+import argparse
+import csv
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from generate_powerbi_report import create_dataset_schema
+
+# Power BI dataType -> pandas dtype; 'datetime' columns are parsed as dates
+PANDAS_DTYPES = {'string': 'category', 'int64': 'int64', 'double': 'float64', 'bool': 'int8'}
+KEY_DTYPE = 'str'
+DATE_FORMAT = 'ISO8601'
+
+
+class SchemaError(ValueError):
+    """Raised when a data file doesn't match its table's declared schema."""
+
+
+def table_columns(table):
+    """The declared columns of a table as {name: column definition}, in schema order.
+
+    Tables of both the flat and the star model are found (see star_schema()).
+    """
+    for entry in create_dataset_schema()['tables'] + create_dataset_schema(star=True)['tables']:
+        if entry['name'] == table:
+            return {column['name']: column for column in entry['columns']}
+    raise KeyError(f"No table '{table}' in the dataset schema")
+
+
+def table_path(data_dir, table, partition=None):
+    """A table's CSV export, or one partition of it (<table>/<partition>.csv, see powerbi_export.py)."""
+    if partition is not None:
+        return os.path.join(data_dir, table, f'{partition}.csv')
+    return os.path.join(data_dir, f'{table}.csv')
+
+
+def split_file(name):
+    """(table, partition) of a data file named relative to its data directory."""
+    path = Path(name)
+    if path.parent != Path('.'):
+        return path.parent.name, path.stem
+    return path.stem, None
+
+
+def read_options(table, usecols=None):
+    """read_csv keyword arguments that load the given columns (all by default) as declared."""
+    columns = table_columns(table)
+    selected = list(columns) if usecols is None else list(usecols)
+    unknown = [name for name in selected if name not in columns]
+    if unknown:
+        raise SchemaError(f"{table} has no column(s) {', '.join(unknown)}")
+
+    dtype, dates = {}, []
+    for name in selected:
+        data_type = columns[name]['dataType']
+        if data_type == 'datetime':
+            dates.append(name)
+        elif data_type == 'string' and columns[name].get('isKey'):
+            dtype[name] = KEY_DTYPE
+        else:
+            dtype[name] = PANDAS_DTYPES[data_type]
+    options = {'usecols': selected, 'dtype': dtype}
+    if dates:
+        options.update(parse_dates=dates, date_format=DATE_FORMAT)
+    return options
+
+
+def check_header(path, table, ignore=()):
+    """Fail fast unless the file's header has exactly the table's declared columns.
+
+    Columns named in ignore may also be present (they are not loaded). Returns the header.
+    """
+    with open(path, newline='') as f:
+        header = next(csv.reader(f), [])
+    declared = table_columns(table)
+    present = [name for name in header if name not in ignore]
+    missing = [name for name in declared if name not in header]
+    unexpected = [name for name in present if name not in declared]
+    duplicated = sorted({name for name in header if header.count(name) > 1})
+
+    if missing or unexpected or duplicated or len(present) != len(declared):
+        problems = [f"{len(present)} columns, expected {len(declared)}"]
+        if missing:
+            problems.append(f"missing {', '.join(missing)}")
+        if unexpected:
+            problems.append(f"unexpected {', '.join(unexpected)}")
+        if duplicated:
+            problems.append(f"duplicated {', '.join(duplicated)}")
+        raise SchemaError(f"{path} doesn't match the {table} schema: {'; '.join(problems)}")
+    return header
+
+
+def _has_type(series, column):
+    data_type = column['dataType']
+    if data_type == 'string':
+        return isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(series)
+    if data_type == 'datetime':
+        return pd.api.types.is_datetime64_any_dtype(series)
+    if data_type == 'double':
+        return pd.api.types.is_float_dtype(series)
+    return pd.api.types.is_integer_dtype(series) or pd.api.types.is_bool_dtype(series)
+
+
+def check_dtypes(df, table, source=None):
+    """Fail unless every declared column of df has its declared type."""
+    columns = table_columns(table)
+    wrong = [f"{name} is {df[name].dtype}, expected {columns[name]['dataType']}"
+             for name in df.columns if name in columns and not _has_type(df[name], columns[name])]
+    if wrong:
+        raise SchemaError(f"{source or table} doesn't match the {table} schema: {'; '.join(wrong)}")
+
+
+def _parse(path, table, read):
+    try:
+        df = read()
+    except ValueError as e:
+        # A value that doesn't parse as its column's type, or NA in an int64 column
+        raise SchemaError(f"{path} doesn't match the {table} schema: {e}") from e
+    if df is not None:
+        check_dtypes(df, table, path)
+    return df
+
+
+def _typed_chunks(path, table, reader):
+    with reader:
+        chunks = iter(reader)
+        while True:
+            chunk = _parse(path, table, lambda: next(chunks, None))
+            if chunk is None:
+                return
+            yield chunk
+
+
+def load_table(data_dir, table, usecols=None, ignore=(), chunksize=None, partition=None, **kwargs):
+    """Read a table's CSV export, or one partition of it, with its declared types.
+
+    The header is checked before anything is parsed. With chunksize this
+    returns an iterator of typed chunks (categories may differ between chunks).
+    Other keyword arguments (e.g. engine) are passed to pd.read_csv.
+    """
+    path = table_path(data_dir, table, partition)
+    check_header(path, table, ignore)
+    options = {**read_options(table, usecols), **kwargs}
+    if chunksize is None:
+        return _parse(path, table, lambda: pd.read_csv(path, **options))
+    return _typed_chunks(path, table, pd.read_csv(path, chunksize=chunksize, **options))
+
+
+def main():
+    """Load every table in the schema and report its in-memory size."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default='data/processed')
+    args = parser.parse_args()
+
+    for entry in create_dataset_schema()['tables']:
+        path = table_path(args.data_dir, entry['name'])
+        if not os.path.exists(path):
+            continue
+        df = load_table(args.data_dir, entry['name'])
+        print(f"{entry['name']:<20}{len(df):>10,} rows{df.memory_usage(deep=True).sum() / 1e6:>10.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,699 @@
+"""
+Materialize the DAX measures in dashboard/measures.dax as an aggregate table.
+The measure set is parsed and every measure the engine supports is
+evaluated for each month x customer_segment x region cell of the policy
+data, into measure_aggregates.csv, along with each cell's policy count.
+The dataset schema declares that table as an aggregation of insurance_data
+for the measures that add up across cells (sums, and sums and differences
+of them) and the policy count: visuals at or above that grain can sum those
+columns, and ratios of them, instead of scanning the fact table. Distinct
+counts, ratios, running totals and ALLEXCEPT totals can't be rolled up
+from the cells, so their columns are marked as valid only at exactly that
+grain.
+
+Supported: SUM, AVERAGE, MIN, MAX and DISTINCTCOUNT of insurance_data
+columns, DIVIDE, arithmetic, VAR/RETURN, and CALCULATE with column filters
+(=, <>, IN), ALLEXCEPT, DATESYTD, DATESMTD and DATEADD(..., MONTH). Other
+measures (moving averages, rankings) are listed with the reason they were
+skipped. Every run cross-checks the engine against the same measures
+written directly in pandas and fails if they disagree; measures without a
+pandas counterpart are listed as unchecked.
+
+Usage:
+    python scripts/dax_measures.py [--data-dir data/processed] [--measures dashboard/measures.dax]
+"""
+
+import argparse
+import functools
+import os
+import re
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+MEASURES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'dashboard', 'measures.dax')
+AGGREGATE_TABLE = 'measure_aggregates'
+SOURCE_TABLE = 'insurance_data'
+DATE_COLUMN = 'policy_date'
+# Cells of the aggregate table; month is policy_date truncated to the month
+GRAIN = ('month', 'customer_segment', 'region')
+# Policies in each cell, stored alongside the measures
+ROW_COUNT = 'policy_count'
+AGGREGATIONS = {'SUM': 'sum', 'AVERAGE': 'mean', 'MIN': 'min', 'MAX': 'max', 'DISTINCTCOUNT': 'nunique'}
+TIME_FUNCTIONS = {'DATESYTD', 'DATESMTD', 'DATEADD'}
+CROSS_CHECK_TOLERANCE = 1e-6
+
+TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<string>"(?:[^"]|"")*")
+  | (?P<column>(?:'[^']+'|[A-Za-z_]\w*)\[[^\]]+\])
+  | (?P<measure>\[[^\]]+\])
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<op><>|<=|>=|[-+*/=<>(),{}])
+""", re.VERBOSE)
+# A measure starts at the beginning of a line: "<name> = <expression>"
+MEASURE_START = re.compile(r'^(?!VAR\b|RETURN\b)([A-Za-z][\w %]*?)\s*=(.*)$')
+
+Context = namedtuple('Context', ['dims', 'filters'])
+
+
+class UnsupportedMeasure(ValueError):
+    """Raised for a measure the engine can't evaluate."""
+
+
+def read_measures(text):
+    """{name: expression text} for every measure in a .dax file, in file order."""
+    measures, name = {}, None
+    for line in text.splitlines():
+        line = line.split('//', 1)[0].rstrip()
+        match = MEASURE_START.match(line)
+        if match:
+            name = match.group(1).strip()
+            measures[name] = match.group(2)
+        elif name is not None and line:
+            measures[name] += '\n' + line
+    return measures
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            raise UnsupportedMeasure(f"can't parse {text[position:position + 20]!r}")
+        if match.lastgroup != 'space':
+            tokens.append((match.lastgroup, match.group()))
+        position = match.end()
+    return tokens
+
+
+class Parser:
+    """Recursive-descent parser for DAX expressions into tuples: (kind, ...)."""
+
+    COMPARISONS = {'=', '<>', '<', '<=', '>', '>='}
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def parse(self):
+        node = self.expression()
+        if self.position != len(self.tokens):
+            raise UnsupportedMeasure(f"unexpected {self.tokens[self.position][1]!r}")
+        return node
+
+    def peek(self, value=None):
+        if self.position >= len(self.tokens):
+            return None
+        token = self.tokens[self.position]
+        if value is not None and token[1].upper() != value:
+            return None
+        return token
+
+    def take(self, value=None):
+        token = self.peek(value)
+        if token is None:
+            raise UnsupportedMeasure(f"expected {value or 'an expression'}")
+        self.position += 1
+        return token
+
+    def expression(self):
+        if not self.peek('VAR'):
+            return self.comparison()
+        bindings = []
+        while self.peek('VAR'):
+            self.take('VAR')
+            name = self.take()[1]
+            self.take('=')
+            bindings.append((name, self.expression()))
+        self.take('RETURN')
+        return ('var', tuple(bindings), self.expression())
+
+    def comparison(self):
+        left = self.additive()
+        token = self.peek()
+        if token and token[1] in self.COMPARISONS:
+            self.take()
+            return ('compare', token[1], left, self.additive())
+        if self.peek('IN'):
+            self.take('IN')
+            return ('in', left, self.primary())
+        return left
+
+    def additive(self):
+        node = self.multiplicative()
+        while self.peek() and self.peek()[1] in ('+', '-'):
+            node = ('binary', self.take()[1], node, self.multiplicative())
+        return node
+
+    def multiplicative(self):
+        node = self.unary()
+        while self.peek() and self.peek()[1] in ('*', '/'):
+            node = ('binary', self.take()[1], node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek('-'):
+            self.take()
+            operand = self.unary()
+            return ('number', -operand[1]) if operand[0] == 'number' else ('binary', '-', ('number', 0.0), operand)
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return ('number', float(value))
+        if kind == 'string':
+            return ('string', value[1:-1].replace('""', '"'))
+        if kind == 'column':
+            table, column = value[:-1].split('[', 1)
+            return ('column', table.strip("'"), column)
+        if kind == 'measure':
+            return ('measure', value[1:-1])
+        if value == '(':
+            node = self.expression()
+            self.take(')')
+            return node
+        if value == '{':
+            items = [self.expression()]
+            while self.peek(','):
+                self.take(',')
+                items.append(self.expression())
+            self.take('}')
+            return ('list', tuple(items))
+        if kind == 'name' and self.peek('('):
+            self.take('(')
+            args = []
+            if not self.peek(')'):
+                args.append(self.expression())
+                while self.peek(','):
+                    self.take(',')
+                    args.append(self.expression())
+            self.take(')')
+            return ('call', value.upper(), tuple(args))
+        if kind == 'name':
+            return ('name', value)
+        raise UnsupportedMeasure(f"unexpected {value!r}")
+
+
+def _grain_column(node):
+    """The grain dimension a column reference stands for, or None."""
+    if node[0] != 'column' or node[1] != SOURCE_TABLE:
+        return None
+    return 'month' if node[2] == DATE_COLUMN else node[2] if node[2] in GRAIN else None
+
+
+def _literal(node):
+    if node[0] in ('number', 'string'):
+        return node[1]
+    raise UnsupportedMeasure("filters must compare a column with constants")
+
+
+def _filter(node):
+    """A CALCULATE filter argument as (column, op, values)."""
+    if node[0] == 'compare' and node[2][0] == 'column' and node[1] in ('=', '<>'):
+        return node[2][2], node[1], (_literal(node[3]),)
+    if node[0] == 'in' and node[1][0] == 'column' and node[2][0] == 'list':
+        return node[1][2], 'in', tuple(_literal(item) for item in node[2][1])
+    raise UnsupportedMeasure("only column = value, column <> value and column IN {...} filters are supported")
+
+
+def _time_function(node):
+    """A time-intelligence CALCULATE argument as (function, months)."""
+    function, args = node[1], node[2]
+    if not args or _grain_column(args[0]) != 'month':
+        raise UnsupportedMeasure(f"{function} must take {SOURCE_TABLE}[{DATE_COLUMN}]")
+    if function == 'DATEADD':
+        if len(args) != 3 or args[1][0] != 'number' or args[2] != ('name', 'MONTH'):
+            raise UnsupportedMeasure("only DATEADD(<date>, <n>, MONTH) is supported")
+        return function, int(args[1][1])
+    return function, 0
+
+
+def compile_measures(text):
+    """Parse a measure set: ({name: expression tree} of supported measures, {name: reason} of the rest)."""
+    trees, unsupported = {}, {}
+    for name, expression in read_measures(text).items():
+        try:
+            trees[name] = Parser(expression).parse()
+        except UnsupportedMeasure as e:
+            unsupported[name] = str(e)
+
+    checked = {}
+
+    def check(node, variables=()):
+        kind = node[0]
+        if kind == 'measure':
+            name = node[1]
+            if name in unsupported:
+                raise UnsupportedMeasure(f"depends on [{name}] ({unsupported[name]})")
+            if name not in trees:
+                raise UnsupportedMeasure(f"[{name}] is not defined")
+            if name not in checked:
+                checked[name] = False  # in progress: a cycle is unsupported
+                check(trees[name])
+                checked[name] = True
+            elif not checked[name]:
+                raise UnsupportedMeasure(f"[{name}] refers to itself")
+        elif kind == 'var':
+            names = set(variables)
+            for variable, value in node[1]:
+                check(value, tuple(names))
+                names.add(variable)
+            check(node[2], tuple(names))
+        elif kind == 'name':
+            if node[1] not in variables:
+                raise UnsupportedMeasure(f"{node[1]} is not supported")
+        elif kind == 'binary':
+            check(node[2], variables)
+            check(node[3], variables)
+        elif kind == 'call':
+            function, args = node[1], node[2]
+            if function in AGGREGATIONS:
+                if len(args) != 1 or args[0][0] != 'column' or args[0][1] != SOURCE_TABLE:
+                    raise UnsupportedMeasure(f"{function} must take one {SOURCE_TABLE} column")
+            elif function == 'DIVIDE':
+                if len(args) not in (2, 3):
+                    raise UnsupportedMeasure("DIVIDE takes 2 or 3 arguments")
+                for arg in args:
+                    check(arg, variables)
+            elif function == 'CALCULATE':
+                check(args[0], variables)
+                for arg in args[1:]:
+                    if arg[0] == 'call' and arg[1] in TIME_FUNCTIONS:
+                        if _time_function(arg)[0] == 'DATESYTD' and not additive(args[0], trees):
+                            raise UnsupportedMeasure("DATESYTD is only supported over sums")
+                    elif arg[0] == 'call' and arg[1] == 'ALLEXCEPT':
+                        if not arg[2] or arg[2][0] != ('name', SOURCE_TABLE):
+                            raise UnsupportedMeasure(f"ALLEXCEPT must remove filters from {SOURCE_TABLE}")
+                        if any(_grain_column(column) is None for column in arg[2][1:]):
+                            raise UnsupportedMeasure(f"ALLEXCEPT may only keep {', '.join(GRAIN)}")
+                    else:
+                        _filter(arg)
+            else:
+                raise UnsupportedMeasure(f"{function} is not supported")
+        elif kind != 'number':
+            raise UnsupportedMeasure(f"a {kind} can't be evaluated on its own")
+
+    supported = {}
+    for name, tree in trees.items():
+        try:
+            check(('measure', name))
+            supported[name] = tree
+        except UnsupportedMeasure as e:
+            unsupported[name] = str(e)
+    return supported, unsupported
+
+
+def additive(node, trees):
+    """Whether a measure adds up across cells (sums, and sums and differences of them).
+
+    CALCULATE keeps a sum additive only with column filters: ALLEXCEPT
+    repeats a total in every cell and the time functions carry values
+    across months.
+    """
+    kind = node[0]
+    if kind == 'measure':
+        return node[1] in trees and additive(trees[node[1]], trees)
+    if kind == 'binary':
+        return node[1] in '+-' and additive(node[2], trees) and additive(node[3], trees)
+    if kind == 'call' and node[1] == 'SUM':
+        return True
+    if kind == 'call' and node[1] == 'CALCULATE':
+        return additive(node[2][0], trees) and not any(
+            arg[0] == 'call' and (arg[1] == 'ALLEXCEPT' or arg[1] in TIME_FUNCTIONS) for arg in node[2][1:])
+    return False
+
+
+@functools.lru_cache(maxsize=None)
+def _compiled(path, modified):
+    with open(path, 'r') as f:
+        return compile_measures(f.read())
+
+
+def load_measures(path=MEASURES_FILE):
+    """compile_measures() of a .dax file, parsed once per version of the file."""
+    return _compiled(os.path.abspath(path), os.stat(path).st_mtime_ns)
+
+
+def aggregate_table_schema(path=MEASURES_FILE):
+    """The dataset-schema entry for the aggregate table of the supported measures.
+
+    Only the additive measures and the policy count are registered as the
+    aggregation; the other columns are listed under exactGrainOnly and not
+    summarized.
+    """
+    supported, _ = load_measures(path)
+    summed = [name for name, tree in supported.items() if additive(tree, supported)]
+    return {
+        "name": AGGREGATE_TABLE,
+        "columns": [
+            {"name": "month", "dataType": "datetime"},
+            {"name": "customer_segment", "dataType": "string"},
+            {"name": "region", "dataType": "string"},
+            {"name": ROW_COUNT, "dataType": "int64", "summarizeBy": "sum"},
+            *({"name": name, "dataType": "double", "summarizeBy": "sum" if name in summed else "none"}
+              for name in supported)
+        ],
+        "aggregationOf": {
+            "table": SOURCE_TABLE,
+            "grain": {"month": DATE_COLUMN, "customer_segment": "customer_segment", "region": "region"},
+            "rowCount": ROW_COUNT,
+            "measures": summed,
+            "exactGrainOnly": [name for name in supported if name not in summed]
+        }
+    }
+
+
+def source_columns(trees):
+    """The insurance_data columns the measures read, besides the grain."""
+    columns = set()
+
+    def visit(node):
+        # Trees nest tuples of nodes (arguments, VAR bindings) as well as nodes
+        if isinstance(node, tuple):
+            if len(node) == 3 and node[0] == 'column' and node[1] == SOURCE_TABLE:
+                columns.add(node[2])
+            for child in node:
+                visit(child)
+
+    for tree in trees.values():
+        visit(tree)
+    return sorted(columns | {DATE_COLUMN, 'customer_segment', 'region'})
+
+
+class MeasureEngine:
+    """Evaluates compiled measures for every cell of GRAIN as NumPy arrays (NaN is DAX's BLANK).
+
+    A filter context is the grain dimensions still grouped on (ALLEXCEPT
+    drops the others) and the column filters in effect. Aggregations group
+    the filtered rows by precomputed group ids and broadcast back to the
+    cells, so each measure is a few bincounts over the rows.
+    """
+
+    def __init__(self, df, trees):
+        self.df, self.trees = df, trees
+        grouped = df.groupby(list(GRAIN), observed=True, sort=True)
+        self.ids = grouped.ngroup().to_numpy()
+        sizes = grouped.size()
+        self.cells, self.sizes = sizes.index, sizes.to_numpy()
+        self.first_rows = np.unique(self.ids, return_index=True)[1]
+        self._groupings, self._codes, self._cache = {}, {}, {}
+
+    def _grouping(self, dims):
+        """Group id of every row, and of every cell, grouping on dims only."""
+        if dims not in self._groupings:
+            if dims == GRAIN:
+                ids = self.ids
+            elif dims:
+                ids = self.df.groupby(list(dims), observed=True, sort=True).ngroup().to_numpy()
+            else:
+                ids = np.zeros(len(self.df), dtype=np.int64)
+            self._groupings[dims] = ids, ids[self.first_rows]
+        return self._groupings[dims]
+
+    def _mask(self, filters):
+        mask = np.ones(len(self.df), dtype=bool)
+        for column, op, values in filters:
+            matches = self.df[column].isin(list(values)).to_numpy()
+            mask &= ~matches if op == '<>' else matches
+        return mask
+
+    def _distinct_codes(self, column):
+        if column not in self._codes:
+            # DISTINCTCOUNT counts BLANK as a value: code 0, the rest from 1
+            codes, uniques = pd.factorize(self.df[column])
+            self._codes[column] = codes + 1, len(uniques) + 1
+        return self._codes[column]
+
+    def aggregate(self, function, column, context):
+        row_ids, cell_ids = self._grouping(context.dims)
+        mask = self._mask(context.filters)
+        ids = row_ids[mask]
+        groups = int(row_ids.max()) + 1 if len(row_ids) else 0
+        counts = np.bincount(ids, minlength=groups)
+        how = AGGREGATIONS[function]
+        if how == 'nunique':
+            codes, n_codes = self._distinct_codes(column)
+            # Each distinct (group, value) pair once, hashed rather than sorted
+            pairs = pd.unique(ids.astype(np.int64) * n_codes + codes[mask])
+            values = np.bincount(pairs // n_codes, minlength=groups).astype(np.float64)
+        elif how == 'sum':
+            values = np.bincount(ids, weights=self.df[column].to_numpy(dtype=np.float64)[mask], minlength=groups)
+        else:
+            values = (pd.Series(self.df[column].to_numpy(dtype=np.float64)[mask])
+                      .groupby(ids).agg(how).reindex(range(groups)).to_numpy())
+        # No rows in a group: BLANK
+        values = np.where(counts > 0, values, np.nan)
+        return values[cell_ids]
+
+    def measure(self, name, context=Context(GRAIN, ())):
+        key = (name, context)
+        if key not in self._cache:
+            self._cache[key] = self.evaluate(self.trees[name], context, {})
+        return self._cache[key]
+
+    def evaluate(self, node, context, variables):
+        kind = node[0]
+        if kind == 'number':
+            return np.full(len(self.cells), node[1])
+        if kind == 'measure':
+            return self.measure(node[1], context)
+        if kind == 'name':
+            return variables[node[1]]
+        if kind == 'var':
+            variables = dict(variables)
+            for name, value in node[1]:
+                variables[name] = self.evaluate(value, context, variables)
+            return self.evaluate(node[2], context, variables)
+        if kind == 'binary':
+            left = self.evaluate(node[2], context, variables)
+            right = self.evaluate(node[3], context, variables)
+            if node[1] in '+-':
+                # BLANK counts as 0 unless both sides are BLANK
+                both_blank = np.isnan(left) & np.isnan(right)
+                left, right = np.nan_to_num(left), np.nan_to_num(right)
+                result = left + right if node[1] == '+' else left - right
+                return np.where(both_blank, np.nan, result)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return left * right if node[1] == '*' else left / right
+        function, args = node[1], node[2]
+        if function in AGGREGATIONS:
+            return self.aggregate(function, args[0][2], context)
+        if function == 'DIVIDE':
+            numerator = self.evaluate(args[0], context, variables)
+            denominator = self.evaluate(args[1], context, variables)
+            alternate = self.evaluate(args[2], context, variables) if len(args) == 3 \
+                else np.full(len(self.cells), np.nan)
+            undefined = np.isnan(denominator) | (denominator == 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(undefined, alternate, numerator / denominator)
+        return self.calculate(args, context, variables)
+
+    def calculate(self, args, context, variables):
+        dims, filters, shifts = context.dims, dict((f[0], f) for f in context.filters), []
+        # Filter modifiers first, then the filter arguments, as CALCULATE applies them
+        for arg in args[1:]:
+            if arg[0] == 'call' and arg[1] == 'ALLEXCEPT':
+                kept = {_grain_column(column) for column in arg[2][1:]}
+                dims = tuple(dim for dim in GRAIN if dim in kept)
+                filters = {column: f for column, f in filters.items() if column in kept}
+        for arg in args[1:]:
+            if arg[0] == 'call' and arg[1] in TIME_FUNCTIONS:
+                if 'month' not in dims:
+                    raise UnsupportedMeasure(f"{arg[1]} needs the month in the filter context")
+                shifts.append(_time_function(arg))
+            elif not (arg[0] == 'call' and arg[1] == 'ALLEXCEPT'):
+                column, op, values = _filter(arg)
+                filters[column] = (column, op, values)
+        inner = Context(dims, tuple(sorted(filters.values())))
+        values = self.evaluate(args[0], inner, variables)
+        for function, months in shifts:
+            values = self.shift(values, months) if function == 'DATEADD' else \
+                self.year_to_date(values) if function == 'DATESYTD' else values
+        return values
+
+    def shift(self, values, months):
+        """Each cell's value taken from the cell months later (DATEADD); BLANK where there is none."""
+        source = pd.MultiIndex.from_arrays([
+            self.cells.get_level_values('month') + pd.DateOffset(months=months),
+            self.cells.get_level_values('customer_segment'), self.cells.get_level_values('region')])
+        positions = self.cells.get_indexer(source)
+        return np.where(positions >= 0, values[positions], np.nan)
+
+    def year_to_date(self, values):
+        """Running totals over the months of each year (DATESYTD) of an additive measure."""
+        months = self.cells.get_level_values('month')
+        keys = [months.year, self.cells.get_level_values('customer_segment'),
+                self.cells.get_level_values('region')]
+        # Cells are sorted by month first, so each group's running total is in month order
+        return pd.Series(np.nan_to_num(values)).groupby(keys).cumsum().to_numpy()
+
+    def table(self):
+        """Every measure for every cell, as the aggregate table."""
+        table = self.cells.to_frame(index=False)
+        table[ROW_COUNT] = self.sizes
+        for name in self.trees:
+            table[name] = self.measure(name)
+        return table
+
+
+def pandas_reference(df):
+    """The same measures written directly in pandas, for cross-checking the engine."""
+    keys = list(GRAIN)
+    grouped = df.groupby(keys, observed=True)
+    cells = grouped.size().index
+    premium, claims = grouped['annual_premium'].sum(), grouped['claim_amount'].sum()
+    customers = grouped['customer_id'].nunique()
+
+    def distinct(rows):
+        return rows.groupby(keys, observed=True)['customer_id'].nunique().reindex(cells)
+
+    def divide(numerator, denominator):
+        # DIVIDE(..., 0): 0 where the denominator is 0 or BLANK
+        return (numerator / denominator).where(denominator.notna() & (denominator != 0), 0)
+
+    def per(column, level):
+        # ALLEXCEPT keeping one grain column: that column's total in every cell
+        totals = df.groupby(level, observed=True)[column].sum()
+        return pd.Series(totals.reindex(cells.get_level_values(level)).to_numpy(), index=cells)
+
+    months = cells.get_level_values('month')
+    year_keys = [months.year, cells.get_level_values('customer_segment'), cells.get_level_values('region')]
+    premium_ytd, claims_ytd = premium.groupby(year_keys).cumsum(), claims.groupby(year_keys).cumsum()
+    previous = premium.reindex(pd.MultiIndex.from_arrays([months - pd.DateOffset(months=1), *year_keys[1:]]))
+    previous = pd.Series(previous.to_numpy(), index=cells)
+    fraud = df[df['fraud_reported'] == 1]
+    high_risk = distinct(df[df['customer_segment'].isin(['High Risk', 'Very High Risk'])])
+    fraud_cases = distinct(fraud)
+    segment_premium = per('annual_premium', 'customer_segment')
+    segment_claims = per('claim_amount', 'customer_segment')
+    region_premium, region_claims = per('annual_premium', 'region'), per('claim_amount', 'region')
+    return {
+        ROW_COUNT: grouped.size(),
+        'Total Premium': premium,
+        'Premium YTD': premium_ytd,
+        'Premium Growth': divide(premium - premium_ytd, premium_ytd),
+        'Total Claims': claims,
+        'Claims YTD': claims_ytd,
+        'Claims Growth': divide(claims - claims_ytd, claims_ytd),
+        'Loss Ratio': divide(claims, premium),
+        'Profit': premium - claims,
+        'Profit Margin': divide(premium - claims, premium),
+        'Total Customers': customers,
+        'Active Customers': distinct(df[df['policy_status'] == 'Active']),
+        'Customer Retention Rate': divide(distinct(df[df['policy_status'].isin(['Active', 'Renewed'])]),
+                                          customers),
+        'Average Premium per Customer': divide(premium, customers),
+        'Total Fraud Cases': fraud_cases,
+        'Fraud Rate': divide(fraud_cases, customers),
+        'Fraud Loss Amount': fraud.groupby(keys, observed=True)['claim_amount'].sum().reindex(cells),
+        'High Risk Customers': high_risk,
+        'Risk Score': divide(high_risk, customers),
+        'Premium MTD': premium,
+        'Claims MTD': claims,
+        # A BLANK previous month counts as 0 in the difference and makes DIVIDE return 0
+        'Premium vs Previous Month': divide(premium - previous.fillna(0), previous),
+        'Premium by Segment': segment_premium,
+        'Claims by Segment': segment_claims,
+        'Segment Profit': segment_premium - segment_claims,
+        'Segment Loss Ratio': divide(segment_claims, segment_premium),
+        'Premium by Region': region_premium,
+        'Claims by Region': region_claims,
+        'Region Profit': region_premium - region_claims,
+        'Region Loss Ratio': divide(region_claims, region_premium),
+    }
+
+
+def cross_check(df, table):
+    """Compare the engine's cells with pandas_reference(): {measure: {cells, max_difference, passed}}."""
+    table = table.set_index(list(GRAIN))
+    results = {}
+    for name, expected in pandas_reference(df).items():
+        if name not in table:
+            continue
+        actual = table[name].to_numpy(dtype=np.float64)
+        expected = expected.reindex(table.index).to_numpy(dtype=np.float64)
+        close = np.isclose(actual, expected, rtol=1e-9, atol=CROSS_CHECK_TOLERANCE, equal_nan=True)
+        difference = np.abs(np.nan_to_num(actual) - np.nan_to_num(expected))
+        results[name] = {'cells': len(actual), 'max_difference': float(difference.max(initial=0.0)),
+                         'passed': bool(close.all())}
+    return results
+
+
+def load_source(data_dir, trees):
+    """The policy rows the measures read, with the month each falls in."""
+    from dataset_schema import load_table
+    from features import FEATURES
+
+    df = load_table(data_dir, SOURCE_TABLE, usecols=source_columns(trees), ignore=FEATURES)
+    df['month'] = df[DATE_COLUMN].dt.to_period('M').dt.to_timestamp()
+    return df
+
+
+def materialize(data_dir='data/processed', path=MEASURES_FILE):
+    """Evaluate the supported measures and cross-check them; returns (table, results)."""
+    began = time.perf_counter()
+    supported, unsupported = load_measures(path)
+    df = load_source(data_dir, supported)
+    loaded = time.perf_counter()
+    table = MeasureEngine(df, supported).table()
+    evaluated = time.perf_counter()
+    checks = cross_check(df, table)
+    return table, {
+        'measures': list(supported),
+        'unsupported': unsupported,
+        'cells': len(table),
+        'source_rows': len(df),
+        'cross_check': checks,
+        'unchecked': [name for name in supported if name not in checks],
+        'passed': all(check['passed'] for check in checks.values()),
+        'timings': {'load_seconds': round(loaded - began, 3),
+                    'evaluate_seconds': round(evaluated - loaded, 3),
+                    'check_seconds': round(time.perf_counter() - evaluated, 3)},
+    }
+
+
+def write_measure_aggregates(data_dir='data/processed', path=MEASURES_FILE):
+    """Write measure_aggregates.csv, refusing to if the engine disagrees with pandas."""
+    table, results = materialize(data_dir, path)
+    if not results['passed']:
+        failed = [name for name, check in results['cross_check'].items() if not check['passed']]
+        raise ValueError(f"Measure engine disagrees with pandas on {', '.join(failed)}")
+    target = os.path.join(data_dir, f'{AGGREGATE_TABLE}.csv')
+    table.to_csv(target + '.tmp', index=False, date_format='%Y-%m-%d')
+    os.replace(target + '.tmp', target)
+    return results
+
+
+def main():
+    """Materialize the measures and report what was evaluated and cross-checked."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default='data/processed')
+    parser.add_argument('--measures', default=MEASURES_FILE)
+    args = parser.parse_args()
+
+    results = write_measure_aggregates(args.data_dir, args.measures)
+    print(f"{len(results['measures'])} measures x {results['cells']:,} cells from "
+          f"{results['source_rows']:,} policies")
+    timings = results['timings']
+    print(f"load {timings['load_seconds']:.3f}s  evaluate {timings['evaluate_seconds']:.3f}s  "
+          f"check {timings['check_seconds']:.3f}s")
+    print("\nCross-check against pandas:")
+    for name, check in results['cross_check'].items():
+        status = "✓" if check['passed'] else "✗"
+        print(f"{status} {name}: {check['cells']:,} cells, max difference {check['max_difference']:.2e}")
+    if results['unchecked']:
+        print(f"Not cross-checked (no pandas reference): {', '.join(results['unchecked'])}")
+    if results['unsupported']:
+        print("\nNot materialized:")
+        for name, reason in results['unsupported'].items():
+            print(f"- {name}: {reason}")
+
+
+if __name__ == "__main__":
+    main()
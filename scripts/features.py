@@ -0,0 +1,145 @@
+"""
+Versioned store of derived columns for the insurance dataset.
+Derived columns (risk_score, premium_category) are defined once here and
+computed once per data version by a vectorized pipeline stage that reads
+only their input columns. Each column is stored as its own .npy file under
+data/processed/features/<data version>/, so consumers memory-map just the
+columns they need instead of recomputing them in every process.
+
+Usage:
+    python scripts/features.py [--data-dir data/processed]
+"""
+
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from dashboard_data import data_version
+from dataset_schema import load_table
+
+FEATURES_VERSION = 1
+FEATURES_DIR = 'features'
+SOURCE_FILE = 'insurance_data.csv'
+HISTORY_VERSIONS = 3
+PREMIUM_CATEGORIES = ['Low', 'Medium', 'High', 'Premium']
+
+
+def risk_score(df):
+    """Claims paid per unit of premium."""
+    return df['claim_amount'].to_numpy(dtype=np.float64) / df['annual_premium'].to_numpy(dtype=np.float64)
+
+
+def premium_category(df):
+    """Premium quartile of each policy."""
+    return pd.qcut(df['annual_premium'], q=4, labels=PREMIUM_CATEGORIES)
+
+
+# name -> (function, input columns)
+FEATURES = {
+    'risk_score': (risk_score, ['claim_amount', 'annual_premium']),
+    'premium_category': (premium_category, ['annual_premium']),
+}
+
+
+def input_columns(columns=None):
+    """The source columns needed to compute the given features."""
+    needed = []
+    for name in columns or FEATURES:
+        needed.extend(column for column in FEATURES[name][1] if column not in needed)
+    return needed
+
+
+def compute_features(df, columns=None):
+    """Compute the given derived columns (all by default) as {name: array or Categorical}."""
+    return {name: FEATURES[name][0](df) for name in columns or FEATURES}
+
+
+def _version_dir(data_dir, version):
+    return os.path.join(data_dir, FEATURES_DIR, version)
+
+
+def write_feature_store(data_dir='data/processed', df=None):
+    """Compute every derived column for the current data and store it column-wise."""
+    source = os.path.join(data_dir, SOURCE_FILE)
+    version = data_version(source)
+    if df is None:
+        df = load_table(data_dir, 'insurance_data', usecols=input_columns(), ignore=FEATURES)
+
+    store_dir = os.path.join(data_dir, FEATURES_DIR)
+    tmp_dir = os.path.join(store_dir, f'.{version}.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    manifest = {'data_version': version, 'features_version': FEATURES_VERSION,
+                'rows': len(df), 'columns': {}}
+    for name, values in compute_features(df).items():
+        entry = {'file': f'{name}.npy'}
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            entry.update(dtype='category', categories=[str(c) for c in values.cat.categories],
+                         ordered=bool(values.cat.ordered))
+            values = values.cat.codes.to_numpy()
+        else:
+            values = np.asarray(values)
+            entry['dtype'] = str(values.dtype)
+        np.save(os.path.join(tmp_dir, entry['file']), values)
+        manifest['columns'][name] = entry
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Swap the finished directory into place, then drop old versions
+    final_dir = _version_dir(data_dir, version)
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(tmp_dir, final_dir)
+    versions = sorted((entry for entry in os.scandir(store_dir)
+                       if entry.is_dir() and not entry.name.startswith('.')),
+                      key=lambda entry: entry.stat().st_mtime)
+    for entry in versions[:-HISTORY_VERSIONS]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+    print(f"Derived features written for data version {version}: {', '.join(manifest['columns'])}")
+    return version
+
+
+def load_features(data_dir='data/processed', columns=None, expected_rows=None, version=None):
+    """Load stored derived columns for the current data as {name: array or Categorical}.
+
+    Arrays are memory-mapped. Returns None if the store has no entry for this
+    data version, was built by other feature definitions, or has the wrong
+    number of rows.
+    """
+    version = version or data_version(os.path.join(data_dir, SOURCE_FILE))
+    manifest_path = os.path.join(_version_dir(data_dir, version), 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest['features_version'] != FEATURES_VERSION or (
+            expected_rows is not None and manifest['rows'] != expected_rows):
+        return None
+
+    features = {}
+    for name in columns or FEATURES:
+        entry = manifest['columns'].get(name)
+        if entry is None:
+            return None
+        values = np.load(os.path.join(_version_dir(data_dir, version), entry['file']), mmap_mode='r')
+        if entry['dtype'] == 'category':
+            dtype = pd.CategoricalDtype(entry['categories'], ordered=entry['ordered'])
+            values = pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+        features[name] = values
+    return features
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default='data/processed')
+    args = parser.parse_args()
+    write_feature_store(args.data_dir)
+
+
+if __name__ == "__main__":
+    main()
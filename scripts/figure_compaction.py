@@ -0,0 +1,134 @@
+"""
+Compact serialization for dashboard figures and responses.
+Numeric trace arrays are rounded to display precision and sent as Plotly
+typed arrays (base64 binary in the smallest dtype that holds them), and
+large responses are gzip/brotli compressed when the browser accepts it.
+"""
+
+import base64
+import gzip
+import os
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+FIGURE_PRECISION = int(os.environ.get('DASHBOARD_FIGURE_PRECISION', 6))
+TYPED_ARRAY_MIN_LENGTH = 32
+COMPRESS_MIN_BYTES = int(os.environ.get('DASHBOARD_COMPRESS_MIN_BYTES', 1024))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'application/javascript', 'text/css')
+
+INTEGER_DTYPES = [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32]
+
+
+def round_significant(values, digits):
+    """Round every element of a float array to the given significant digits."""
+    values = np.asarray(values, dtype=np.float64)
+    nonzero = np.isfinite(values) & (values != 0)
+    magnitude = np.zeros_like(values)
+    magnitude[nonzero] = np.floor(np.log10(np.abs(values[nonzero])))
+    scale = 10.0 ** (digits - 1 - magnitude)
+    return np.where(nonzero, np.round(values * scale) / scale, values)
+
+
+def _numeric_array(value):
+    """Return value as a numeric ndarray, or None if it isn't a plain numeric array."""
+    if isinstance(value, np.ndarray):
+        array = value
+    elif isinstance(value, (list, tuple)) and value and all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) for v in value):
+        array = np.asarray(value)
+    else:
+        return None
+    if array.ndim != 1 or array.dtype.kind not in 'iuf':
+        return None
+    return array
+
+
+def typed_array(array, digits=FIGURE_PRECISION):
+    """Encode a numeric array as a Plotly typed array at display precision."""
+    if array.dtype.kind in 'iu' or (np.isfinite(array).all() and np.all(np.mod(array, 1) == 0)):
+        for dtype in INTEGER_DTYPES:
+            info = np.iinfo(dtype)
+            if array.size == 0 or (array.min() >= info.min and array.max() <= info.max):
+                array = array.astype(dtype)
+                break
+        else:
+            array = array.astype(np.float64)
+    else:
+        # float32 holds 7 significant digits, enough for anything rounded to <= 7
+        array = round_significant(array, digits).astype(np.float32 if digits <= 7 else np.float64)
+
+    dtype = array.dtype.newbyteorder('<')
+    code = {'f': 'f', 'i': 'i', 'u': 'u'}[dtype.kind] + str(dtype.itemsize)
+    return {'dtype': code, 'bdata': base64.b64encode(array.astype(dtype).tobytes()).decode('ascii')}
+
+
+def _compact(value, digits):
+    array = _numeric_array(value)
+    if array is not None:
+        if len(array) >= TYPED_ARRAY_MIN_LENGTH:
+            return typed_array(array, digits)
+        if array.dtype.kind == 'f':
+            return round_significant(array, digits).tolist()
+        return value
+    if isinstance(value, dict):
+        return {key: _compact(item, digits) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_compact(item, digits) for item in value]
+    return value
+
+
+def compact_figure(figure, digits=FIGURE_PRECISION):
+    """Return a figure dict with its numeric trace data quantized and typed-array encoded."""
+    if not digits:
+        return figure
+    if hasattr(figure, 'to_dict'):
+        figure = figure.to_dict()
+    return {**figure, 'data': [_compact(trace, digits) for trace in figure.get('data', [])]}
+
+
+def compact_graphs(component, digits=FIGURE_PRECISION):
+    """Compact the figure of every dcc.Graph inside a Dash component tree."""
+    if not digits:
+        return component
+    from dash import dcc
+
+    for child in [component, *component._traverse()]:
+        if isinstance(child, dcc.Graph) and getattr(child, 'figure', None) is not None:
+            child.figure = compact_figure(child.figure, digits)
+    return component
+
+
+def enable_response_compression(server, min_bytes=COMPRESS_MIN_BYTES):
+    """Compress large text/JSON responses with brotli or gzip, as the client allows."""
+    import flask
+
+    @server.after_request
+    def compress_response(response):
+        accept = flask.request.headers.get('Accept-Encoding', '').lower()
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code >= 300
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        body = response.get_data()
+        if len(body) < min_bytes:
+            return response
+        if brotli is not None and 'br' in accept:
+            response.set_data(brotli.compress(body, quality=5))
+            response.headers['Content-Encoding'] = 'br'
+        elif 'gzip' in accept:
+            response.set_data(gzip.compress(body, compresslevel=6))
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            return response
+        response.headers['Content-Length'] = str(len(response.get_data()))
+        response.vary.add('Accept-Encoding')
+        return response
+
+    return server
@@ -51,21 +51,17 @@ def generate_customer_data(n_customers=20000):
                                   np.random.binomial(1, 0.6, n_customers),
                                   np.random.binomial(1, 0.05, n_customers))
     
-    # Calculate risk score with more variation
-    df['risk_score'] = (
+    # Score customers for segmentation only; the risk_score feature itself is
+    # derived from claims and premium in features.py
+    segment_score = (
         (df['claim_amount'] / df['annual_premium'].clip(lower=1)).fillna(0) * 0.4 +
         (df['fraud_reported'] * 0.6) +
         np.random.uniform(0, 0.2, n_customers)  # Add random noise
     )
     
-    # Ensure risk score is properly scaled
-    df['risk_score'] = (df['risk_score'] - df['risk_score'].min()) / (
-        df['risk_score'].max() - df['risk_score'].min()
-    )
-    
     # Create segments ensuring even distribution
     df['customer_segment'] = pd.qcut(
-        df['risk_score'], 
+        segment_score, 
         q=4, 
         labels=CUSTOMER_SEGMENTS
     )
@@ -168,10 +164,8 @@ def generate_region_metrics(df):
     region_metrics = region_metrics.reset_index()
     return region_metrics
 
-def main():
-    """Generate and save all datasets for Power BI."""
-    print("Generating insurance data for Power BI...")
-    
+def write_datasets(data_dir='data/processed'):
+    """Generate the policy data and its metric tables and save them to data_dir."""
     # Generate main dataset
     df = generate_customer_data()
     
@@ -182,20 +176,28 @@ def main():
     
     # Create directories if they don't exist
     import os
-    os.makedirs('data/processed', exist_ok=True)
+    os.makedirs(data_dir, exist_ok=True)
     
     # Save datasets
     print("\nSaving datasets...")
-    df.to_csv('data/processed/insurance_data.csv', index=False)
-    time_metrics.to_csv('data/processed/time_metrics.csv')
-    customer_metrics.to_csv('data/processed/customer_metrics.csv', index=False)
-    region_metrics.to_csv('data/processed/region_metrics.csv', index=False)
+    df.to_csv(os.path.join(data_dir, 'insurance_data.csv'), index=False)
+    time_metrics.to_csv(os.path.join(data_dir, 'time_metrics.csv'))
+    customer_metrics.to_csv(os.path.join(data_dir, 'customer_metrics.csv'), index=False)
+    region_metrics.to_csv(os.path.join(data_dir, 'region_metrics.csv'), index=False)
+    return df
+
+def main():
+    """Generate and save all datasets for Power BI."""
+    print("Generating insurance data for Power BI...")
+    
+    df = write_datasets('data/processed')
     
     print("\nDatasets generated and saved:")
     print("1. insurance_data.csv - Main dataset")
     print("2. time_metrics.csv - Time-based metrics")
     print("3. customer_metrics.csv - Customer segment metrics")
     print("4. region_metrics.csv - Regional metrics")
+    print("\nRun scripts/pipeline.py to build the dashboard stores and the Power BI export from them.")
     
     # Print some basic statistics
     print("\nBasic Statistics:")
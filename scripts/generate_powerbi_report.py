@@ -1,12 +1,45 @@
 """
 Generate Power BI report pages using the Power BI REST API.
 This script creates a template report with all required pages and visualizations.
+
+Usage:
+    python scripts/generate_powerbi_report.py [--star]
 """
 
+import argparse
 import json
 import os
 from datetime import datetime
 
+# Text attributes of the policy data that the star schema moves into dimension tables
+STAR_DIMENSIONS = ['customer_segment', 'region', 'policy_type', 'payment_method', 'policy_status']
+STAR_FACT_TABLE = 'insurance_fact'
+
+def visual_containers(page):
+    """Lay out a layout page's sections as Power BI visual containers.
+
+    A section's visuals are placed left to right from the section's
+    position; a visual without its own height takes the section's.
+    """
+    containers = []
+    for section in page.get('sections', []):
+        position = section['position']
+        x = position['x']
+        for visual in section.get('visuals', section.get('items', [])):
+            width = visual.get('width', position['width'])
+            spec = {key: value for key, value in visual.items() if key not in ('width', 'height', 'title')}
+            spec.setdefault('visualType', section.get('visualType'))
+            containers.append({
+                'x': x,
+                'y': position['y'],
+                'width': width,
+                'height': visual.get('height', position['height']),
+                'visual': spec,
+                'title': visual.get('title', visual.get('measure')),
+            })
+            x += width
+    return containers
+
 def create_report_template():
     """Create the basic report template structure."""
     template = {
@@ -19,38 +52,49 @@ def create_report_template():
     with open('dashboard/layout.json', 'r') as f:
         layout = json.load(f)
     
-    # Add pages from layout
-    template["pages"] = layout["pages"]
+    # Add pages from layout, with their sections laid out as visual containers
+    template["pages"] = [{**page, "visualContainers": visual_containers(page)} for page in layout["pages"]]
     
     return template
 
-def create_dataset_schema():
-    """Create the dataset schema for Power BI."""
+def create_dataset_schema(star=False):
+    """Create the dataset schema for Power BI.
+
+    With star, the policy data is modelled as a fact table of integer
+    surrogate keys and measures instead (see star_schema()).
+    """
     schema = {
         "name": "InsuranceAnalytics",
         "tables": [
             {
                 "name": "insurance_data",
                 "columns": [
-                    {"name": "customer_id", "dataType": "string"},
+                    {"name": "customer_id", "dataType": "string", "isKey": True},
                     {"name": "age", "dataType": "int64"},
+                    {"name": "policy_date", "dataType": "datetime"},
                     {"name": "annual_premium", "dataType": "double"},
+                    {"name": "has_claim", "dataType": "bool"},
                     {"name": "claim_amount", "dataType": "double"},
                     {"name": "fraud_reported", "dataType": "bool"},
                     {"name": "customer_segment", "dataType": "string"},
-                    {"name": "policy_date", "dataType": "datetime"},
                     {"name": "policy_type", "dataType": "string"},
                     {"name": "region", "dataType": "string"},
                     {"name": "payment_method", "dataType": "string"},
                     {"name": "policy_status", "dataType": "string"},
                     {"name": "customer_tenure", "dataType": "double"},
                     {"name": "previous_claims", "dataType": "int64"}
-                ]
+                ],
+                # Exported as one file per month for incremental refresh (see powerbi_export.py)
+                "refreshPolicy": {
+                    "partitionColumn": "policy_date",
+                    "granularity": "month",
+                    "rangeParameters": ["RangeStart", "RangeEnd"]
+                }
             },
             {
                 "name": "time_metrics",
                 "columns": [
-                    {"name": "period", "dataType": "datetime"},
+                    {"name": "policy_date", "dataType": "datetime"},
                     {"name": "monthly_premium", "dataType": "double"},
                     {"name": "monthly_claims", "dataType": "double"},
                     {"name": "monthly_fraud_cases", "dataType": "int64"},
@@ -70,8 +114,10 @@ def create_dataset_schema():
                     {"name": "avg_claim", "dataType": "double"},
                     {"name": "total_claims", "dataType": "double"},
                     {"name": "fraud_rate", "dataType": "double"},
-                    {"name": "profit", "dataType": "double"},
-                    {"name": "loss_ratio", "dataType": "double"}
+                    {"name": "avg_tenure", "dataType": "double"},
+                    {"name": "total_previous_claims", "dataType": "int64"},
+                    {"name": "loss_ratio", "dataType": "double"},
+                    {"name": "profit", "dataType": "double"}
                 ]
             },
             {
@@ -134,7 +180,7 @@ def create_dataset_schema():
             {
                 "name": "time_to_date",
                 "fromTable": "time_metrics",
-                "fromColumn": "period",
+                "fromColumn": "policy_date",
                 "toTable": "date_table",
                 "toColumn": "Date",
                 "crossFilteringBehavior": "bothDirections"
@@ -142,13 +188,95 @@ def create_dataset_schema():
         ]
     }
     
-    return schema
+    # Precomputed cells of the DAX measures, an aggregation of insurance_data (see dax_measures.py)
+    from dax_measures import AGGREGATE_TABLE, aggregate_table_schema
+    schema["tables"].append(aggregate_table_schema())
+    schema["relationships"] += [
+        {
+            "name": f"{AGGREGATE_TABLE}_to_date",
+            "fromTable": AGGREGATE_TABLE,
+            "fromColumn": "month",
+            "toTable": "date_table",
+            "toColumn": "Date",
+            "crossFilteringBehavior": "oneDirection"
+        },
+        {
+            "name": f"{AGGREGATE_TABLE}_to_customer",
+            "fromTable": AGGREGATE_TABLE,
+            "fromColumn": "customer_segment",
+            "toTable": "customer_metrics",
+            "toColumn": "customer_segment",
+            "crossFilteringBehavior": "oneDirection"
+        },
+        {
+            "name": f"{AGGREGATE_TABLE}_to_region",
+            "fromTable": AGGREGATE_TABLE,
+            "fromColumn": "region",
+            "toTable": "region_metrics",
+            "toColumn": "region",
+            "crossFilteringBehavior": "oneDirection"
+        }
+    ]
+    
+    return star_schema(schema) if star else schema
+
+def star_schema(schema):
+    """Split insurance_data into a fact table and one dimension per text attribute.
+
+    The fact table keeps the measures, dates and customer_id and replaces
+    each attribute with an integer <attribute>_key into dim_<attribute>;
+    the metric tables join the dimensions on their label instead of the
+    policy rows.
+    """
+    tables = {table['name']: table for table in schema['tables']}
+    policies = tables.pop('insurance_data')
+    for name, table in tables.items():
+        if table.get('aggregationOf', {}).get('table') == 'insurance_data':
+            tables[name] = {**table, "aggregationOf": {**table['aggregationOf'], "table": STAR_FACT_TABLE}}
+    fact = {
+        **policies,
+        "name": STAR_FACT_TABLE,
+        "columns": [{"name": f"{column['name']}_key", "dataType": "int64"}
+                    if column['name'] in STAR_DIMENSIONS else column for column in policies['columns']]
+    }
+    dimensions = [{
+        "name": f"dim_{attribute}",
+        "columns": [
+            {"name": f"{attribute}_key", "dataType": "int64", "isKey": True},
+            {"name": attribute, "dataType": "string"}
+        ]
+    } for attribute in STAR_DIMENSIONS]
 
-def create_report_config():
+    relationships = [{
+        "name": f"fact_to_{attribute}",
+        "fromTable": STAR_FACT_TABLE,
+        "fromColumn": f"{attribute}_key",
+        "toTable": f"dim_{attribute}",
+        "toColumn": f"{attribute}_key",
+        "crossFilteringBehavior": "oneDirection"
+    } for attribute in STAR_DIMENSIONS]
+    for relationship in schema['relationships']:
+        if relationship['fromTable'] != 'insurance_data':
+            relationships.append(relationship)
+        elif relationship['fromColumn'] in STAR_DIMENSIONS:
+            relationships.append({
+                **relationship,
+                "name": f"{relationship['toTable']}_to_{relationship['fromColumn']}",
+                "fromTable": relationship['toTable'],
+                "fromColumn": relationship['toColumn'],
+                "toTable": f"dim_{relationship['fromColumn']}",
+                "toColumn": relationship['fromColumn']
+            })
+        else:
+            relationships.append({**relationship, "fromTable": STAR_FACT_TABLE})
+
+    return {**schema, "tables": [fact, *dimensions, *tables.values()], "relationships": relationships}
+
+def create_report_config(star=False):
     """Create the complete report configuration."""
     config = {
         "report": create_report_template(),
-        "dataset": create_dataset_schema(),
+        "dataset": create_dataset_schema(star),
         "theme": None
     }
     
@@ -158,18 +286,33 @@ def create_report_config():
     
     return config
 
-def save_report_config():
-    """Save the complete report configuration."""
-    config = create_report_config()
+def latest_report_config(output_dir='data/processed/powerbi'):
+    """Path of the newest report_config_<timestamp>.json in output_dir, or None."""
+    if not os.path.isdir(output_dir):
+        return None
+    config_files = sorted(f for f in os.listdir(output_dir) if f.startswith('report_config_'))
+    return os.path.join(output_dir, config_files[-1]) if config_files else None
+
+def save_report_config(star=False, output_dir='data/processed/powerbi'):
+    """Save the complete report configuration, unless the latest saved one is identical."""
+    config = create_report_config(star)
     
     # Create output directory
-    output_dir = 'data/processed/powerbi'
     os.makedirs(output_dir, exist_ok=True)
     
+    # A rerun with nothing changed keeps the existing file rather than adding a copy
+    latest = latest_report_config(output_dir)
+    if latest:
+        with open(latest, 'r') as f:
+            if json.load(f) == config:
+                print(f"\nReport configuration unchanged: {os.path.basename(latest)}")
+                return latest
+    
     # Save configurations
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    path = f'{output_dir}/report_config_{timestamp}.json'
     
-    with open(f'{output_dir}/report_config_{timestamp}.json', 'w') as f:
+    with open(path, 'w') as f:
         json.dump(config, f, indent=2)
     
     print(f"\nReport configuration saved to: report_config_{timestamp}.json")
@@ -178,11 +321,17 @@ def save_report_config():
     print(f"- {len(config['dataset']['tables'])} tables")
     print(f"- {len(config['dataset']['relationships'])} relationships")
     print("\nReady for Power BI import.")
+    return path
 
 def main():
     """Main function to generate report configuration."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--star', action='store_true',
+                        help='Model the policy data as a star schema (see powerbi_export.py --star)')
+    args = parser.parse_args()
+
     print("Generating Power BI report configuration...")
-    save_report_config()
+    save_report_config(args.star)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
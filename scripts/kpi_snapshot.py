@@ -0,0 +1,183 @@
+"""
+KPI snapshot table for the dashboard.
+The pipeline computes every KPI card value once per data version, for each
+customer_segment x region filter (including 'All'), together with real
+year-over-year changes, and appends the rows to kpi_snapshot.csv. Pages
+then look their numbers up instead of recomputing them from the full data.
+
+Year over year compares the 12 months ending at the latest policy date with
+the 12 months before them.
+
+Usage:
+    python scripts/kpi_snapshot.py [--data-dir data/processed]
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from dashboard_data import data_version
+from dataset_schema import load_table
+
+ALL = 'All'
+FILTERS = ['customer_segment', 'region']
+SNAPSHOT_FILE = 'kpi_snapshot.csv'
+SOURCE_FILE = 'insurance_data.csv'
+HISTORY_VERSIONS = 10
+HIGH_RISK_QUANTILE = 0.75
+
+# Additive per-cell totals; every KPI is derived from sums of these
+CELL_TOTALS = ['policies', 'premium', 'claims', 'fraud', 'risk_sum', 'risk_count',
+               'high_risk', 'premium_customers',
+               'current_premium', 'prior_premium', 'current_claims', 'prior_claims',
+               'current_policies', 'prior_policies', 'current_fraud', 'prior_fraud']
+
+
+def _change(current, prior):
+    return current / prior - 1 if prior else np.nan
+
+
+def _cells(df):
+    """Aggregate the data to one row of additive totals per segment x region."""
+    dates = pd.to_datetime(df['policy_date'])
+    period_end = dates.max()
+    current = dates > period_end - pd.DateOffset(years=1)
+    prior = (dates > period_end - pd.DateOffset(years=2)) & ~current
+    risk = df['risk_score'].replace([np.inf, -np.inf], np.nan)
+    threshold = risk.quantile(HIGH_RISK_QUANTILE)
+
+    frame = pd.DataFrame({
+        'customer_segment': df['customer_segment'].astype(str),
+        'region': df['region'].astype(str),
+        'policies': 1,
+        'premium': df['annual_premium'],
+        'claims': df['claim_amount'],
+        'fraud': df['fraud_reported'],
+        'risk_sum': risk.fillna(0),
+        'risk_count': risk.notna().astype(int),
+        'high_risk': (risk > threshold).astype(int),
+        'premium_customers': (df['premium_category'] == 'Premium').astype(int),
+        'current_premium': df['annual_premium'].where(current, 0),
+        'prior_premium': df['annual_premium'].where(prior, 0),
+        'current_claims': df['claim_amount'].where(current, 0),
+        'prior_claims': df['claim_amount'].where(prior, 0),
+        'current_policies': current.astype(int),
+        'prior_policies': prior.astype(int),
+        'current_fraud': df['fraud_reported'].where(current, 0),
+        'prior_fraud': df['fraud_reported'].where(prior, 0),
+    })
+    return frame.groupby(FILTERS, observed=True)[CELL_TOTALS].sum(), period_end
+
+
+def _kpi_row(cells):
+    totals = cells.sum()
+    by_region = cells.groupby(level='region')[['premium', 'current_premium', 'prior_premium']].sum()
+    top_region = by_region['premium'].idxmax()
+    top = by_region.loc[top_region]
+    current_fraud_rate = totals['current_fraud'] / totals['current_policies'] if totals['current_policies'] else np.nan
+    prior_fraud_rate = totals['prior_fraud'] / totals['prior_policies'] if totals['prior_policies'] else np.nan
+    return {
+        'total_premium': totals['premium'],
+        'total_claims': totals['claims'],
+        'policies': int(totals['policies']),
+        'avg_premium': totals['premium'] / totals['policies'],
+        'fraud_count': int(totals['fraud']),
+        'fraud_rate': totals['fraud'] / totals['policies'],
+        'avg_risk_score': totals['risk_sum'] / totals['risk_count'] if totals['risk_count'] else np.nan,
+        'high_risk_customers': int(totals['high_risk']),
+        'premium_customers': int(totals['premium_customers']),
+        'segments': cells.index.get_level_values('customer_segment').nunique(),
+        'regions': len(by_region),
+        'top_region': top_region,
+        'premium_yoy': _change(totals['current_premium'], totals['prior_premium']),
+        'claims_yoy': _change(totals['current_claims'], totals['prior_claims']),
+        'policies_yoy': _change(totals['current_policies'], totals['prior_policies']),
+        'fraud_rate_yoy': current_fraud_rate - prior_fraud_rate,
+        'top_region_premium_yoy': _change(top['current_premium'], top['prior_premium']),
+    }
+
+
+def compute_kpi_snapshot(df, version=None):
+    """One row of KPIs per filter combination.
+
+    df must have the dashboard's derived columns (risk_score and
+    premium_category). High-risk customers are counted against the overall
+    75th percentile of risk_score, so filtered counts add up.
+    """
+    cells, period_end = _cells(df)
+    segments = [ALL] + sorted(cells.index.get_level_values('customer_segment').unique())
+    regions = [ALL] + sorted(cells.index.get_level_values('region').unique())
+
+    rows = []
+    for segment in segments:
+        for region in regions:
+            selected = cells
+            if segment != ALL:
+                selected = selected[selected.index.get_level_values('customer_segment') == segment]
+            if region != ALL:
+                selected = selected[selected.index.get_level_values('region') == region]
+            if selected.empty:
+                continue
+            rows.append({'version': version, 'customer_segment': segment, 'region': region,
+                         'period_end': period_end.date().isoformat(), **_kpi_row(selected)})
+    return pd.DataFrame(rows)
+
+
+def write_kpi_snapshot(data_dir='data/processed', df=None):
+    """Compute the snapshot for the current data and append it to kpi_snapshot.csv."""
+    from features import FEATURES, compute_features, load_features
+
+    source = os.path.join(data_dir, SOURCE_FILE)
+    version = data_version(source)
+    if df is None:
+        df = load_table(data_dir, 'insurance_data', ignore=FEATURES)
+    features = load_features(data_dir, expected_rows=len(df), version=version)
+    df = df.assign(**(features if features is not None else compute_features(df)))
+
+    snapshot = compute_kpi_snapshot(df, version)
+    path = os.path.join(data_dir, SNAPSHOT_FILE)
+    if os.path.exists(path):
+        history = pd.read_csv(path)
+        history = history[history['version'] != version]
+        kept = list(dict.fromkeys(history['version']))[-(HISTORY_VERSIONS - 1):]
+        snapshot = pd.concat([history[history['version'].isin(kept)], snapshot], ignore_index=True)
+
+    tmp_path = path + '.tmp'
+    snapshot.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    print(f"KPI snapshot written for data version {version}")
+    return version
+
+
+def load_kpi_snapshot(data_dir='data/processed', version=None):
+    """Read the KPI rows for the current data as {(customer_segment, region): kpis}.
+
+    Returns an empty dict if no snapshot matches the current data version
+    (or the given one).
+    """
+    path = os.path.join(data_dir, SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return {}
+    version = version or data_version(os.path.join(data_dir, SOURCE_FILE))
+    snapshot = pd.read_csv(path)
+    return kpi_lookup(snapshot[snapshot['version'] == version])
+
+
+def kpi_lookup(snapshot):
+    """Index snapshot rows by filter combination, with NaN turned into None."""
+    snapshot = snapshot.astype(object).where(snapshot.notna(), None)
+    return {(row['customer_segment'], row['region']): row
+            for row in snapshot.to_dict('records')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default='data/processed')
+    args = parser.parse_args()
+    write_kpi_snapshot(args.data_dir)
+
+
+if __name__ == "__main__":
+    main()
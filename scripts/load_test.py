@@ -0,0 +1,302 @@
+"""
+Load-test the insurance dashboard's Dash callbacks.
+Simulates concurrent users who move between pages, filter, sort and page
+through the policy explorer, look customers up and click the export
+buttons, driving the _dash-update-component endpoint either in-process
+(against create_dashboard.py loaded with generated data of each size) or
+against a running server, and reports throughput and latency percentiles
+per callback.
+
+Usage:
+    python scripts/load_test.py --users 10 --actions 20 --sizes 20000,200000
+    python scripts/load_test.py --url http://127.0.0.1:8050 --users 25
+"""
+
+import argparse
+import functools
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+PAGES = {'/': 0.3, '/customer': 0.15, '/risk': 0.15, '/regional': 0.15, '/policies': 0.15, '/lookup': 0.1}
+EXPORT_FORMATS = ['xlsx', 'csv', 'parquet']
+POLICY_PAGE_SIZE = 25
+# (filter_query, sort_by) a user applies on the policy explorer before paging
+POLICY_QUERIES = [
+    ('', []),
+    ('', [{'column_id': 'annual_premium', 'direction': 'desc'}]),
+    ('{region} = North', [{'column_id': 'policy_date', 'direction': 'asc'}]),
+    ('{customer_segment} = "High Risk" && {claim_amount} > 1000', [{'column_id': 'claim_amount', 'direction': 'desc'}]),
+    ('{policy_date} datestartswith 2023', []),
+    ('{policy_status} icontains act', [{'column_id': 'customer_segment', 'direction': 'asc'},
+                                       {'column_id': 'age', 'direction': 'desc'}]),
+]
+UNKNOWN_CUSTOMER_ID = 'CUS-UNKNOWN'
+
+# Callbacks are identified by their first output
+CALLBACK_NAMES = {
+    'page-content.children': 'display_page',
+    'policy-table.data': 'update_policy_table',
+    'customer-detail.children': 'show_customer_detail',
+    'download-location.href': 'download_report',
+    'customer-behavior-scatter.figure': 'update_customer_scatter',
+    'download-pdf.data': 'export_dashboard_pdf',
+    'total-premium.children': 'update_dashboard',
+}
+
+
+def parse_outputs(output):
+    """Turn a dependency output key into the outputs list Dash expects."""
+    if output.startswith('..'):
+        parts = output[2:-2].split('...')
+    else:
+        parts = [output]
+    return [dict(zip(('id', 'property'), part.rsplit('.', 1))) for part in parts]
+
+
+class DashClient:
+    """Post callback requests either through a Flask test client or over HTTP."""
+
+    def __init__(self, url=None, server=None):
+        self.url = url.rstrip('/') if url else None
+        self.server = server
+        self._local = threading.local()
+        self.callbacks = {}
+        for dependency in json.loads(self._request('GET', '/_dash-dependencies')[1]):
+            first_output = parse_outputs(dependency['output'])[0]
+            name = CALLBACK_NAMES.get(f"{first_output['id']}.{first_output['property']}",
+                                      dependency['output'])
+            self.callbacks[name] = dependency
+
+    def _request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        if self.url is None:
+            client = getattr(self._local, 'client', None)
+            if client is None:
+                client = self._local.client = self.server.test_client()
+            response = client.open(path, method=method, data=data, content_type='application/json')
+            payload = response.get_data()
+            response.close()
+            return response.status_code, payload
+
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=300) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def call(self, name, values, changed):
+        """Fire a callback with the given {'id.property': value} inputs and state."""
+        dependency = self.callbacks[name]
+
+        def fill(items):
+            return [{**item, 'value': values.get(f"{item['id']}.{item['property']}")} for item in items]
+
+        outputs = parse_outputs(dependency['output'])
+        body = {
+            'output': dependency['output'],
+            # Single-output callbacks are sent a bare output spec, not a list
+            'outputs': outputs if dependency['output'].startswith('..') else outputs[0],
+            'inputs': fill(dependency['inputs']),
+            'state': fill(dependency['state']),
+            'changedPropIds': [changed],
+        }
+        began = time.perf_counter()
+        status, payload = self._request('POST', '/_dash-update-component', body)
+        return status, time.perf_counter() - began, len(payload), payload
+
+    def get(self, path):
+        began = time.perf_counter()
+        status, payload = self._request('GET', path)
+        return status, time.perf_counter() - began, len(payload)
+
+
+def simulate_user(client, user_id, actions, export_rate, include_pdf, think_time):
+    """One user's session: page navigation with occasional exports.
+
+    On the policy explorer the user applies a filter and sort and opens a
+    page; on the customer lookup they look up an id seen in the explorer,
+    or an unknown one if they haven't seen any yet.
+    """
+    rng = random.Random(user_id)
+    samples = []
+    clicks = 0
+    customer_ids = []
+    for _ in range(actions):
+        if rng.random() < export_rate:
+            clicks += 1
+            if include_pdf and rng.random() < 0.25:
+                status, seconds, size, _ = client.call(
+                    'export_dashboard_pdf', {'export-pdf-button.n_clicks': clicks}, 'export-pdf-button.n_clicks')
+                samples.append(('export_dashboard_pdf', status, seconds, size))
+            else:
+                status, seconds, size, payload = client.call(
+                    'download_report',
+                    {'download-button.n_clicks': clicks, 'export-format.value': rng.choice(EXPORT_FORMATS)},
+                    'download-button.n_clicks')
+                samples.append(('download_report', status, seconds, size))
+                if status == 200:
+                    href = json.loads(payload)['response']['download-location']['href']
+                    status, seconds, size = client.get(href)
+                    samples.append(('download_stream', status, seconds, size))
+        else:
+            pathname = rng.choices(list(PAGES), weights=list(PAGES.values()))[0]
+            status, seconds, size, _ = client.call(
+                'display_page', {'url.pathname': pathname, 'data-ready-poll.n_intervals': 1}, 'url.pathname')
+            samples.append(('display_page', status, seconds, size))
+            if pathname == '/policies':
+                filter_query, sort_by = rng.choice(POLICY_QUERIES)
+                status, seconds, size, payload = client.call(
+                    'update_policy_table',
+                    {'policy-table.page_current': rng.randrange(5), 'policy-table.page_size': POLICY_PAGE_SIZE,
+                     'policy-table.sort_by': sort_by, 'policy-table.filter_query': filter_query},
+                    'policy-table.filter_query')
+                samples.append(('update_policy_table', status, seconds, size))
+                if status == 200:
+                    rows = json.loads(payload)['response']['policy-table']['data']
+                    customer_ids.extend(row['customer_id'] for row in rows)
+            elif pathname == '/lookup':
+                customer_id = rng.choice(customer_ids) if customer_ids else UNKNOWN_CUSTOMER_ID
+                status, seconds, size, _ = client.call(
+                    'show_customer_detail', {'customer-lookup-id.value': customer_id}, 'customer-lookup-id.value')
+                samples.append(('show_customer_detail', status, seconds, size))
+        if think_time:
+            time.sleep(rng.uniform(0, think_time))
+    return samples
+
+
+def run_scenario(client, users, actions, export_rate, include_pdf, think_time):
+    """Run all users concurrently and summarise latency per callback."""
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        sessions = list(pool.map(
+            lambda user_id: simulate_user(client, user_id, actions, export_rate, include_pdf, think_time),
+            range(users)))
+    elapsed = time.perf_counter() - began
+
+    samples = [sample for session in sessions for sample in session]
+    callbacks = {}
+    for name in sorted({sample[0] for sample in samples}):
+        rows = [sample for sample in samples if sample[0] == name]
+        latencies = np.array([row[2] for row in rows]) * 1000
+        callbacks[name] = {
+            'requests': len(rows),
+            'errors': sum(1 for row in rows if row[1] >= 400),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+            'p99_ms': round(float(np.percentile(latencies, 99)), 2),
+            'max_ms': round(float(latencies.max()), 2),
+            'mean_bytes': int(np.mean([row[3] for row in rows])),
+        }
+    return {
+        'requests': len(samples),
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'callbacks': callbacks,
+    }
+
+
+def generate_dataset(n_customers, directory, base_size=20000):
+    """Write a processed dataset of the given size for the dashboard to load.
+
+    The generator assigns one policy date per day, so larger books are built
+    by repeating a base book under new customer ids.
+    """
+    import pandas as pd
+    from generate_powerbi_data import generate_customer_data, generate_time_metrics, generate_region_metrics
+
+    base = generate_customer_data(min(n_customers, base_size))
+    repeats = -(-n_customers // len(base))
+    df = pd.concat([base] * repeats, ignore_index=True).iloc[:n_customers]
+    df['customer_id'] = [f'CUS{str(i).zfill(max(6, len(str(n_customers))))}' for i in range(len(df))]
+    df.to_csv(os.path.join(directory, 'insurance_data.csv'), index=False)
+    generate_time_metrics(df).to_csv(os.path.join(directory, 'time_metrics.csv'))
+    generate_region_metrics(df).to_csv(os.path.join(directory, 'region_metrics.csv'), index=False)
+
+
+def build_id():
+    """Identify the build under test by its git commit, if available."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(label, result):
+    print(f"\n{label}: {result['requests']} requests in {result['elapsed_seconds']:.1f}s "
+          f"({result['throughput_rps']} req/s)")
+    print("-" * 78)
+    print(f"{'Callback':<24}{'Requests':>9}{'Errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in result['callbacks'].items():
+        print(f"{name:<24}{stats['requests']:>9}{stats['errors']:>8}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+
+
+def main():
+    """Run the load test and save the results as JSON."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', help='Test a running server instead of loading the app in-process')
+    parser.add_argument('--sizes', default='20000', help='Comma-separated dataset sizes (in-process only)')
+    parser.add_argument('--users', type=int, default=10, help='Concurrent simulated users')
+    parser.add_argument('--actions', type=int, default=20, help='Actions per user')
+    parser.add_argument('--export-rate', type=float, default=0.05, help='Share of actions that are exports')
+    parser.add_argument('--include-pdf', action='store_true', help='Also click the PDF export')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Max seconds between actions')
+    parser.add_argument('--label', help='Name for this build in the results')
+    parser.add_argument('--output-dir', default='reports')
+    args = parser.parse_args()
+
+    scenario = dict(users=args.users, actions=args.actions, export_rate=args.export_rate,
+                    include_pdf=args.include_pdf, think_time=args.think_time)
+    results = {
+        'label': args.label,
+        'build': build_id(),
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'scenario': scenario,
+        'runs': [],
+    }
+
+    if args.url:
+        print(f"Load testing {args.url}...")
+        result = run_scenario(DashClient(url=args.url), **scenario)
+        results['runs'].append({'target': args.url, **result})
+        print_results(args.url, result)
+    else:
+        os.environ.setdefault('DASHBOARD_RELOAD_INTERVAL', '0')
+        import create_dashboard
+        from dashboard_data import DataStore, load_dashboard_data
+
+        client = DashClient(server=create_dashboard.app.server)
+        for size in (int(s) for s in args.sizes.split(',')):
+            with tempfile.TemporaryDirectory() as directory:
+                print(f"\nGenerating dataset with {size:,} policies...")
+                generate_dataset(size, directory)
+                store = DataStore(functools.partial(load_dashboard_data, directory), reload_interval=0)
+                store.start().get(timeout=600)
+                create_dashboard.data_store = store
+                result = run_scenario(client, **scenario)
+            results['runs'].append({'dataset_size': size, **result})
+            print_results(f"{size:,} policies", result)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"load_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to: {path}")
+
+
+if __name__ == "__main__":
+    main()
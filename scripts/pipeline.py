@@ -0,0 +1,333 @@
+"""
+Run the data pipeline as a graph of cached stages.
+Each stage declares the artifacts it reads and writes in the data
+directory, the repository files it reads and the scripts it runs. Its key
+is a hash of the content of all of those inputs, and a stage is skipped
+when its key and the content of its outputs are what they were after its
+last successful run, so a rerun with nothing changed only stats files
+(a file is hashed again only when its size or modification time changed).
+A stage starts as soon as the stages producing its inputs have finished,
+on a thread pool, and every run's per-stage timings are recorded in
+pipeline_state.json in the data directory.
+
+A validation stage's result is cached like any other output: with the
+same inputs it is reported again without rerunning it, pass or fail.
+
+The four dataset files are the pipeline's sources, not a stage's outputs:
+edits to them flow through to every stage. Synthetic data is generated
+into the data directory only when one of them is missing, or with
+--generate, which replaces them.
+
+prepare_dashboard_data.py and insurance_analysis.py are not stages: the
+first reads a raw export that nothing here produces and rewrites
+customer_metrics.csv and time_metrics.csv in another layout, the second is
+an interactive analysis that shows its plots.
+
+Usage:
+    python scripts/pipeline.py [--data-dir data/processed] [--generate] [--star] [--force] [--jobs N]
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = 'pipeline_state.json'
+STATE_FORMAT = 1
+HASH_BLOCK_BYTES = 1024 * 1024
+POWERBI_DIR = 'powerbi'
+DATASET_FILES = ['insurance_data.csv', 'time_metrics.csv', 'customer_metrics.csv', 'region_metrics.csv']
+SOURCE_FILE = DATASET_FILES[0]
+
+# inputs and outputs are paths in the data directory (a directory or a glob
+# stands for the files under or matching it), sources are repository files
+# relative to the working directory, code the scripts the stage runs and
+# options the run_pipeline() arguments that change what it writes. A check
+# stage returns whether it passed.
+Stage = namedtuple('Stage', 'name run inputs outputs code sources options check',
+                   defaults=((), (), False))
+
+
+def _features(data_dir, star):
+    from features import write_feature_store
+    write_feature_store(data_dir)
+
+
+def _samples(data_dir, star):
+    from sampling import refresh_samples
+    refresh_samples(data_dir)
+
+
+def _sketches(data_dir, star):
+    from approximate import write_sketches
+    write_sketches(data_dir)
+
+
+def _kpi_snapshot(data_dir, star):
+    from kpi_snapshot import write_kpi_snapshot
+    write_kpi_snapshot(data_dir)
+
+
+def _customer_index(data_dir, star):
+    from customer_index import write_customer_index
+    write_customer_index(data_dir)
+
+
+def _sql_store(data_dir, star):
+    from query_backend import write_sql_store
+    write_sql_store(data_dir)
+
+
+def _export(data_dir, star):
+    from powerbi_export import export_powerbi
+    export_powerbi(data_dir, os.path.join(data_dir, POWERBI_DIR), star=star)
+
+
+def _report_config(data_dir, star):
+    from generate_powerbi_report import save_report_config
+    save_report_config(star, os.path.join(data_dir, POWERBI_DIR))
+
+
+def _validate_data(data_dir, star):
+    from validate_powerbi_data import print_results, run_validation, validation_passed
+    results = run_validation(data_dir)
+    print_results(results)
+    return validation_passed(results)
+
+
+def _validate_config(data_dir, star):
+    from validate_powerbi_config import validate_config
+    return validate_config(os.path.join(data_dir, POWERBI_DIR))
+
+
+SCHEMA_CODE = ['dataset_schema.py', 'generate_powerbi_report.py', 'features.py']
+
+STAGES = [
+    Stage('features', _features, [SOURCE_FILE], ['features'], SCHEMA_CODE),
+    Stage('samples', _samples, [SOURCE_FILE], ['samples'], ['sampling.py', *SCHEMA_CODE]),
+    Stage('sketches', _sketches, [SOURCE_FILE], ['sketches.json'], ['approximate.py', *SCHEMA_CODE]),
+    Stage('kpi_snapshot', _kpi_snapshot, [SOURCE_FILE, 'features'], ['kpi_snapshot.csv'],
+          ['kpi_snapshot.py', *SCHEMA_CODE]),
+    Stage('customer_index', _customer_index, [SOURCE_FILE], ['customer_index'],
+          ['customer_index.py', *SCHEMA_CODE]),
+    Stage('sql_store', _sql_store, [SOURCE_FILE, 'features'], ['insurance.sqlite'],
+          ['query_backend.py', *SCHEMA_CODE]),
+    Stage('export', _export, DATASET_FILES,
+          ['date_table.csv', 'measure_aggregates.csv', f'{POWERBI_DIR}/manifest.json'],
+          ['powerbi_export.py', 'dax_measures.py', 'validate_powerbi_data.py', *SCHEMA_CODE],
+          ['dashboard/measures.dax'], ['star']),
+    Stage('report_config', _report_config, [], [f'{POWERBI_DIR}/report_config_*.json'],
+          ['generate_powerbi_report.py', 'dax_measures.py'],
+          ['dashboard/layout.json', 'dashboard/theme.json', 'dashboard/measures.dax'], ['star']),
+    Stage('validate_data', _validate_data, [*DATASET_FILES, 'date_table.csv', 'measure_aggregates.csv'], [],
+          ['validate_powerbi_data.py', 'reconcile_metrics.py', 'referential_integrity.py', *SCHEMA_CODE],
+          check=True),
+    Stage('validate_config', _validate_config,
+          [f'{POWERBI_DIR}/manifest.json', f'{POWERBI_DIR}/report_config_*.json'],
+          [f'{POWERBI_DIR}/validation_report.txt'],
+          ['validate_powerbi_config.py', 'validate_powerbi_data.py', 'powerbi_export.py', *SCHEMA_CODE],
+          ['dashboard/measures.dax'], check=True),
+]
+
+
+def file_hash(path):
+    """SHA-256 of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def expand(path):
+    """The files an artifact stands for: the file itself, the files under a directory, or a glob's matches."""
+    if glob.has_magic(path):
+        return sorted(glob.glob(path))
+    if os.path.isdir(path):
+        return sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    return [path] if os.path.exists(path) else []
+
+
+def upstream(stages):
+    """Each stage's name -> the names of the stages producing its inputs."""
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    return {stage.name: {producers[path] for path in stage.inputs if path in producers} for stage in stages}
+
+
+class PipelineState:
+    """File hashes and the key, outputs and timing of each stage's last run, kept in the data directory.
+
+    A file is hashed again only when its size or modification time differs
+    from when it was last hashed.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, STATE_FILE)
+        stored = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                stored = json.load(f)
+        if stored.get('format') != STATE_FORMAT:
+            stored = {}
+        self.files = stored.get('files', {})
+        self.stages = stored.get('stages', {})
+        self.last_run = stored.get('last_run')
+        self._lock = threading.Lock()
+
+    def content_hash(self, path):
+        stat = os.stat(path)
+        with self._lock:
+            known = self.files.get(path)
+        if known and (known['size'], known['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            return known['content_hash']
+        digest = file_hash(path)
+        with self._lock:
+            self.files[path] = {'content_hash': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        return digest
+
+    def fingerprint(self, path):
+        """Hash of an artifact's content, or None if there are no files for it."""
+        files = expand(path)
+        if files == [path]:
+            return self.content_hash(path)
+        if not files:
+            return None
+        listing = [(os.path.relpath(file, path if os.path.isdir(path) else os.path.dirname(path)),
+                    self.content_hash(file)) for file in files]
+        return hashlib.sha256(json.dumps(listing).encode()).hexdigest()
+
+    def stage_key(self, stage, options):
+        payload = {
+            'inputs': {path: self.fingerprint(os.path.join(self.data_dir, path)) for path in stage.inputs},
+            'sources': {path: self.fingerprint(path) for path in stage.sources},
+            'code': {name: self.fingerprint(os.path.join(SCRIPTS_DIR, name)) for name in stage.code},
+            'options': {name: options[name] for name in stage.options},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def outputs(self, stage):
+        return {path: self.fingerprint(os.path.join(self.data_dir, path)) for path in stage.outputs}
+
+    def execute(self, stage, options, force=False):
+        """Run a stage unless it is up to date; its status ('ran', 'cached' or 'failed') and seconds."""
+        began = time.perf_counter()
+        key = self.stage_key(stage, options)
+        with self._lock:
+            record = self.stages.get(stage.name)
+        if not force and record and record['key'] == key and record['outputs'] == self.outputs(stage):
+            return {'status': 'cached' if record.get('passed', True) else 'failed', 'cached': True,
+                    'seconds': round(time.perf_counter() - began, 3)}
+
+        with self._lock:
+            self.stages.pop(stage.name, None)
+        try:
+            result = stage.run(self.data_dir, **options)
+        except Exception as e:
+            print(f"Error in stage {stage.name}: {e}")
+            return {'status': 'failed', 'cached': False, 'error': str(e),
+                    'seconds': round(time.perf_counter() - began, 3)}
+        seconds = round(time.perf_counter() - began, 3)
+        record = {'key': key, 'outputs': self.outputs(stage), 'seconds': seconds,
+                  'finished': datetime.now().isoformat(timespec='seconds')}
+        if stage.check:
+            record['passed'] = bool(result)
+        with self._lock:
+            self.stages[stage.name] = record
+        return {'status': 'ran' if record.get('passed', True) else 'failed', 'cached': False, 'seconds': seconds}
+
+    def save(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        with self._lock:
+            payload = {'format': STATE_FORMAT, 'files': self.files, 'stages': self.stages,
+                       'last_run': self.last_run}
+            tmp = f'{self.path}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(payload, f, indent=2)
+            os.replace(tmp, self.path)
+
+
+def run_pipeline(data_dir='data/processed', star=False, force=False, jobs=None, generate=False, stages=STAGES):
+    """Run the stages that are out of date, each once the stages it depends on are done.
+
+    The dataset files are generated first if any is missing, or with
+    generate. Returns each stage's status and seconds; a stage whose
+    upstream failed is 'blocked'.
+    """
+    began, started = time.perf_counter(), datetime.now()
+    state = PipelineState(data_dir)
+    options = {'star': star}
+    depends = upstream(stages)
+    pending = {stage.name: stage for stage in stages}
+    running, statuses = {}, {}
+
+    def finish(name, status):
+        statuses[name] = status
+        print(f"[pipeline] {name:<16}{status['status']:<8}{status['seconds']:>9.3f}s"
+              + (" (from cache)" if status.get('cached') and status['status'] == 'failed' else ""))
+
+    # Synthetic data never replaces the sources unless asked to
+    if generate or not all(os.path.exists(os.path.join(data_dir, name)) for name in DATASET_FILES):
+        from generate_powerbi_data import write_datasets
+        generating = time.perf_counter()
+        write_datasets(data_dir)
+        finish('generate', {'status': 'ran', 'cached': False, 'seconds': round(time.perf_counter() - generating, 3)})
+
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if not depends[name] <= statuses.keys():
+                    continue
+                del pending[name]
+                if any(statuses[dependency]['status'] in ('failed', 'blocked') for dependency in depends[name]):
+                    finish(name, {'status': 'blocked', 'seconds': 0.0})
+                    continue
+                running[pool.submit(state.execute, stage, options, force)] = name
+            if not running:
+                if pending:
+                    raise ValueError(f"stages depend on each other: {', '.join(pending)}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                finish(running.pop(future), future.result())
+            state.save()
+
+    state.last_run = {'started': started.isoformat(timespec='seconds'),
+                      'seconds': round(time.perf_counter() - began, 3),
+                      'stages': {name: statuses[name] for name in ['generate', *(stage.name for stage in stages)]
+                                 if name in statuses}}
+    state.save()
+    return state.last_run
+
+
+def main():
+    """Bring the pipeline's outputs up to date and print each stage's timing."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default='data/processed')
+    parser.add_argument('--generate', action='store_true',
+                        help='Replace the dataset files with freshly generated synthetic data')
+    parser.add_argument('--star', action='store_true',
+                        help='Export and describe the policy data as a star schema (see powerbi_export.py --star)')
+    parser.add_argument('--force', action='store_true', help='Run every stage, even if it is up to date')
+    parser.add_argument('--jobs', type=int, help='Stages to run at once (default: one per CPU)')
+    args = parser.parse_args()
+
+    run = run_pipeline(args.data_dir, args.star, args.force, args.jobs, args.generate)
+    counts = {}
+    for status in run['stages'].values():
+        counts[status['status']] = counts.get(status['status'], 0) + 1
+    print(f"\n[pipeline] {', '.join(f'{count} {status}' for status, count in sorted(counts.items()))} "
+          f"in {run['seconds']:.3f}s")
+    return not (counts.get('failed') or counts.get('blocked'))
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,411 @@
+"""
+Indexed query backend for the policy explorer table.
+DataTable's custom filtering and sorting send a filter_query string and a
+sort_by list; these are parsed here and answered from per-column sort
+indexes (an argsort of each column's keys, built the first time the column
+is filtered or sorted on) so a page of rows can be served without scanning
+or sorting the whole dataset:
+
+- each filter clause is resolved to a range of positions in its column's
+  sorted order with two binary searches,
+- the most selective clause supplies the candidate rows and the remaining
+  clauses are checked on those rows only,
+- an unfiltered single-column sort reads the page straight out of the
+  column's sorted order.
+
+The indexes of a data version are saved under
+data/processed/policy_index/<data version>/ and memory-mapped, so dashboard
+worker processes build each one once and share its pages.
+"""
+
+import bisect
+import os
+import re
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+CLAUSE_PATTERN = re.compile(
+    r'^\{(?P<column>[^}]+)\}\s*'
+    r'(?P<operator>is blank|is nil|[si]?(?:contains|datestartswith|<=|>=|!=|=|<|>|eq|ne|lt|le|gt|ge))'
+    r'\s*(?P<value>.*)$'
+)
+OPERATOR_ALIASES = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}
+SORT_CACHE_SIZE = 4
+INDEX_DIR = 'policy_index'
+HISTORY_VERSIONS = 3
+
+
+class QueryError(ValueError):
+    """Raised for filter expressions the explorer cannot evaluate."""
+
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'`':
+        value = value[1:-1].replace('\\' + value[0], value[0])
+    return value
+
+
+def parse_filter_query(filter_query):
+    """Split a DataTable filter_query into (column, operator, value, case_sensitive) clauses."""
+    clauses = []
+    for part in (filter_query or '').split(' && '):
+        part = part.strip()
+        if not part:
+            continue
+        match = CLAUSE_PATTERN.match(part)
+        if match is None:
+            raise QueryError(f"Unsupported filter: {part}")
+        operator = match['operator']
+        case_sensitive = True
+        if operator[0] in 'si' and operator not in ('is blank', 'is nil'):
+            case_sensitive = operator[0] == 's'
+            operator = operator[1:]
+        operator = OPERATOR_ALIASES.get(operator, operator)
+        clauses.append((match['column'], operator, _unquote(match['value']), case_sensitive))
+    return clauses
+
+
+def position_dtype(n_rows):
+    """The narrowest integer dtype that holds row positions of a table of n_rows."""
+    return np.dtype(np.int32 if n_rows < 2 ** 31 else np.int64)
+
+
+def index_dir(data_dir, version):
+    """Where the column indexes of one data version are kept."""
+    return os.path.join(data_dir, INDEX_DIR, version)
+
+
+def _open_store(store):
+    """Create a version's index directory, dropping all but the newest versions."""
+    if os.path.isdir(store):
+        return
+    os.makedirs(store, exist_ok=True)
+    parent = os.path.dirname(store)
+    versions = sorted((entry for entry in os.scandir(parent) if entry.is_dir()),
+                      key=lambda entry: entry.stat().st_mtime)
+    for entry in versions[:-HISTORY_VERSIONS]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _stored(store, name, compute):
+    """Memory-map store/name.npy, computing and saving it first if no process has yet.
+
+    Without a store, or if it can't be written, the array is kept in memory.
+    """
+    if store is None:
+        return compute()
+    path = os.path.join(store, f'{name}.npy')
+    if not os.path.exists(path):
+        array = compute()
+        try:
+            _open_store(store)
+            # Processes building the same array race harmlessly: each replaces it whole
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+        except OSError:
+            return array
+    return np.load(path, mmap_mode='r')
+
+
+class ColumnIndex:
+    """Sort keys of one column and the row order that sorts them.
+
+    Numbers and dates are keyed by their own values, so the keys are the
+    column's array rather than a copy. Categoricals are keyed by their
+    codes, remapped to the order of their labels unless they are ordered;
+    other text by the dense rank of each value among the distinct values,
+    computed with Arrow. Missing values sort last, under the largest key of
+    an integer dtype. The order holds int32 positions below 2^31 rows and,
+    with a store directory, it and any derived keys are kept there as .npy
+    files and memory-mapped, so the worker processes share one copy.
+    """
+
+    def __init__(self, series, store=None):
+        self.kind = 'text'
+        self.categories = None
+        self.values = None
+        self.lexical = True
+        self.missing = None
+        name = series.name
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            labels = pd.Index(series.cat.categories.astype(str))
+            self.missing = np.iinfo(codes.dtype).max
+            if series.cat.ordered:
+                self.lexical = False
+                self.categories = labels
+                rank = np.arange(len(labels), dtype=codes.dtype)
+            else:
+                sorter = labels.argsort()
+                self.categories = labels[sorter]
+                rank = np.empty(len(labels), dtype=codes.dtype)
+                rank[sorter] = np.arange(len(labels), dtype=codes.dtype)
+            self.keys = _stored(store, f'{name}.keys',
+                                lambda: np.where(codes < 0, self.missing, rank[codes]).astype(codes.dtype))
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            self.kind = 'date'
+            values = series.to_numpy()
+            if values.dtype.kind != 'M':
+                values = series.to_numpy(dtype='datetime64[ns]')
+            self.unit = np.datetime_data(values.dtype)[0]
+            self.missing = np.iinfo(np.int64).max
+            keys = values.view(np.int64)
+            # NaT is the smallest int64; only then are the keys copied, to move it last
+            if np.isnat(values).any():
+                keys = _stored(store, f'{name}.keys', lambda: np.where(np.isnat(values), self.missing, keys))
+            self.keys = keys
+        elif pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            self.kind = 'number'
+            keys = series.to_numpy()
+            if keys.dtype.kind not in 'iuf':
+                # Nullable integers and the like; NaN already sorts last
+                keys = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            self.keys = keys
+        else:
+            if not isinstance(series.dtype, pd.StringDtype):
+                series = series.astype('string')
+            # Arrow-backed strings are used in place, chunked as they were read
+            values = pa.array(series, type=pa.large_string(), from_pandas=True)
+            self.values = values
+            self.missing = np.iinfo(np.int32).max
+            self.keys = _stored(store, f'{name}.keys', lambda: np.where(
+                values.is_null().to_numpy(zero_copy_only=False), self.missing,
+                pc.rank(values, tiebreaker='dense').to_numpy() - 1).astype(np.int32))
+        self.order = _stored(store, f'{name}.order',
+                             lambda: np.argsort(self.keys, kind='stable').astype(position_dtype(len(self.keys))))
+        self.valid = len(self.keys) - int(np.count_nonzero(self.is_missing(self.keys)))
+
+    def is_missing(self, keys):
+        return np.isnan(keys) if self.missing is None else keys == self.missing
+
+    def sorted_key(self, position):
+        """The key at a position of the sorted order."""
+        return self.keys[self.order[position]]
+
+    def sort_keys(self, rows=None, descending=False):
+        """Keys of the given rows (all by default) for np.lexsort, with missing values last either way."""
+        keys = self.keys if rows is None else self.keys[rows]
+        if not descending:
+            return keys
+        if self.missing is None:
+            return -keys
+        flipped = -keys.astype(np.int64)
+        flipped[self.is_missing(keys)] = np.iinfo(np.int64).max
+        return flipped
+
+    def key(self, value):
+        """Sort key of a filter value typed into this column."""
+        if self.kind == 'number':
+            try:
+                return float(value)
+            except ValueError:
+                raise QueryError(f"'{value}' is not a number") from None
+        if self.kind == 'date':
+            try:
+                return self.date_key(value)
+            except ValueError:
+                raise QueryError(f"'{value}' is not a date") from None
+        if self.categories is None:
+            # Binary search of the sorted values; a value that isn't present gets
+            # a key between its neighbours' ranks
+            position = bisect.bisect_left(self.order, value, 0, self.valid,
+                                          key=lambda row: self.values[int(row)].as_py())
+            if position == self.valid:
+                return (float(self.sorted_key(position - 1)) + 0.5) if position else -0.5
+            rank = float(self.sorted_key(position))
+            return rank if self.values[int(self.order[position])].as_py() == value else rank - 0.5
+        # A value that isn't present gets a key between its neighbours' codes
+        if value in self.categories:
+            return float(self.categories.get_loc(value))
+        return float(self.categories.searchsorted(value)) - 0.5 if self.lexical else -0.5
+
+    def date_key(self, value):
+        return int(pd.Timestamp(value).to_datetime64().astype(f'datetime64[{self.unit}]').view(np.int64))
+
+    def position(self, key, side):
+        search = bisect.bisect_left if side == 'left' else bisect.bisect_right
+        return search(self.order, key, 0, self.valid, key=self.keys.__getitem__)
+
+    def match(self, value, operator, case_sensitive):
+        """Rows whose text contains, or equals ignoring case, value, as a mask; text without categories only."""
+        if operator == 'contains':
+            mask = pc.match_substring(self.values, value, ignore_case=not case_sensitive)
+        else:
+            mask = pc.equal(pc.utf8_lower(self.values), value.lower())
+        return pc.fill_null(mask, False).to_numpy(zero_copy_only=False)
+
+
+class Clause:
+    """One filter clause, resolved against its column's index.
+
+    Most clauses select ranges of the column's sorted order; a text search
+    on a column without categories selects a mask of rows instead.
+    """
+
+    def __init__(self, index, operator, value, case_sensitive=True):
+        self.index = index
+        self.operator = operator
+        self.mask = None
+        self.ranges = self._ranges(operator, value, case_sensitive)
+
+    def _ranges(self, operator, value, case_sensitive):
+        index = self.index
+        if operator in ('is blank', 'is nil'):
+            return [(index.valid, len(index.keys))]
+        if index.kind == 'text' and (operator == 'contains' or (
+                operator in ('=', '!=') and not case_sensitive)):
+            if index.categories is None:
+                self.mask = index.match(value, operator, case_sensitive)
+                if operator == '!=':
+                    self.mask = ~self.mask & ~index.is_missing(index.keys)
+                return None
+            # Matched against the distinct values, then mapped to their row ranges
+            if operator == 'contains':
+                codes = np.flatnonzero(index.categories.str.contains(value, case=case_sensitive, regex=False))
+            else:
+                codes = np.flatnonzero(index.categories.str.lower() == value.lower())
+            equal = [(index.position(code, 'left'), index.position(code, 'right')) for code in codes]
+            if operator != '!=':
+                return equal
+            bounds = [0] + [position for span in equal for position in span] + [index.valid]
+            return list(zip(bounds[::2], bounds[1::2]))
+        if operator == 'contains':
+            operator = '='
+        if operator == 'datestartswith':
+            if index.kind == 'text' and index.lexical:
+                # ISO date strings: the prefix selects a contiguous run of values
+                return [(index.position(index.key(value), 'left'),
+                         index.position(index.key(value + '\uffff'), 'left'))]
+            if index.kind != 'date':
+                raise QueryError("datestartswith only applies to date columns")
+            # '2023' or '2023-04' selects that whole year or month
+            start = pd.Timestamp(value)
+            end = start + (pd.DateOffset(years=1) if len(value) <= 4 else
+                           pd.DateOffset(months=1) if len(value) <= 7 else pd.DateOffset(days=1))
+            return [(index.position(index.date_key(start), 'left'), index.position(index.date_key(end), 'left'))]
+
+        key = index.key(value)
+        left, right = index.position(key, 'left'), index.position(key, 'right')
+        return {
+            '=': [(left, right)],
+            '!=': [(0, left), (right, index.valid)],
+            '<': [(0, left)],
+            '<=': [(0, right)],
+            '>': [(right, index.valid)],
+            '>=': [(left, index.valid)],
+        }[operator]
+
+    def count(self):
+        if self.mask is not None:
+            return int(np.count_nonzero(self.mask))
+        return sum(stop - start for start, stop in self.ranges)
+
+    def rows(self):
+        """Row positions matching this clause, in ascending row order."""
+        order = self.index.order
+        if self.mask is not None:
+            return np.flatnonzero(self.mask).astype(order.dtype)
+        parts = [order[start:stop] for start, stop in self.ranges if stop > start]
+        rows = np.concatenate(parts) if parts else np.empty(0, dtype=order.dtype)
+        return np.sort(rows)
+
+    def matches(self, rows):
+        """Check this clause against the given rows only."""
+        if self.mask is not None:
+            return self.mask[rows]
+        index = self.index
+        keys = index.keys[rows]
+        mask = np.zeros(len(rows), dtype=bool)
+        for start, stop in self.ranges:
+            if stop <= start:
+                continue
+            if start >= index.valid:
+                mask |= index.is_missing(keys)
+            else:
+                mask |= (keys >= index.sorted_key(start)) & (keys <= index.sorted_key(stop - 1))
+        return mask
+
+
+class PolicyIndex:
+    """Serve filtered, sorted pages of a DataFrame from column indexes built on first use.
+
+    Only the columns a query filters or sorts on are indexed; store is the
+    directory to share them through (see index_dir()).
+    """
+
+    def __init__(self, df, columns=None, store=None):
+        self.df = df
+        self.columns = list(columns or df.columns)
+        self.store = store
+        self._indexes = {}
+        self._sorts = {}
+        self._lock = threading.Lock()
+
+    def index(self, column):
+        if column not in self.columns:
+            raise QueryError(f"Unknown column: {column}")
+        if column not in self._indexes:
+            with self._lock:
+                if column not in self._indexes:
+                    self._indexes[column] = ColumnIndex(self.df[column], self.store)
+        return self._indexes[column]
+
+    def filter_rows(self, filter_query):
+        """Row positions matching filter_query in ascending order, or None for all rows."""
+        clauses = [Clause(self.index(column), operator, value, case_sensitive)
+                   for column, operator, value, case_sensitive in parse_filter_query(filter_query)]
+        if not clauses:
+            return None
+        clauses.sort(key=Clause.count)
+        rows = clauses[0].rows()
+        for clause in clauses[1:]:
+            if not len(rows):
+                break
+            rows = rows[clause.matches(rows)]
+        return rows
+
+    def _sort_keys(self, rows, sort_by):
+        # np.lexsort sorts by the last key first
+        return [self.index(spec['column_id']).sort_keys(rows, spec.get('direction') == 'desc')
+                for spec in reversed(sort_by)]
+
+    def _sorted_all(self, sort_by):
+        """Row order for sort_by over the whole table, cached for repeat paging."""
+        if len(sort_by) == 1 and sort_by[0].get('direction') != 'desc':
+            return self.index(sort_by[0]['column_id']).order
+        key = tuple((spec['column_id'], spec.get('direction')) for spec in sort_by)
+        with self._lock:
+            if key in self._sorts:
+                return self._sorts[key]
+        # Ties keep row order and missing values stay last, as in ascending sorts
+        order = np.lexsort(self._sort_keys(None, sort_by)).astype(position_dtype(len(self.df)))
+        with self._lock:
+            self._sorts[key] = order
+            while len(self._sorts) > SORT_CACHE_SIZE:
+                self._sorts.pop(next(iter(self._sorts)))
+        return order
+
+    def page(self, page_current=0, page_size=25, sort_by=None, filter_query=''):
+        """Return (page DataFrame, total matching rows) for one table page."""
+        sort_by = [spec for spec in (sort_by or []) if spec.get('column_id') in self.columns]
+        rows = self.filter_rows(filter_query)
+        total = len(self.df) if rows is None else len(rows)
+        start = page_current * page_size
+        stop = min(start + page_size, total)
+
+        if rows is None:
+            selected = (self._sorted_all(sort_by)[start:stop] if sort_by
+                        else np.arange(start, max(start, stop)))
+        elif sort_by:
+            selected = rows[np.lexsort(self._sort_keys(rows, sort_by))][start:stop]
+        else:
+            selected = rows[start:stop]
+        return self.df.iloc[selected][self.columns], total
@@ -0,0 +1,362 @@
+"""
+Export the processed datasets for Power BI incremental refresh.
+Tables with a refreshPolicy in create_dataset_schema() (the policy data)
+are split into one CSV per month of their partition column, under
+<output-dir>/<table>/<YYYY-MM>.csv; the metric tables and the date
+dimension are exported whole. A manifest lists every file with its
+RangeStart/RangeEnd (RangeStart <= date < RangeEnd, as Power BI's
+incremental refresh filters them), row count and content hash.
+
+A rerun only replaces the files whose contents changed, and the manifest's
+"refresh" entry gives the RangeStart/RangeEnd spanning the changed months,
+so a refresh reloads those months instead of all history. If no source
+file changed since the last export, nothing is read at all.
+
+The date dimension (date_table.csv) is generated here, one row per day of
+the calendar years the policy dates span, and so are the DAX measure
+aggregates (measure_aggregates.csv, see dax_measures.py). Both are written
+to the data directory as well, so the relationships against them can be
+checked there.
+
+With --star the policy data is exported as the star schema instead: a
+fact table (insurance_fact) of integer surrogate keys, dates and measures,
+a dim_<attribute> table per text attribute, and measures.dax rewritten
+for those tables. Keys are kept stable from one export to the next.
+
+Usage:
+    python scripts/powerbi_export.py [--data-dir data/processed] [--output-dir data/processed/powerbi]
+    python scripts/powerbi_export.py --star
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from dataset_schema import check_header, load_table, table_columns, table_path
+from dax_measures import AGGREGATE_TABLE, MEASURES_FILE, write_measure_aggregates
+from generate_powerbi_report import STAR_DIMENSIONS, STAR_FACT_TABLE, create_dataset_schema
+from validate_powerbi_data import ValidationCache, content_hash
+
+CHUNK_ROWS = 1000000
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_FORMAT = 1
+DATE_TABLE = 'date_table'
+CSV_DATE_FORMAT = '%Y-%m-%d'
+# refreshPolicy granularity -> pandas period frequency
+PERIOD_FREQUENCIES = {'month': 'M'}
+# Exported whole, after the date dimension and the measure aggregates are generated
+WHOLE_TABLES = ['time_metrics', 'customer_metrics', 'region_metrics', DATE_TABLE, AGGREGATE_TABLE]
+GENERATED_TABLES = {DATE_TABLE, AGGREGATE_TABLE}
+
+
+def partitioned_tables(star=False):
+    """{table: refresh policy} for the tables the dataset schema exports in partitions."""
+    return {table['name']: table['refreshPolicy'] for table in create_dataset_schema(star)['tables']
+            if 'refreshPolicy' in table}
+
+
+def build_date_table(first, last):
+    """The date dimension: one row per day of the calendar years spanning first..last."""
+    dates = pd.date_range(f'{pd.Timestamp(first).year}-01-01', f'{pd.Timestamp(last).year}-12-31', freq='D')
+    return pd.DataFrame({
+        'Date': dates,
+        'Year': dates.year,
+        'Month': dates.month,
+        'MonthName': dates.month_name(),
+        'Quarter': dates.quarter,
+        'YearMonth': dates.strftime('%Y-%m'),
+        'WeekDay': dates.day_name(),
+        'WeekDayNo': dates.dayofweek + 1,
+        'WeekNo': dates.isocalendar()['week'].to_numpy(dtype='int64'),
+        'DayOfYear': dates.dayofyear,
+    })
+
+
+def schema_version(star=False):
+    """Version of the dataset schema the files were exported with."""
+    payload = json.dumps(create_dataset_schema(star), sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:12]
+
+
+def read_manifest(output_dir):
+    """The last export's manifest, or None."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE), 'r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return manifest if manifest.get('format') == MANIFEST_FORMAT else None
+
+
+def write_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+class SurrogateKeys:
+    """Integer keys for the star schema's text attributes, numbered from 1 as new labels are seen.
+
+    Keys already assigned by the last export are read back from its
+    dimension files, so a label keeps its key and unchanged months stay
+    byte-identical.
+    """
+
+    def __init__(self, output_dir, attributes=STAR_DIMENSIONS):
+        self.keys = {}
+        for attribute in attributes:
+            table = f'dim_{attribute}'
+            self.keys[attribute] = {}
+            if os.path.exists(table_path(output_dir, table)):
+                dimension = load_table(output_dir, table)
+                self.keys[attribute] = dict(zip(dimension[attribute].astype(str),
+                                                dimension[f'{attribute}_key'].tolist()))
+
+    def encode(self, chunk):
+        """A chunk of policies as fact rows: each attribute replaced by its key (blank stays blank)."""
+        for attribute, keys in self.keys.items():
+            values = chunk[attribute].astype('category')
+            labels = values.cat.categories.astype(str)
+            for label in labels:
+                keys.setdefault(label, len(keys) + 1)
+            # Code -1 (a blank) picks the trailing NA
+            lookup = pd.array([keys[label] for label in labels] + [pd.NA], dtype='Int64')
+            chunk[f'{attribute}_key'] = lookup[values.cat.codes.to_numpy()]
+        return chunk[list(table_columns(STAR_FACT_TABLE))]
+
+    def dimension(self, attribute):
+        keys = self.keys[attribute]
+        return pd.DataFrame({f'{attribute}_key': list(keys.values()), attribute: list(keys)})
+
+
+def star_measures(text):
+    """measures.dax for the star schema: attributes from their dimension, everything else from the fact."""
+    def column(match):
+        name = match.group(1)
+        return f'dim_{name}[{name}]' if name in STAR_DIMENSIONS else f'{STAR_FACT_TABLE}[{name}]'
+
+    text = re.sub(r'\binsurance_data\[(\w+)\]', column, text)
+    return re.sub(r'\binsurance_data\b', STAR_FACT_TABLE, text)
+
+
+def table_files(entry):
+    """The files of one table in a manifest, relative to the output directory."""
+    return [partition['file'] for partition in entry['partitions'].values()] if 'partitions' in entry \
+        else [entry['file']]
+
+
+def manifest_files(manifest):
+    return [name for entry in manifest['tables'].values() for name in table_files(entry)]
+
+
+def remove_table(output_dir, entry):
+    """Delete a table the last export wrote but this one doesn't."""
+    for name in table_files(entry):
+        path = os.path.join(output_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+    if 'partitions' in entry and entry['partitions']:
+        directory = os.path.dirname(os.path.join(output_dir, next(iter(entry['partitions'].values()))['file']))
+        if os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+
+
+def _place(tmp, path, previous_hash):
+    """Move a freshly written file into place unless it matches the previous export; returns its hash."""
+    digest = content_hash(tmp)
+    if digest == previous_hash and os.path.exists(path):
+        os.remove(tmp)
+    else:
+        os.replace(tmp, path)
+    return digest
+
+
+def write_partitions(data_dir, output_dir, table, policy, previous=None, chunk_rows=CHUNK_ROWS,
+                     source=None, transform=None):
+    """Split a table into one file per period of its partition column.
+
+    The rows are read from source (the table itself by default), each chunk
+    passed through transform if given. Returns ({period: manifest entry},
+    first date, last date). Files whose contents are unchanged from previous
+    (the last manifest's entries) are left untouched, and periods no longer
+    in the data are removed.
+    """
+    from features import FEATURES
+
+    previous = previous or {}
+    column, frequency = policy['partitionColumn'], PERIOD_FREQUENCIES[policy['granularity']]
+    os.makedirs(os.path.join(output_dir, table), exist_ok=True)
+    rows, first, last = {}, None, None
+    for chunk in load_table(data_dir, source or table, ignore=FEATURES, chunksize=chunk_rows):
+        if transform is not None:
+            chunk = transform(chunk)
+        periods = chunk[column].dt.to_period(frequency)
+        for period, part in chunk.groupby(periods, sort=False):
+            name = str(period)
+            with open(table_path(output_dir, table, name) + '.tmp', 'a' if name in rows else 'w', newline='') as f:
+                part.to_csv(f, header=name not in rows, index=False, date_format=CSV_DATE_FORMAT)
+            rows[name] = rows.get(name, 0) + len(part)
+        first = chunk[column].min() if first is None else min(first, chunk[column].min())
+        last = chunk[column].max() if last is None else max(last, chunk[column].max())
+
+    partitions = {}
+    for name in sorted(rows):
+        path = table_path(output_dir, table, name)
+        period = pd.Period(name, freq=frequency)
+        partitions[name] = {
+            'file': os.path.relpath(path, output_dir),
+            'RangeStart': period.start_time.strftime(CSV_DATE_FORMAT),
+            'RangeEnd': (period + 1).start_time.strftime(CSV_DATE_FORMAT),
+            'rows': rows[name],
+            'content_hash': _place(path + '.tmp', path, previous.get(name, {}).get('content_hash')),
+            'bytes': os.path.getsize(path),
+        }
+    for name in set(previous) - set(partitions):
+        path = table_path(output_dir, table, name)
+        if os.path.exists(path):
+            os.remove(path)
+    return partitions, first, last
+
+
+def write_file(output_dir, name, write, previous=None):
+    """Write one whole file through write(path), replacing the last export's only if it changed."""
+    path = os.path.join(output_dir, name)
+    write(path + '.tmp')
+    with open(path + '.tmp', 'rb') as f:
+        rows = max(sum(1 for _ in f) - 1, 0)
+    digest = _place(path + '.tmp', path, (previous or {}).get('content_hash'))
+    return {'file': name, 'rows': rows, 'content_hash': digest, 'bytes': os.path.getsize(path)}
+
+
+def write_date_table(data_dir, first, last):
+    """Generate date_table.csv in the data directory, rewriting it only if its contents change."""
+    path = table_path(data_dir, DATE_TABLE)
+    previous = content_hash(path) if os.path.exists(path) else None
+    build_date_table(first, last).to_csv(path + '.tmp', index=False, date_format=CSV_DATE_FORMAT)
+    _place(path + '.tmp', path, previous)
+
+
+def export_powerbi(data_dir='data/processed', output_dir='data/processed/powerbi', chunk_rows=CHUNK_ROWS,
+                  star=False):
+    """Export every table in the dataset schema, replacing only what changed; returns the manifest.
+
+    With star, the policy data is exported as the star schema's fact table
+    and dimensions, with measures.dax rewritten to match (see star_schema()).
+    """
+    began = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    policies = partitioned_tables(star)
+    previous = read_manifest(output_dir) or {'tables': {}}
+    cache = ValidationCache(data_dir)
+    sources = {f'{table}.csv': cache.content_hash(f'{table}.csv')
+               for table in ['insurance_data', *WHOLE_TABLES] if table not in GENERATED_TABLES}
+    sources['measures.dax'] = content_hash(MEASURES_FILE)
+    schema = schema_version(star)
+    if (previous.get('sources') == sources and previous.get('schema') == schema
+            and all(os.path.exists(os.path.join(output_dir, name)) for name in manifest_files(previous))):
+        cache.save()
+        # The last export's refresh range has been handed out; nothing is left to refresh
+        manifest = {**previous, 'refresh': {'RangeStart': None, 'RangeEnd': None, 'partitions': {}}}
+        if previous.get('refresh') != manifest['refresh']:
+            write_manifest(output_dir, manifest)
+        return {**manifest, 'timings': {'export_seconds': round(time.perf_counter() - began, 3)}}
+
+    before = previous['tables']
+    keys = SurrogateKeys(output_dir) if star else None
+    tables, refresh, first, last = {}, {}, None, None
+    for table, policy in policies.items():
+        written = before.get(table, {}).get('partitions', {})
+        partitions, table_first, table_last = write_partitions(
+            data_dir, output_dir, table, policy, written, chunk_rows,
+            source='insurance_data', transform=keys.encode if star else None)
+        tables[table] = {'partitionColumn': policy['partitionColumn'], 'granularity': policy['granularity'],
+                         'partitions': partitions}
+        # Periods that changed or are no longer in the data; Power BI drops the latter on refresh
+        refresh[table] = {name: partitions.get(name, written.get(name)) for name in set(partitions) | set(written)
+                          if partitions.get(name, {}).get('content_hash') != written.get(name, {}).get('content_hash')}
+        first = table_first if first is None else min(first, table_first)
+        last = table_last if last is None else max(last, table_last)
+    write_date_table(data_dir, first, last)
+    write_measure_aggregates(data_dir)
+
+    if star:
+        for attribute in STAR_DIMENSIONS:
+            table = f'dim_{attribute}'
+            tables[table] = write_file(output_dir, f'{table}.csv',
+                                       lambda path: keys.dimension(attribute).to_csv(path, index=False),
+                                       before.get(table))
+    for table in WHOLE_TABLES:
+        source = table_path(data_dir, table)
+        check_header(source, table)
+        tables[table] = write_file(output_dir, f'{table}.csv', lambda path: shutil.copyfile(source, path),
+                                   before.get(table))
+    for table in set(before) - set(tables):
+        remove_table(output_dir, before[table])
+    cache.save()
+
+    measures = os.path.join(output_dir, os.path.basename(MEASURES_FILE))
+    if star:
+        with open(MEASURES_FILE, 'r') as f:
+            text = star_measures(f.read())
+        with open(measures + '.tmp', 'w') as f:
+            f.write(text)
+        os.replace(measures + '.tmp', measures)
+    elif os.path.exists(measures):
+        os.remove(measures)
+
+    # Power BI refreshes one contiguous range; it spans every changed or removed period
+    changed = [entry for periods in refresh.values() for entry in periods.values()]
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'generated': datetime.now().isoformat(timespec='seconds'),
+        'model': 'star' if star else 'flat',
+        'sources': sources,
+        'schema': schema,
+        'tables': tables,
+        'refresh': {
+            'RangeStart': min((entry['RangeStart'] for entry in changed), default=None),
+            'RangeEnd': max((entry['RangeEnd'] for entry in changed), default=None),
+            'partitions': {table: sorted(periods) for table, periods in refresh.items()},
+        },
+    }
+    write_manifest(output_dir, manifest)
+    return {**manifest, 'timings': {'export_seconds': round(time.perf_counter() - began, 3)}}
+
+
+def main():
+    """Export the datasets and report which partitions need refreshing."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default='data/processed')
+    parser.add_argument('--output-dir', default='data/processed/powerbi')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--star', action='store_true',
+                        help='Export the policy data as a fact table of integer keys plus dimension tables')
+    args = parser.parse_args()
+
+    manifest = export_powerbi(args.data_dir, args.output_dir, args.chunk_rows, args.star)
+    for table, entry in manifest['tables'].items():
+        if 'partitions' in entry:
+            changed = manifest['refresh']['partitions'].get(table, [])
+            size = sum(partition['bytes'] for partition in entry['partitions'].values())
+            print(f"{table:<24}{len(entry['partitions']):>6,} partitions{size / 1e6:>10.1f} MB, "
+                  f"{len(changed):,} changed")
+        else:
+            print(f"{table:<24}{entry['rows']:>10,} rows{entry['bytes'] / 1e6:>10.1f} MB")
+    refresh = manifest['refresh']
+    if refresh['RangeStart'] is None:
+        print("\nNothing changed since the last export")
+    else:
+        print(f"\nRefresh RangeStart = {refresh['RangeStart']}, RangeEnd = {refresh['RangeEnd']}")
+    print(f"Exported in {manifest['timings']['export_seconds']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
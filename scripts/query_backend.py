@@ -0,0 +1,331 @@
+"""
+Aggregation backends for the dashboard.
+Pages ask for aggregated results only (group counts and means, binned
+histograms, box-plot quartiles, one page of policies, one customer) through
+the same small interface, answered either by pandas over the loaded frame or
+by an embedded SQLite database built from the processed data. With SQLite
+the dashboard never loads the policy table, so its memory no longer grows
+with the size of the book.
+
+Build the database with:
+    python scripts/query_backend.py [--data-dir data/processed]
+and run the dashboard with DASHBOARD_QUERY_BACKEND=sqlite.
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from dashboard_data import data_version
+from dataset_schema import load_table
+from policy_index import PolicyIndex, QueryError, parse_filter_query
+
+DATABASE_FILE = 'insurance.sqlite'
+TABLE = 'insurance_data'
+SOURCE_FILE = 'insurance_data.csv'
+LOAD_CHUNK_ROWS = 200000
+INDEXED_COLUMNS = ['customer_id', 'policy_date', 'region', 'customer_segment', 'annual_premium']
+HISTOGRAM_BINS = 30
+BOX_QUANTILES = {'q1': 0.25, 'median': 0.5, 'q3': 0.75}
+
+
+def _box_from_quartiles(stats):
+    """Add Tukey fences (1.5 IQR, clipped to the data) to per-group quartiles."""
+    iqr = stats['q3'] - stats['q1']
+    stats['lowerfence'] = np.maximum(stats['q1'] - 1.5 * iqr, stats['min'])
+    stats['upperfence'] = np.minimum(stats['q3'] + 1.5 * iqr, stats['max'])
+    return stats
+
+
+def _bin_edges(low, high, bins):
+    if low is None or high is None or not np.isfinite([low, high]).all():
+        return None
+    width = (high - low) / bins if high > low else 1.0
+    return low, width
+
+
+class PandasBackend:
+    """Aggregate over a DataFrame held in memory.
+
+    index_dir is where the explorer's column indexes are shared (see policy_index.py).
+    """
+
+    def __init__(self, df, index_dir=None):
+        self.df = df
+        self.index_dir = index_dir
+        self._index = None
+        self._lock = threading.Lock()
+
+    def numeric_columns(self):
+        return set(self.df.select_dtypes('number').columns)
+
+    def counts(self, by):
+        return self.df.groupby(by, observed=True).size().reset_index(name='policies')
+
+    def means(self, by, columns):
+        return self.df.groupby(by, observed=True)[columns].mean().reset_index()
+
+    def histogram(self, column, by, bins=HISTOGRAM_BINS):
+        values = self.df[column].replace([np.inf, -np.inf], np.nan)
+        edges = _bin_edges(values.min(), values.max(), bins)
+        if edges is None:
+            return pd.DataFrame(columns=[by, 'bin_start', 'bin_end', 'policies'])
+        low, width = edges
+        frame = pd.DataFrame({by: self.df[by].astype(str),
+                              'bin': np.minimum((values - low) // width, bins - 1)}).dropna()
+        counts = frame.groupby([by, 'bin']).size().reset_index(name='policies')
+        counts['bin_start'] = low + counts['bin'] * width
+        counts['bin_end'] = counts['bin_start'] + width
+        return counts[[by, 'bin_start', 'bin_end', 'policies']]
+
+    def box_stats(self, column, by):
+        grouped = self.df.groupby(by, observed=True)[column]
+        stats = grouped.agg(['count', 'mean', 'min', 'max']).rename(columns={'count': 'policies'})
+        for name, q in BOX_QUANTILES.items():
+            stats[name] = grouped.quantile(q)
+        return _box_from_quartiles(stats.reset_index())
+
+    def customer(self, customer_id, customer_index=None):
+        if customer_index is None:
+            from customer_index import CustomerIndex
+            customer_index = CustomerIndex.from_frame(self.df)
+        row = customer_index.lookup(customer_id, self.df['customer_id'].array)
+        return None if row is None else self.df.iloc[row].to_dict()
+
+    def page(self, page_current, page_size, sort_by, filter_query, columns):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = PolicyIndex(self.df, columns, self.index_dir)
+        return self._index.page(page_current, page_size, sort_by, filter_query)
+
+    def read_table(self):
+        return self.df
+
+
+class SQLiteBackend:
+    """Push aggregations down to an embedded SQLite database of the policy table."""
+
+    # Compared and sorted by category order rather than alphabetically
+    ORDERED_CATEGORIES = {'premium_category': ['Low', 'Medium', 'High', 'Premium']}
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connection()
+        self.columns = [row[1] for row in connection.execute(f'PRAGMA table_info({TABLE})')]
+        self.meta = dict(connection.execute('SELECT key, value FROM dataset_meta'))
+        self.rows = int(self.meta['rows'])
+        self.version = self.meta['data_version']
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads; open one per thread, read-only
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            self._local.connection = connection
+        return connection
+
+    def query(self, sql, params=()):
+        return pd.read_sql_query(sql, self._connection(), params=params)
+
+    def _column(self, name):
+        if name not in self.columns:
+            raise QueryError(f"Unknown column: {name}")
+        return f'"{name}"'
+
+    def _sort_key(self, name):
+        column = self._column(name)
+        categories = self.ORDERED_CATEGORIES.get(name)
+        if categories is None:
+            return column
+        cases = ' '.join(f"WHEN '{category}' THEN {i}" for i, category in enumerate(categories))
+        return f'(CASE {column} {cases} END)'
+
+    def counts(self, by):
+        column = self._column(by)
+        return self.query(f'SELECT {column}, COUNT(*) AS policies FROM {TABLE} '
+                          f'WHERE {column} IS NOT NULL GROUP BY {column} ORDER BY {self._sort_key(by)}')
+
+    def means(self, by, columns):
+        group = self._column(by)
+        averages = ', '.join(f'AVG({self._column(c)}) AS {self._column(c)}' for c in columns)
+        return self.query(f'SELECT {group}, {averages} FROM {TABLE} '
+                          f'WHERE {group} IS NOT NULL GROUP BY {group} ORDER BY {group}')
+
+    def histogram(self, column, by, bins=HISTOGRAM_BINS):
+        value, group = self._column(column), self._column(by)
+        low, high = self._connection().execute(f'SELECT MIN({value}), MAX({value}) FROM {TABLE}').fetchone()
+        edges = _bin_edges(low, high, bins)
+        if edges is None:
+            return pd.DataFrame(columns=[by, 'bin_start', 'bin_end', 'policies'])
+        low, width = edges
+        counts = self.query(
+            f'SELECT CAST({group} AS TEXT) AS {group}, MIN(CAST(({value} - ?) / ? AS INTEGER), ?) AS bin, '
+            f'COUNT(*) AS policies FROM {TABLE} WHERE {value} IS NOT NULL AND {group} IS NOT NULL '
+            f'GROUP BY 1, 2 ORDER BY 1, 2',
+            (low, width, bins - 1))
+        counts['bin_start'] = low + counts['bin'] * width
+        counts['bin_end'] = counts['bin_start'] + width
+        return counts[[by, 'bin_start', 'bin_end', 'policies']]
+
+    def box_stats(self, column, by):
+        """Quartiles by linear interpolation, as pandas computes them."""
+        value, group = self._column(column), self._column(by)
+        picks = []
+        for name, q in BOX_QUANTILES.items():
+            position = f'CAST((n - 1) * {q} AS INTEGER)'
+            picks.append(f'MAX(CASE WHEN i = {position} THEN v END) AS {name}_low')
+            picks.append(f'MAX(CASE WHEN i = MIN({position} + 1, n - 1) THEN v END) AS {name}_high')
+        stats = self.query(
+            f'WITH ranked AS (SELECT {group} AS grp, {value} AS v, '
+            f'ROW_NUMBER() OVER (PARTITION BY {group} ORDER BY {value}) - 1 AS i, '
+            f'COUNT(*) OVER (PARTITION BY {group}) AS n '
+            f'FROM {TABLE} WHERE {value} IS NOT NULL AND {group} IS NOT NULL) '
+            f'SELECT grp AS {group}, MAX(n) AS policies, AVG(v) AS mean, MIN(v) AS min, MAX(v) AS max, '
+            f'{", ".join(picks)} FROM ranked GROUP BY grp ORDER BY grp')
+        for name, q in BOX_QUANTILES.items():
+            fraction = (stats['policies'] - 1) * q % 1
+            stats[name] = stats[f'{name}_low'] + fraction * (stats[f'{name}_high'] - stats[f'{name}_low'])
+        stats = stats.drop(columns=[c for c in stats if c.endswith(('_low', '_high'))])
+        return _box_from_quartiles(stats)
+
+    def customer(self, customer_id, customer_index=None):
+        result = self.query(f'SELECT * FROM {TABLE} WHERE customer_id = ? LIMIT 1', (customer_id,))
+        return None if result.empty else result.iloc[0].to_dict()
+
+    def _where(self, filter_query):
+        """Translate DataTable filter clauses into a parameterized WHERE clause."""
+        conditions, params = [], []
+        for column, operator, value, case_sensitive in parse_filter_query(filter_query):
+            name = self._column(column)
+            numeric = column in self.numeric_columns()
+            if operator in ('is blank', 'is nil'):
+                conditions.append(f"({name} IS NULL OR {name} = '')")
+                continue
+            if operator == 'datestartswith':
+                conditions.append(f"{name} LIKE ? ESCAPE '\\'")
+                params.append(value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+                continue
+            if operator == 'contains' and not numeric:
+                if case_sensitive:
+                    conditions.append(f'INSTR({name}, ?) > 0')
+                else:
+                    conditions.append(f'INSTR(LOWER({name}), LOWER(?)) > 0')
+                params.append(value)
+                continue
+            if operator == 'contains':
+                operator = '='
+            if numeric:
+                try:
+                    params.append(float(value))
+                except ValueError:
+                    raise QueryError(f"'{value}' is not a number") from None
+                conditions.append(f'{name} {operator} ?')
+            elif column in self.ORDERED_CATEGORIES and operator not in ('=', '!='):
+                categories = self.ORDERED_CATEGORIES[column]
+                rank = categories.index(value) if value in categories else -0.5
+                conditions.append(f'{self._sort_key(column)} {operator} ?')
+                params.append(rank)
+            elif case_sensitive:
+                conditions.append(f'{name} {operator} ?')
+                params.append(value)
+            else:
+                conditions.append(f'LOWER({name}) {operator} LOWER(?)')
+                params.append(value)
+        return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+    def numeric_columns(self):
+        if not hasattr(self, '_numeric'):
+            types = {row[1]: row[2] for row in self._connection().execute(f'PRAGMA table_info({TABLE})')}
+            self._numeric = {name for name, kind in types.items() if kind.upper() in ('INTEGER', 'REAL')}
+        return self._numeric
+
+    def page(self, page_current, page_size, sort_by, filter_query, columns):
+        where, params = self._where(filter_query)
+        total = self._connection().execute(f'SELECT COUNT(*) FROM {TABLE}{where}', params).fetchone()[0]
+        order = [f"{self._sort_key(spec['column_id'])} {'DESC' if spec.get('direction') == 'desc' else 'ASC'} NULLS LAST"
+                 for spec in (sort_by or []) if spec.get('column_id') in self.columns]
+        # rowid follows the CSV's row order, so unsorted pages match PandasBackend's
+        order_by = ' ORDER BY ' + ', '.join(order + ['rowid'])
+        selected = ', '.join(self._column(c) for c in columns)
+        page = self.query(f'SELECT {selected} FROM {TABLE}{where}{order_by} LIMIT ? OFFSET ?',
+                          params + [page_size, page_current * page_size])
+        return page, total
+
+    def read_table(self):
+        """The whole policy table as a DataFrame, for exports."""
+        df = self.query(f'SELECT * FROM {TABLE} ORDER BY rowid')
+        for column, categories in self.ORDERED_CATEGORIES.items():
+            if column in df:
+                df[column] = pd.Categorical(df[column], categories=categories, ordered=True)
+        return df
+
+
+def write_sql_store(data_dir='data/processed'):
+    """Load insurance_data.csv and its derived features into an SQLite database, in chunks."""
+    from features import FEATURES, load_features, write_feature_store
+
+    source = os.path.join(data_dir, SOURCE_FILE)
+    version = data_version(source)
+    features = load_features(data_dir, version=version)
+    if features is None:
+        write_feature_store(data_dir)
+        features = load_features(data_dir, version=version)
+
+    path = os.path.join(data_dir, DATABASE_FILE)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    rows = 0
+    try:
+        for chunk in load_table(data_dir, 'insurance_data', ignore=FEATURES, chunksize=LOAD_CHUNK_ROWS):
+            # Dates are stored as ISO text, which sorts and prefix-matches like the dates
+            for column in chunk.select_dtypes('datetime').columns:
+                chunk[column] = chunk[column].dt.strftime('%Y-%m-%d')
+            for name, values in features.items():
+                values = values[rows:rows + len(chunk)]
+                chunk[name] = np.asarray(values.astype(object) if isinstance(values, pd.Categorical) else values)
+            chunk.to_sql(TABLE, connection, if_exists='append', index=False)
+            rows += len(chunk)
+        for column in INDEXED_COLUMNS:
+            connection.execute(f'CREATE INDEX idx_{column} ON {TABLE} ("{column}")')
+        connection.execute('CREATE TABLE dataset_meta (key TEXT PRIMARY KEY, value TEXT)')
+        connection.executemany('INSERT INTO dataset_meta VALUES (?, ?)',
+                               [('data_version', version), ('rows', str(rows))])
+        connection.commit()
+        connection.execute('ANALYZE')
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+    print(f"SQL store written for data version {version}: {rows:,} rows")
+    return version
+
+
+def open_sql_store(data_dir='data/processed'):
+    """Open the SQLite store if it exists and matches the current data, else return None."""
+    path = os.path.join(data_dir, DATABASE_FILE)
+    if not os.path.exists(path):
+        return None
+    backend = SQLiteBackend(path)
+    source = os.path.join(data_dir, SOURCE_FILE)
+    if os.path.exists(source) and data_version(source) != backend.version:
+        print(f"{DATABASE_FILE} is out of date with {SOURCE_FILE}; rebuild it with query_backend.py")
+        return None
+    return backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default='data/processed')
+    args = parser.parse_args()
+    write_sql_store(args.data_dir)
+
+
+if __name__ == "__main__":
+    main()
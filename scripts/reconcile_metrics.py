@@ -0,0 +1,240 @@
+"""
+Reconcile the published metric tables against the policy data.
+time_metrics.csv, customer_metrics.csv and region_metrics.csv are
+aggregates of insurance_data.csv, but nothing guarantees they were
+refreshed together. This stage recomputes every published column from the
+raw rows and reports each cell that differs from the published value by
+more than the table's rounding allows, along with groups missing from
+either side, so a stale or partial metrics refresh is caught.
+
+The raw data is read once, in chunks: each chunk is grouped by month x
+segment x region into counts, sums, minima and maxima, the partial cubes
+are merged, and every metric table is rolled up from the one cube.
+
+Usage:
+    python scripts/reconcile_metrics.py [--data-dir data/processed] [--chunk-rows 1000000] [--json]
+"""
+
+import argparse
+import hashlib
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset_schema import load_table
+
+CHUNK_ROWS = 1000000
+DIMENSIONS = ['month', 'customer_segment', 'region']
+# Bump when the way published columns are recomputed changes
+RECONCILE_VERSION = 2
+MAX_PRINTED_MISMATCHES = 10
+
+# table -> (key column in the table, cube dimension, {column: (how, source)}).
+# 'count' counts policies; 'ratio' and 'difference' combine two other
+# published columns, after rounding, as generate_powerbi_data.py does.
+METRIC_TABLES = {
+    'time_metrics': ('policy_date', 'month', {
+        'monthly_premium': ('sum', 'annual_premium'),
+        'monthly_claims': ('sum', 'claim_amount'),
+        'monthly_fraud_cases': ('sum', 'fraud_reported'),
+        'new_policies': ('count', None),
+    }),
+    'customer_metrics': ('customer_segment', 'customer_segment', {
+        'avg_age': ('mean', 'age'),
+        'min_age': ('min', 'age'),
+        'max_age': ('max', 'age'),
+        'customer_count': ('count', None),
+        'avg_premium': ('mean', 'annual_premium'),
+        'total_premium': ('sum', 'annual_premium'),
+        'avg_claim': ('mean', 'claim_amount'),
+        'total_claims': ('sum', 'claim_amount'),
+        'fraud_rate': ('mean', 'fraud_reported'),
+        'avg_tenure': ('mean', 'customer_tenure'),
+        'total_previous_claims': ('sum', 'previous_claims'),
+        'loss_ratio': ('ratio', ('total_claims', 'total_premium')),
+        'profit': ('difference', ('total_premium', 'total_claims')),
+    }),
+    'region_metrics': ('region', 'region', {
+        'total_premium': ('sum', 'annual_premium'),
+        'avg_premium': ('mean', 'annual_premium'),
+        'total_claims': ('sum', 'claim_amount'),
+        'avg_claim': ('mean', 'claim_amount'),
+        'fraud_cases': ('sum', 'fraud_reported'),
+        'fraud_rate': ('mean', 'fraud_reported'),
+        'customer_count': ('count', None),
+        'total_previous_claims': ('sum', 'previous_claims'),
+        'loss_ratio': ('ratio', ('total_claims', 'total_premium')),
+        'profit': ('difference', ('total_premium', 'total_claims')),
+    }),
+}
+# Published decimal places; a cell may differ by one unit in the last place
+DECIMALS = {'loss_ratio': 4}
+DEFAULT_DECIMALS = 2
+
+# Merging two partial cubes: how each cube statistic combines
+CUBE_MERGE = {'sum': 'sum', 'min': 'min', 'max': 'max'}
+
+
+def specification_version():
+    """Version of the reconciliation, for caching its results (see validate_powerbi_data.py)."""
+    payload = json.dumps({'version': RECONCILE_VERSION, 'tables': METRIC_TABLES, 'decimals': DECIMALS},
+                         sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:12]
+
+
+def cube_statistics(tables=METRIC_TABLES):
+    """The statistics the cube must hold for each source column: {column: [stats]}."""
+    needed = {}
+    for _, _, columns in tables.values():
+        for how, source in columns.values():
+            if how in ('sum', 'mean'):
+                needed.setdefault(source, set()).add('sum')
+            elif how in ('min', 'max'):
+                needed.setdefault(source, set()).add(how)
+    return {column: sorted(stats) for column, stats in needed.items()}
+
+
+def chunk_cube(chunk, statistics):
+    """Group one chunk of policies by DIMENSIONS into rows and the per-column statistics."""
+    keys = [chunk['policy_date'].dt.to_period('M').dt.to_timestamp().rename('month')]
+    keys += [chunk[dimension].astype(str) for dimension in DIMENSIONS[1:]]
+    grouped = chunk.groupby(keys, observed=True, sort=False)
+    cube = grouped.agg(statistics)
+    cube.columns = [f'{column}:{stat}' for column, stat in cube.columns]
+    cube['rows'] = grouped.size()
+    return cube
+
+
+def _merge(cube, by):
+    how = {name: CUBE_MERGE.get(name.rsplit(':', 1)[-1], 'sum') for name in cube.columns}
+    return cube.groupby(level=by, sort=True).agg(how)
+
+
+def build_cube(data_dir, chunk_rows=CHUNK_ROWS, tables=METRIC_TABLES):
+    """One chunked pass over insurance_data.csv, merged into a single month x segment x region cube."""
+    from features import FEATURES
+
+    statistics = cube_statistics(tables)
+    columns = sorted(set(statistics) | {'policy_date', *DIMENSIONS[1:]})
+    cube, rows = None, 0
+    for chunk in load_table(data_dir, 'insurance_data', usecols=columns, ignore=FEATURES, chunksize=chunk_rows):
+        part = chunk_cube(chunk, statistics)
+        cube = part if cube is None else _merge(pd.concat([cube, part]), DIMENSIONS)
+        rows += len(chunk)
+    return cube, rows
+
+
+def recompute_table(cube, dimension, columns):
+    """A metric table's published columns recomputed from the cube, indexed by its key."""
+    totals = _merge(cube, dimension)
+    values = {}
+    # Combined columns come after the columns they combine
+    for name, (how, source) in columns.items():
+        if how == 'count':
+            value = totals['rows']
+        elif how == 'mean':
+            value = totals[f'{source}:sum'] / totals['rows']
+        elif how == 'ratio':
+            value = values[source[0]] / values[source[1]]
+        elif how == 'difference':
+            value = values[source[0]] - values[source[1]]
+        else:
+            value = totals[f'{source}:{how}']
+        values[name] = value.round(DECIMALS.get(name, DEFAULT_DECIMALS))
+    return pd.DataFrame(values)
+
+
+def _label(key):
+    return key.strftime('%Y-%m') if isinstance(key, pd.Timestamp) else str(key)
+
+
+def diff_table(published, recomputed, key, columns):
+    """Cells of a published table that differ from the recomputed ones by more than their rounding."""
+    published = published.set_index(published[key].astype(recomputed.index.dtype))
+    duplicated = published.index[published.index.duplicated()].unique()
+    published = published[~published.index.duplicated()]
+    missing = recomputed.index.difference(published.index)
+    unexpected = published.index.difference(recomputed.index)
+    shared = recomputed.index.intersection(published.index)
+
+    mismatches = []
+    for column in columns:
+        expected = recomputed.loc[shared, column].to_numpy(dtype=np.float64)
+        actual = published.loc[shared, column].to_numpy(dtype=np.float64)
+        tolerance = 10.0 ** -DECIMALS.get(column, DEFAULT_DECIMALS) + 1e-9
+        wrong = ~np.isclose(actual, expected, rtol=0, atol=tolerance, equal_nan=True)
+        for position in np.flatnonzero(wrong):
+            mismatches.append({'key': _label(shared[position]), 'column': column,
+                               'published': float(actual[position]), 'recomputed': float(expected[position]),
+                               'difference': float(actual[position] - expected[position])})
+    return {
+        'rows': len(published),
+        'cells_checked': len(shared) * len(columns),
+        'mismatches': mismatches,
+        'missing_groups': [_label(value) for value in missing],
+        'unexpected_groups': [_label(value) for value in unexpected],
+        'duplicated_groups': [_label(value) for value in duplicated],
+        'passed': not (mismatches or len(missing) or len(unexpected) or len(duplicated)),
+    }
+
+
+def reconcile(data_dir='data/processed', chunk_rows=CHUNK_ROWS, tables=METRIC_TABLES):
+    """Recompute every metric table from insurance_data.csv and diff it against the published one."""
+    began = time.perf_counter()
+    cube, rows = build_cube(data_dir, chunk_rows, tables)
+    aggregated = time.perf_counter()
+    results = {}
+    for table, (key, dimension, columns) in tables.items():
+        recomputed = recompute_table(cube, dimension, columns)
+        results[table] = diff_table(load_table(data_dir, table), recomputed, key, columns)
+    finished = time.perf_counter()
+    return {
+        'source_rows': rows,
+        'cube_cells': len(cube),
+        'tables': results,
+        'passed': all(result['passed'] for result in results.values()),
+        'timings': {'aggregate_seconds': round(aggregated - began, 3),
+                    'compare_seconds': round(finished - aggregated, 3)},
+    }
+
+
+def print_reconciliation(results):
+    print("\nMetric Reconciliation:")
+    print("-" * 50)
+    for table, result in results['tables'].items():
+        status = "✓" if result['passed'] else "✗"
+        print(f"{status} {table}: {result['cells_checked']:,} cells, {len(result['mismatches']):,} mismatched")
+        if result['missing_groups']:
+            print(f"    missing groups: {', '.join(result['missing_groups'])}")
+        if result['unexpected_groups']:
+            print(f"    groups not in the data: {', '.join(result['unexpected_groups'])}")
+        if result['duplicated_groups']:
+            print(f"    groups published more than once: {', '.join(result['duplicated_groups'])}")
+        for mismatch in result['mismatches'][:MAX_PRINTED_MISMATCHES]:
+            print(f"    {mismatch['key']} {mismatch['column']}: published {mismatch['published']:,.4f}, "
+                  f"recomputed {mismatch['recomputed']:,.4f}")
+        if len(result['mismatches']) > MAX_PRINTED_MISMATCHES:
+            print(f"    ... and {len(result['mismatches']) - MAX_PRINTED_MISMATCHES:,} more")
+
+
+def main():
+    """Reconcile the metric tables and print or dump the differences."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default='data/processed')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    results = reconcile(args.data_dir, args.chunk_rows)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print_reconciliation(results)
+    print(f"\n{results['source_rows']:,} policies aggregated into {results['cube_cells']:,} cells in "
+          f"{results['timings']['aggregate_seconds']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
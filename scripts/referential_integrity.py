@@ -0,0 +1,238 @@
+"""
+Referential-integrity checks for the relationships in the dataset schema.
+Every relationship declared in create_dataset_schema() (segment, region,
+and the policy dates against date_table.Date) is checked as a many-to-one
+join: each non-blank key on the "from" side must exist on the "to" side,
+and the "to" side's keys must be unique.
+
+The "from" table is read in chunks and joined on its distinct values
+rather than its rows: text columns arrive as categoricals, so a chunk's
+keys are looked up once per category and mapped back to the rows through
+the categorical codes (other columns are factorized the same way). The
+"to" keys are held as a hash index, or with --bloom as a fixed-size Bloom
+filter, which bounds memory however many keys there are at the cost of
+possibly missing a few orphans (the false-positive rate is reported).
+
+Usage:
+    python scripts/referential_integrity.py [--data-dir data/processed] [--bloom] [--json]
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset_schema import load_table, table_path
+from generate_powerbi_report import create_dataset_schema
+
+CHUNK_ROWS = 1000000
+ORPHAN_SAMPLES = 10
+BLOOM_BYTES = 16 * 1024 * 1024
+BLOOM_HASHES = 7
+# Bump when the checks change in a way that invalidates cached results
+INTEGRITY_VERSION = 1
+
+
+def relationships():
+    """The relationships declared in the dataset schema."""
+    return create_dataset_schema()['relationships']
+
+
+def specification_version(bloom=False):
+    """Version of the checks, for caching their results (see validate_powerbi_data.py)."""
+    payload = json.dumps({'version': INTEGRITY_VERSION, 'relationships': relationships(),
+                          'bloom': [BLOOM_BYTES, BLOOM_HASHES] if bloom else None}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:12]
+
+
+def _comparable(values):
+    """Keys in one representation on both sides: dates as datetime64[ns], everything else as text."""
+    values = pd.Index(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype('datetime64[ns]')
+    return values.astype(str)
+
+
+def distinct_codes(series):
+    """Each row's code into the column's distinct values (-1 for blanks), and those values."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), _comparable(series.cat.categories)
+    codes, values = pd.factorize(series)
+    return codes, _comparable(values)
+
+
+class BloomFilter:
+    """A Bloom filter over value hashes in a fixed number of bytes (a power of two)."""
+
+    def __init__(self, n_bytes=BLOOM_BYTES, n_hashes=BLOOM_HASHES):
+        self.bits = np.zeros(n_bytes, dtype=np.uint8)
+        self.mask = np.uint64(n_bytes * 8 - 1)
+        self.n_hashes = n_hashes
+        self.added = 0
+
+    def _positions(self, values):
+        hashes = pd.util.hash_array(values.to_numpy())
+        first, step = hashes & np.uint64(0xFFFFFFFF), (hashes >> np.uint64(32)) | np.uint64(1)
+        for i in range(self.n_hashes):
+            yield (first + np.uint64(i) * step) & self.mask
+
+    def add(self, values):
+        for positions in self._positions(values):
+            np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                             np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+        self.added += len(values)
+
+    def contains(self, values):
+        found = np.ones(len(values), dtype=bool)
+        for positions in self._positions(values):
+            found &= ((self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7))) & 1).astype(bool)
+        return found
+
+    def false_positive_rate(self):
+        bits = len(self.bits) * 8
+        return (1 - math.exp(-self.n_hashes * self.added / bits)) ** self.n_hashes
+
+
+def load_keys(data_dir, table, column, chunk_rows=CHUNK_ROWS, bloom=False):
+    """The "to" side's keys as (membership test, duplicate key count, Bloom filter).
+
+    With bloom duplicates can't be counted and are None; otherwise the filter is None.
+    """
+    if bloom:
+        keys = BloomFilter()
+        for chunk in load_table(data_dir, table, usecols=[column], chunksize=chunk_rows):
+            keys.add(distinct_codes(chunk[column])[1])
+        return keys.contains, None, keys
+    series = load_table(data_dir, table, usecols=[column])[column].dropna()
+    keys = _comparable(series.unique())
+    return lambda values: values.isin(keys), int(len(series) - len(keys)), None
+
+
+class RelationshipCheck:
+    """Orphan rows of one many-to-one relationship, accumulated chunk by chunk."""
+
+    def __init__(self, data_dir, relationship, chunk_rows=CHUNK_ROWS, bloom=False):
+        self.column = relationship['fromColumn']
+        self.contains, self.duplicate_keys, self.bloom_filter = load_keys(
+            data_dir, relationship['toTable'], relationship['toColumn'], chunk_rows, bloom)
+        self.rows = self.blank_rows = self.orphan_rows = 0
+        self.orphans = pd.Index([])
+        self.sample_counts, self.first_lines = {}, []
+
+    def update(self, chunk):
+        codes, values = distinct_codes(chunk[self.column])
+        missing = ~self.contains(values)
+        valid = codes >= 0
+        orphaned = np.zeros(len(codes), dtype=bool)
+        orphaned[valid] = missing[codes[valid]]
+
+        counts = np.bincount(codes[valid], minlength=len(values))
+        missing &= counts > 0
+        for position in np.flatnonzero(missing):
+            value = values[position]
+            label = str(value.date() if isinstance(value, pd.Timestamp) else value)
+            if label in self.sample_counts or len(self.sample_counts) < ORPHAN_SAMPLES:
+                self.sample_counts[label] = self.sample_counts.get(label, 0) + int(counts[position])
+        self.orphans = self.orphans.union(values[missing].astype(str))
+        # File line numbers: the header is line 1
+        lines = self.rows + np.flatnonzero(orphaned)[:ORPHAN_SAMPLES - len(self.first_lines)] + 2
+        self.first_lines.extend(lines.tolist())
+
+        self.rows += len(codes)
+        self.blank_rows += int(np.count_nonzero(~valid))
+        self.orphan_rows += int(np.count_nonzero(orphaned))
+
+    def result(self):
+        result = {
+            'rows': self.rows,
+            'blank_rows': self.blank_rows,
+            'orphan_rows': self.orphan_rows,
+            'orphan_values': len(self.orphans),
+            'samples': [{'value': value, 'rows': count} for value, count in self.sample_counts.items()],
+            'first_orphan_lines': self.first_lines,
+            'duplicate_keys': self.duplicate_keys,
+            'passed': self.orphan_rows == 0 and not self.duplicate_keys,
+        }
+        if self.bloom_filter is not None:
+            # Orphans whose key collides in the filter are missed; counts are lower bounds
+            result['false_positive_rate'] = self.bloom_filter.false_positive_rate()
+        return result
+
+
+def check_integrity(data_dir='data/processed', chunk_rows=CHUNK_ROWS, bloom=False):
+    """Check every relationship in the dataset schema, reading each "from" table once."""
+    began = time.perf_counter()
+    results, checks = {}, {}
+    for relationship in relationships():
+        name = relationship['name']
+        results[name] = {'from': f"{relationship['fromTable']}.{relationship['fromColumn']}",
+                         'to': f"{relationship['toTable']}.{relationship['toColumn']}"}
+        missing = [table for table in (relationship['fromTable'], relationship['toTable'])
+                   if not os.path.exists(table_path(data_dir, table))]
+        if missing:
+            results[name].update(passed=None, skipped=f"no {', '.join(f'{table}.csv' for table in missing)}")
+            continue
+        checks.setdefault(relationship['fromTable'], {})[name] = RelationshipCheck(
+            data_dir, relationship, chunk_rows, bloom)
+
+    for table, table_checks in checks.items():
+        columns = sorted({check.column for check in table_checks.values()})
+        for chunk in load_table(data_dir, table, usecols=columns, chunksize=chunk_rows):
+            for check in table_checks.values():
+                check.update(chunk)
+        for name, check in table_checks.items():
+            results[name].update(check.result())
+
+    return {
+        'mode': 'bloom' if bloom else 'exact',
+        'relationships': results,
+        'passed': all(result['passed'] is not False for result in results.values()),
+        'timings': {'check_seconds': round(time.perf_counter() - began, 3)},
+    }
+
+
+def print_integrity(results):
+    print(f"\nReferential Integrity ({results['mode']}):")
+    print("-" * 50)
+    for name, result in results['relationships'].items():
+        status = "–" if result['passed'] is None else "✓" if result['passed'] else "✗"
+        if result['passed'] is None:
+            print(f"{status} {name}: {result['from']} -> {result['to']} skipped, {result['skipped']}")
+            continue
+        print(f"{status} {name}: {result['from']} -> {result['to']}: {result['orphan_rows']:,} orphan rows "
+              f"({result['orphan_values']:,} keys) of {result['rows']:,}")
+        if result['blank_rows']:
+            print(f"    {result['blank_rows']:,} rows with a blank key")
+        if result['samples']:
+            print("    orphaned keys: " + ", ".join(f"{sample['value']} ({sample['rows']:,} rows)"
+                                                  for sample in result['samples']))
+            print(f"    first orphan lines: {', '.join(str(line) for line in result['first_orphan_lines'])}")
+        if result['duplicate_keys']:
+            print(f"    {result['duplicate_keys']:,} duplicate keys in {result['to']}")
+        if 'false_positive_rate' in result:
+            print(f"    Bloom filter false-positive rate {result['false_positive_rate']:.2e}")
+
+
+def main():
+    """Check the schema's relationships and print or dump the orphans."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default='data/processed')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--bloom', action='store_true', help='Hold the keys in a fixed-size Bloom filter')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    results = check_integrity(args.data_dir, args.chunk_rows, args.bloom)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print_integrity(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Streaming report exports for the dashboard.
+Writes Excel workbooks in constant-memory mode and compressed CSV/Parquet
+bundles straight to a temporary file, so large books never sit in memory.
+"""
+
+import os
+import io
+import tempfile
+import threading
+import zipfile
+from datetime import datetime
+
+import pandas as pd
+
+# Excel hard limit is 1,048,576 rows per sheet, one of which is the header
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_DATA_ROWS = EXCEL_MAX_ROWS - 1
+EXPORT_CHUNK_ROWS = 50000
+EXPORT_FORMATS = {
+    'xlsx': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': ('csv.zip', 'application/zip'),
+    'parquet': ('parquet.zip', 'application/zip'),
+}
+
+# Bound the number of exports being built at once so that concurrent
+# downloads queue up instead of each holding a writer in memory.
+MAX_CONCURRENT_EXPORTS = int(os.environ.get('DASHBOARD_MAX_CONCURRENT_EXPORTS', 2))
+_export_slots = threading.BoundedSemaphore(MAX_CONCURRENT_EXPORTS)
+
+
+def build_summary(df):
+    """Build the summary sheet shown at the end of every export."""
+    return pd.DataFrame({
+        'Metric': [
+            'Total Premium',
+            'Total Claims',
+            'Fraud Rate',
+            'Number of Policies',
+            'Average Premium',
+            'Average Claim'
+        ],
+        'Value': [
+            f"${df['annual_premium'].sum():,.2f}",
+            f"${df['claim_amount'].sum():,.2f}",
+            f"{df['fraud_reported'].mean()*100:.1f}%",
+            f"{len(df):,}",
+            f"${df['annual_premium'].mean():,.2f}",
+            f"${df['claim_amount'].mean():,.2f}"
+        ]
+    })
+
+
+def iter_row_chunks(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield lists of plain Python rows, converting values xlsxwriter can't write."""
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        converted = {}
+        for column in chunk.columns:
+            series = chunk[column]
+            if pd.api.types.is_datetime64_any_dtype(series) or isinstance(series.dtype, pd.PeriodDtype):
+                series = series.astype(str)
+            elif isinstance(series.dtype, pd.CategoricalDtype):
+                series = series.astype(object)
+            converted[column] = series.astype(object).where(series.notna(), None)
+        yield list(zip(*(converted[column].tolist() for column in chunk.columns)))
+
+
+def sheet_parts(name, n_rows, max_rows=EXCEL_MAX_DATA_ROWS):
+    """Return (sheet_name, start, stop) for each sheet a table is split across."""
+    if n_rows <= max_rows:
+        return [(name, 0, n_rows)]
+    parts = []
+    for i, start in enumerate(range(0, n_rows, max_rows), 1):
+        suffix = f' ({i})'
+        parts.append((name[:31 - len(suffix)] + suffix, start, min(start + max_rows, n_rows)))
+    return parts
+
+
+def write_excel(path, sheets, max_rows=EXCEL_MAX_DATA_ROWS):
+    """Write sheets to an xlsx file using xlsxwriter's constant-memory mode.
+
+    Rows are flushed to disk as they are written, so memory stays flat no
+    matter how large the tables are. Tables longer than the Excel row limit
+    are split across numbered sheets.
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True})
+    header_format = workbook.add_format({
+        'bold': True,
+        'font_color': 'white',
+        'bg_color': '#2c3e50',
+        'border': 1
+    })
+    try:
+        for name, frame in sheets.items():
+            for sheet_name, start, stop in sheet_parts(name, len(frame), max_rows):
+                worksheet = workbook.add_worksheet(sheet_name)
+                worksheet.set_column('A:Z', 15)
+                worksheet.write_row(0, 0, [str(c) for c in frame.columns], header_format)
+                row = 1
+                for rows in iter_row_chunks(frame.iloc[start:stop]):
+                    for values in rows:
+                        worksheet.write_row(row, 0, values)
+                        row += 1
+    finally:
+        workbook.close()
+
+
+def write_csv_bundle(path, sheets, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Write each sheet as a deflate-compressed CSV inside a zip archive."""
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        for name, frame in sheets.items():
+            member = name.lower().replace(' ', '_') + '.csv'
+            with bundle.open(member, 'w', force_zip64=True) as raw:
+                with io.TextIOWrapper(raw, encoding='utf-8', newline='') as handle:
+                    frame.to_csv(handle, index=False, chunksize=chunk_rows)
+
+
+def write_parquet_bundle(path, sheets, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Write each sheet as a Parquet file inside a zip archive (requires pyarrow)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED) as bundle:
+        for name, frame in sheets.items():
+            member = name.lower().replace(' ', '_') + '.parquet'
+            with bundle.open(member, 'w', force_zip64=True) as raw:
+                writer = None
+                try:
+                    for start in range(0, max(len(frame), 1), chunk_rows):
+                        table = pa.Table.from_pandas(frame.iloc[start:start + chunk_rows],
+                                                     preserve_index=False)
+                        if writer is None:
+                            writer = pq.ParquetWriter(raw, table.schema, compression='zstd')
+                        writer.write_table(table)
+                finally:
+                    if writer is not None:
+                        writer.close()
+
+
+WRITERS = {
+    'xlsx': write_excel,
+    'csv': write_csv_bundle,
+    'parquet': write_parquet_bundle,
+}
+
+
+def export_report(sheets, export_format='xlsx', directory=None):
+    """Write sheets to a temporary file and return (path, download_name, mimetype).
+
+    The caller owns the returned file and should delete it once it has been
+    served. At most MAX_CONCURRENT_EXPORTS exports are built at a time.
+    """
+    if export_format not in WRITERS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    extension, mimetype = EXPORT_FORMATS[export_format]
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    fd, path = tempfile.mkstemp(prefix='insurance_report_', suffix=f'.{extension}', dir=directory)
+    os.close(fd)
+
+    with _export_slots:
+        try:
+            WRITERS[export_format](path, sheets)
+        except Exception:
+            os.remove(path)
+            raise
+
+    return path, f'insurance_report_{timestamp}.{extension}', mimetype
@@ -0,0 +1,239 @@
+"""
+Deterministic stratified samples of the insurance dataset.
+Each row gets a stable pseudo-random key from a hash of its customer_id, and
+every customer_segment x region stratum keeps the rows with the smallest
+keys (a bottom-k reservoir). Samples of several sizes are drawn from the
+reservoirs with proportional allocation and a per-stratum floor, so small
+segments stay visible and the same data always yields the same sample.
+
+Bottom-k reservoirs merge exactly, so when rows are appended to
+insurance_data.csv only the new rows are read and folded in. The samples
+are keyed on the data version of the file they were drawn from, and are
+not loaded for any other version.
+
+Usage:
+    python scripts/sampling.py [--data-dir data/processed] [--rebuild]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from dashboard_data import data_version
+from dataset_schema import check_header, load_table
+
+SAMPLE_SIZES = (500, 1000, 2000, 5000)
+# Rows kept per stratum; the largest sample size unless sizes are overridden
+RESERVOIR_SIZE = max(SAMPLE_SIZES)
+STRATA = ['customer_segment', 'region']
+KEY_COLUMN = 'customer_id'
+MIN_PER_STRATUM = 20
+SOURCE_FILE = 'insurance_data.csv'
+SAMPLES_DIR = 'samples'
+TAIL_BYTES = 4096
+MANIFEST_VERSION = 2
+
+
+def sample_keys(df):
+    """Stable uint64 sampling key for each row."""
+    return pd.util.hash_pandas_object(df[KEY_COLUMN].astype(str), index=False).to_numpy()
+
+
+def stratum_labels(df):
+    labels = df[STRATA[0]].astype(str)
+    for column in STRATA[1:]:
+        labels = labels + '|' + df[column].astype(str)
+    return labels
+
+
+def bottom_k(df, k):
+    """Keep the k rows with the smallest sampling key in each stratum, ordered by key."""
+    if df.empty:
+        return df
+    ranked = df.assign(_key=sample_keys(df), _stratum=stratum_labels(df))
+    ranked = ranked.sort_values(['_stratum', '_key'], kind='stable')
+    ranked = ranked[ranked.groupby('_stratum', sort=False).cumcount() < k]
+    return ranked.drop(columns=['_key', '_stratum']).reset_index(drop=True)
+
+
+def allocate(counts, size, minimum=MIN_PER_STRATUM):
+    """Split size across strata in proportion to counts, with a floor per stratum."""
+    counts = pd.Series(counts, dtype='int64')
+    if size >= counts.sum():
+        return counts
+    base = np.minimum(counts, minimum)
+    if base.sum() >= size:
+        # More strata than the sample can hold at the floor; share it out evenly
+        base = np.minimum(counts, size // len(counts))
+    capacity = counts - base
+    remaining = size - base.sum()
+    quota = capacity / capacity.sum() * remaining if capacity.sum() else capacity * 0.0
+    allocation = base + np.floor(quota).astype('int64')
+    leftover = int(size - allocation.sum())
+    if leftover > 0:
+        fractions = (quota - np.floor(quota))[allocation < counts]
+        for stratum in fractions.sort_values(ascending=False).index[:leftover]:
+            allocation[stratum] += 1
+    return allocation
+
+
+def draw_sample(reservoir, counts, size):
+    """Take a sample of the given size from the per-stratum reservoirs."""
+    allocation = allocate(counts, size)
+    labels = stratum_labels(reservoir)
+    rank = reservoir.assign(_key=sample_keys(reservoir), _stratum=labels).sort_values(
+        ['_stratum', '_key'], kind='stable').groupby('_stratum', sort=False).cumcount()
+    keep = rank.sort_index() < labels.map(allocation).fillna(0).to_numpy()
+    return reservoir[keep.to_numpy()].reset_index(drop=True)
+
+
+def _tail_digest(path, size):
+    with open(path, 'rb') as f:
+        f.seek(max(0, size - TAIL_BYTES))
+        return hashlib.sha1(f.read(size - max(0, size - TAIL_BYTES))).hexdigest()
+
+
+def _read_appended(path, columns, offset):
+    """Read the rows written to a CSV after byte offset, given the file's header."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        if not f.read(1):
+            return pd.DataFrame(columns=columns)
+        f.seek(offset)
+        return pd.read_csv(f, header=None, names=columns)
+
+
+def read_manifest(samples_dir):
+    path = os.path.join(samples_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+
+def refresh_samples(data_dir='data/processed', sizes=SAMPLE_SIZES, rebuild=False):
+    """Build or incrementally update the samples under data_dir/samples.
+
+    Returns the manifest that was written.
+    """
+    from features import FEATURES
+
+    source = os.path.join(data_dir, SOURCE_FILE)
+    samples_dir = os.path.join(data_dir, SAMPLES_DIR)
+    os.makedirs(samples_dir, exist_ok=True)
+    sizes = sorted(int(size) for size in sizes)
+    source_bytes = os.path.getsize(source)
+    version = data_version(source)
+    manifest = None if rebuild else read_manifest(samples_dir)
+
+    # A file of the same size is either unchanged or was edited in place, which needs a rebuild
+    appended = (
+        manifest is not None
+        and manifest['sizes'] == sizes
+        and manifest['strata'] == STRATA
+        and (source_bytes > manifest['source']['bytes'] or manifest['source']['data_version'] == version)
+        and _tail_digest(source, manifest['source']['bytes']) == manifest['source']['tail_sha1']
+    )
+    header = check_header(source, 'insurance_data', ignore=FEATURES)
+    if appended:
+        reservoir = pd.read_csv(os.path.join(samples_dir, 'reservoir.csv'))
+        new_rows = _read_appended(source, header, manifest['source']['bytes'])[list(reservoir.columns)]
+        if new_rows.empty:
+            return manifest
+        counts = pd.Series(manifest['counts'], dtype='int64').add(
+            stratum_labels(new_rows).value_counts(), fill_value=0).astype('int64')
+        reservoir = bottom_k(pd.concat([reservoir, new_rows], ignore_index=True), max(sizes))
+        rows = manifest['source']['rows'] + len(new_rows)
+        mode = f'appended {len(new_rows):,} rows'
+    else:
+        df = load_table(data_dir, 'insurance_data', ignore=FEATURES)
+        counts = stratum_labels(df).value_counts()
+        reservoir = bottom_k(df, max(sizes))
+        rows = len(df)
+        mode = 'rebuilt'
+
+    files = {}
+    for size in sizes:
+        name = f'sample_{size}.csv'
+        draw_sample(reservoir, counts, size).to_csv(os.path.join(samples_dir, name), index=False)
+        files[str(size)] = name
+    reservoir.to_csv(os.path.join(samples_dir, 'reservoir.csv'), index=False)
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'key_column': KEY_COLUMN,
+        'strata': STRATA,
+        'sizes': sizes,
+        'min_per_stratum': MIN_PER_STRATUM,
+        'source': {'file': SOURCE_FILE, 'rows': int(rows), 'bytes': source_bytes,
+                   'tail_sha1': _tail_digest(source, source_bytes), 'data_version': version},
+        'counts': {stratum: int(count) for stratum, count in sorted(counts.items())},
+        'files': files,
+    }
+    # Written last, so readers never see a manifest for samples not yet on disk
+    tmp_path = os.path.join(samples_dir, 'manifest.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(samples_dir, 'manifest.json'))
+    print(f"Samples {mode}: sizes {', '.join(map(str, sizes))} from {rows:,} rows")
+    return manifest
+
+
+def _current_manifest(data_dir, expected_rows, version):
+    """The samples manifest, or None if the samples were drawn from other data."""
+    manifest = read_manifest(os.path.join(data_dir, SAMPLES_DIR))
+    if manifest is None or (expected_rows is not None and manifest['source']['rows'] != expected_rows):
+        return None
+    if manifest['source']['data_version'] != (version or data_version(os.path.join(data_dir, SOURCE_FILE))):
+        return None
+    return manifest
+
+
+def load_samples(data_dir='data/processed', expected_rows=None, version=None):
+    """Load the stored samples as {size: DataFrame}.
+
+    Returns an empty dict if there are none, or if they were built from
+    other data than the current insurance_data.csv (or the given data
+    version), or from a different number of rows than expected_rows.
+    """
+    samples_dir = os.path.join(data_dir, SAMPLES_DIR)
+    manifest = _current_manifest(data_dir, expected_rows, version)
+    if manifest is None:
+        return {}
+    return {int(size): pd.read_csv(os.path.join(samples_dir, name))
+            for size, name in manifest['files'].items()}
+
+
+def load_reservoir(data_dir='data/processed', expected_rows=None, version=None):
+    """Load the per-stratum reservoir and the stratum sizes it was drawn from.
+
+    Returns (reservoir DataFrame, {stratum: rows}), or None as for load_samples.
+    """
+    samples_dir = os.path.join(data_dir, SAMPLES_DIR)
+    manifest = _current_manifest(data_dir, expected_rows, version)
+    if manifest is None:
+        return None
+    return pd.read_csv(os.path.join(samples_dir, 'reservoir.csv')), manifest['counts']
+
+
+def stratified_sample(df, size):
+    """Draw the same sample refresh_samples would store, from an in-memory frame."""
+    return draw_sample(bottom_k(df, size), stratum_labels(df).value_counts(), size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default='data/processed')
+    parser.add_argument('--sizes', default=','.join(map(str, SAMPLE_SIZES)))
+    parser.add_argument('--rebuild', action='store_true', help='Ignore existing samples and rescan all rows')
+    args = parser.parse_args()
+    refresh_samples(args.data_dir, [int(s) for s in args.sizes.split(',')], rebuild=args.rebuild)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Share the dashboard dataset between worker processes.
+One loader process publishes every column into POSIX shared memory as a
+NumPy array; dashboard workers attach to those segments read-only and build
+their DataFrames on top of them without copying the data.
+
+Usage:
+    python scripts/shared_dataset.py --name insurance
+    DASHBOARD_SHARED_DATASET=insurance gunicorn --pythonpath scripts -w 16 create_dashboard:server
+
+Numeric, date and dictionary-encoded string columns are shared without
+copying; only the (small) category labels are materialised per worker.
+Strings with too many distinct values for a dictionary, such as
+customer_id, are shared as Arrow offsets and bytes buffers that pandas
+reads in place.
+
+The samples, KPI snapshot, customer index and sketches are loaded by each
+worker from the pipeline's stores in the data directory, for the data
+version that was published; the customer index is memory-mapped, so its
+pages are shared between workers too.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.arrays import ArrowStringArray
+
+from dashboard_data import (DASHBOARD_FILES, DATA_DIR, RELOAD_INTERVAL, DashboardData, StartupReport,
+                            data_version, files_fingerprint, load_dashboard_data, load_stores)
+
+FRAMES = ['df', 'time_metrics', 'region_metrics']
+SOURCE_FILE = DASHBOARD_FILES[0]
+# Strings with more distinct values than this share of the rows are not dictionary-encoded
+DICTIONARY_MAX_RATIO = 0.5
+
+
+def manifest_path(name):
+    """Location of the manifest describing the current version of a dataset."""
+    return os.path.join(tempfile.gettempdir(), f'{name}.shared_dataset.json')
+
+
+def read_manifest(name):
+    """Return the current manifest for a dataset, or None if nothing is published."""
+    try:
+        with open(manifest_path(name), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def codes_dtype(n_categories):
+    """The integer dtype pandas itself uses for categorical codes."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _copy_to_segment(array, segment_name):
+    shm = shared_memory.SharedMemory(name=segment_name, create=True, size=max(array.nbytes, 1))
+    target = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    target[...] = array
+    return shm
+
+
+def _encode_text(series):
+    """The Arrow buffers of a string column: int64 offsets, UTF-8 bytes and, if it has any, a null mask."""
+    array = pa.array(series, type=pa.large_string(), from_pandas=True)
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    # Concatenating rebases a sliced array so its offsets start at zero
+    array = pa.concat_arrays([array])
+    offsets = np.frombuffer(array.buffers()[1], dtype=np.int64)[:len(array) + 1]
+    data = np.frombuffer(array.buffers()[2] or b'', dtype=np.uint8)[:offsets[-1]]
+    arrays = {'values': offsets, 'data': data}
+    if array.null_count:
+        arrays['nulls'] = array.is_null().to_numpy(zero_copy_only=False)
+    return arrays
+
+
+def _encode_column(series):
+    """Split a column into named arrays that can live in shared memory.
+
+    Returns (kind, {part: array}); every kind has 'values', dictionary-encoded
+    kinds 'categories' and 'text' columns their Arrow buffers.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = np.asarray(series.cat.categories.astype(str), dtype=str)
+        codes = series.cat.codes.to_numpy().astype(codes_dtype(len(categories)))
+        return 'category', {'values': codes, 'categories': categories}
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime', {'values': series.to_numpy(dtype='datetime64[ns]')}
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return 'numeric', {'values': np.ascontiguousarray(series.to_numpy())}
+    # An id column would rebuild every value as a Python string per worker from its categories
+    if series.nunique(dropna=False) > DICTIONARY_MAX_RATIO * len(series):
+        return 'text', _encode_text(series)
+    codes, categories = pd.factorize(series.astype(str), sort=True)
+    return 'string', {'values': codes.astype(codes_dtype(len(categories))),
+                      'categories': np.asarray(categories, dtype=str)}
+
+
+def _part_key(part):
+    """Prefix of a part's segment, dtype and length in a manifest column entry."""
+    return '' if part == 'values' else part + '_'
+
+
+class SharedDatasetPublisher:
+    """Own the shared memory segments for each published version of a dataset."""
+
+    def __init__(self, name):
+        self.name = name
+        self.version = 0
+        self.segments = {}
+
+    def publish(self, data, data_dir=None, source_version=None):
+        """Copy every column of the dataset into new segments and announce the version.
+
+        data_dir and source_version, the data version of the insurance_data.csv
+        the data was loaded from, tell workers where to load the stores for it.
+        """
+        version = self.version + 1
+        segments = []
+        manifest = {'name': self.name, 'version': version, 'published': time.time(), 'frames': {}}
+        if data_dir is not None:
+            manifest['source'] = {'data_dir': os.path.abspath(data_dir), 'data_version': source_version}
+
+        for frame_name in FRAMES:
+            frame = getattr(data, frame_name)
+            if frame is None:
+                continue
+            columns = []
+            for i, column in enumerate(frame.columns):
+                kind, arrays = _encode_column(frame[column])
+                prefix = f'{self.name}_v{version}_{frame_name}_{i}'
+                entry = {'name': column, 'kind': kind}
+                for part, array in arrays.items():
+                    shm = _copy_to_segment(array, prefix if part == 'values' else f'{prefix}_{part}')
+                    segments.append(shm)
+                    key = _part_key(part)
+                    entry.update({key + 'segment': shm.name, key + 'dtype': array.dtype.str,
+                                  key + 'length': len(array)})
+                if 'categories' in arrays:
+                    entry['ordered'] = bool(getattr(frame[column].dtype, 'ordered', False))
+                columns.append(entry)
+            manifest['frames'][frame_name] = columns
+
+        # Write the manifest atomically so workers never see a partial version
+        path = manifest_path(self.name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+        self.segments[version] = segments
+        self.version = version
+        return version
+
+    def release(self, keep_versions=1):
+        """Unlink all but the newest versions. Attached workers keep their mappings."""
+        for version in sorted(self.segments)[:-keep_versions or None]:
+            for shm in self.segments.pop(version):
+                shm.close()
+                shm.unlink()
+
+    def close(self):
+        self.release(keep_versions=0)
+        if os.path.exists(manifest_path(self.name)):
+            os.remove(manifest_path(self.name))
+
+
+def _attach_array(segment_name, dtype, length, handles):
+    shm = shared_memory.SharedMemory(name=segment_name)
+    # Workers only borrow the segment; the publisher is responsible for unlinking it
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    handles.append(shm)
+    array = np.ndarray((length,), dtype=np.dtype(dtype), buffer=shm.buf)
+    array.flags.writeable = False
+    return array
+
+
+def _attach_part(entry, part, handles):
+    key = _part_key(part)
+    return _attach_array(entry[key + 'segment'], entry[key + 'dtype'], entry[key + 'length'], handles)
+
+
+def _attach_text(entry, handles):
+    """A pandas string array reading the shared Arrow buffers in place."""
+    offsets = _attach_part(entry, 'values', handles)
+    data = _attach_part(entry, 'data', handles)
+    validity = None
+    if 'nulls_segment' in entry:
+        # Only the null bitmap, an eighth of a byte per row, is built per worker
+        validity = pa.py_buffer(np.packbits(~_attach_part(entry, 'nulls', handles), bitorder='little'))
+    array = pa.LargeStringArray.from_buffers(len(offsets) - 1, pa.py_buffer(offsets), pa.py_buffer(data), validity)
+    # The dtype load_table gives string columns
+    return ArrowStringArray(pa.chunked_array([array]), dtype=pd.StringDtype('pyarrow', na_value=np.nan))
+
+
+def published_version(name):
+    """Version number of the dataset currently published under name."""
+    manifest = read_manifest(name)
+    return manifest['version'] if manifest is not None else None
+
+
+def attach_dataset(name, report=None):
+    """Build read-only DataFrames over the shared memory of the current version.
+
+    The samples, KPI snapshot, customer index and sketches are loaded from
+    the data directory the version was published from, if they match it.
+    """
+    report = report or StartupReport()
+    manifest = read_manifest(name)
+    if manifest is None:
+        raise FileNotFoundError(f"No shared dataset published under '{name}'")
+
+    handles = []
+    frames = {}
+    with report.timed(f"attach shared dataset v{manifest['version']}"):
+        for frame_name, columns in manifest['frames'].items():
+            data = {}
+            for entry in columns:
+                if entry['kind'] == 'text':
+                    data[entry['name']] = _attach_text(entry, handles)
+                    continue
+                values = _attach_part(entry, 'values', handles)
+                if entry['kind'] in ('category', 'string'):
+                    categories = _attach_part(entry, 'categories', handles)
+                    dtype = pd.CategoricalDtype(categories.astype(str), ordered=entry['ordered'])
+                    data[entry['name']] = pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+                else:
+                    data[entry['name']] = values
+            frames[frame_name] = pd.DataFrame(data, copy=False)
+
+    stores = {}
+    source = manifest.get('source')
+    if source is not None and 'df' in frames:
+        from policy_index import index_dir
+        stores = load_stores(source['data_dir'], len(frames['df']), report, version=source['data_version'])
+        stores['index_dir'] = index_dir(source['data_dir'], source['data_version'])
+    data = DashboardData(version=manifest['version'], **frames, **stores)
+    # Keep the segments mapped for as long as the DataFrames are in use
+    data.shared_segments = handles
+    return data
+
+
+def main():
+    """Load the processed data once and publish it for dashboard workers."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--name', default='insurance', help='Name workers attach to')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--watch', type=float, default=RELOAD_INTERVAL,
+                        help='Seconds between checks for new data files (0 disables)')
+    args = parser.parse_args()
+
+    print(f"Publishing {args.data_dir} as shared dataset '{args.name}'...")
+    report = StartupReport()
+    publisher = SharedDatasetPublisher(args.name)
+    source = os.path.join(args.data_dir, SOURCE_FILE)
+    fingerprint = seen = files_fingerprint(args.data_dir)
+    failed = None
+    source_version = data_version(source)
+    version = publisher.publish(load_dashboard_data(args.data_dir, report=report), args.data_dir, source_version)
+    report.mark(f'published v{version}')
+    report.print_report()
+
+    try:
+        print("\nShared dataset ready. Press Ctrl+C to stop and release the memory.")
+        while True:
+            time.sleep(args.watch or 3600)
+            if not args.watch:
+                continue
+            current = files_fingerprint(args.data_dir)
+            if current == fingerprint:
+                continue
+            # Files still being written keep changing; reload once they have held still for a tick
+            if current != seen:
+                seen = current
+                continue
+            try:
+                source_version = data_version(source)
+                data = load_dashboard_data(args.data_dir)
+                if files_fingerprint(args.data_dir) != current:
+                    continue
+                version = publisher.publish(data, args.data_dir, source_version)
+            except Exception as e:
+                # The published version stays current; try again on the next tick
+                if current != failed:
+                    print(f"Error reloading {args.data_dir}: {e}")
+                failed = current
+                continue
+            fingerprint = current
+            # Keep the previous version so workers mid-request can finish on it
+            publisher.release(keep_versions=2)
+            print(f"Published v{version}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        publisher.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Time-indexed range queries over metric time series.
+Dates are kept sorted alongside cumulative sums and sparse min/max tables,
+so the total of any column over a date range costs two binary searches and
+a subtraction, and its min/max costs two lookups, whatever the history length.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class TimeIndex:
+    """Answer range totals and extents over a date-indexed metrics frame."""
+
+    def __init__(self, df, date_column, value_columns):
+        order = np.argsort(df[date_column].to_numpy(dtype='datetime64[ns]'), kind='stable')
+        self.dates = df[date_column].to_numpy(dtype='datetime64[ns]')[order]
+        self.columns = list(value_columns)
+        self._prefix = {}
+        self._sparse_min = {}
+        self._sparse_max = {}
+
+        for column in self.columns:
+            values = df[column].to_numpy()[order]
+            # Integers stay integers so counts are exact; cumsum[0] is the empty range
+            dtype = np.int64 if np.issubdtype(values.dtype, np.integer) else np.float64
+            self._prefix[column] = np.concatenate([[0], np.cumsum(values, dtype=dtype)])
+            self._sparse_min[column] = self._build_sparse(values, np.minimum)
+            self._sparse_max[column] = self._build_sparse(values, np.maximum)
+
+    @staticmethod
+    def _build_sparse(values, combine):
+        """Level k holds the min/max of each window of 2**k values."""
+        levels = [np.asarray(values, dtype=np.float64)]
+        width = 1
+        while width * 2 <= len(values):
+            previous = levels[-1]
+            levels.append(combine(previous[:-width], previous[width:]))
+            width *= 2
+        return levels
+
+    def bounds(self, start, end):
+        """Positions [i, j) of the rows with start <= date <= end."""
+        start = np.datetime64(pd.Timestamp(start), 'ns')
+        end = np.datetime64(pd.Timestamp(end), 'ns')
+        i = np.searchsorted(self.dates, start, side='left')
+        j = np.searchsorted(self.dates, end, side='right')
+        return int(i), int(max(i, j))
+
+    def total(self, column, start, end):
+        """Sum of column over the date range."""
+        i, j = self.bounds(start, end)
+        prefix = self._prefix[column]
+        return prefix[j] - prefix[i]
+
+    def totals(self, start, end):
+        """Sum of every indexed column over the date range."""
+        i, j = self.bounds(start, end)
+        return {column: self._prefix[column][j] - self._prefix[column][i] for column in self.columns}
+
+    def extent(self, column, start, end):
+        """(min, max) of column over the date range, or None if the range is empty."""
+        i, j = self.bounds(start, end)
+        if i >= j:
+            return None
+        level = (j - i).bit_length() - 1
+        lows, highs = self._sparse_min[column][level], self._sparse_max[column][level]
+        last = j - (1 << level)
+        return min(lows[i], lows[last]), max(highs[i], highs[last])
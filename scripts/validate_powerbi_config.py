@@ -1,19 +1,28 @@
 """
 Validate Power BI report configuration and data model.
+
+Usage:
+    python scripts/validate_powerbi_config.py [--powerbi-dir data/processed/powerbi]
 """
 
+import argparse
+import functools
 import json
 import os
-import pandas as pd
 from datetime import datetime
+from generate_powerbi_report import create_dataset_schema, latest_report_config
+from powerbi_export import read_manifest, table_files
+from validate_powerbi_data import ALL_COLUMNS, ValidationCache, stream_table
+
+POWERBI_DIR = 'data/processed/powerbi'
 
-def load_config():
+def load_config(config_dir=POWERBI_DIR):
     """Load the latest Power BI report configuration."""
-    config_dir = 'data/processed/powerbi'
-    config_files = [f for f in os.listdir(config_dir) if f.startswith('report_config_')]
-    latest_config = sorted(config_files)[-1]
+    latest_config = latest_report_config(config_dir)
+    if latest_config is None:
+        raise FileNotFoundError(f"no report_config_*.json in {config_dir}")
     
-    with open(f'{config_dir}/{latest_config}', 'r') as f:
+    with open(latest_config, 'r') as f:
         config = json.load(f)
     
     return config
@@ -122,44 +131,52 @@ def validate_measures(measures_file):
         print(f"Error validating measures: {str(e)}")
         return False
 
-def validate_data_files():
+def validate_data_files(data_dir=POWERBI_DIR):
     """Validate required data files."""
     print("\nValidating data files...")
     
-    required_files = [
-        'insurance_data.csv',
-        'time_metrics.csv',
-        'customer_metrics.csv',
-        'region_metrics.csv',
-        'date_table.csv'
-    ]
-    
-    data_dir = 'data/processed/powerbi'
     missing_files = []
+    # Files unchanged since the last run are answered from the validation cache
+    cache = ValidationCache(data_dir)
+    # Partitioned tables are validated file by file, as the export manifest lists them
+    manifest = read_manifest(data_dir) or {'tables': {}}
+    required_files = [f"{table['name']}.csv"
+                      for table in create_dataset_schema(star=manifest.get('model') == 'star')['tables']]
     
     for file in required_files:
-        file_path = f'{data_dir}/{file}'
-        if not os.path.exists(file_path):
-            missing_files.append(file)
+        entry = manifest['tables'].get(os.path.splitext(file)[0])
+        names = table_files(entry) if entry else [file]
+        absent = [name for name in names if not os.path.exists(f'{data_dir}/{name}')]
+        if absent:
+            missing_files.extend(absent)
             continue
         
-        # Validate file contents
+        # Validate file contents, counting rows and nulls chunk by chunk
         try:
-            df = pd.read_csv(file_path)
+            columns = {ALL_COLUMNS: {'nulls'}}
+            rows, nulls = 0, {}
+            for name in names:
+                profile = cache.profile(name, columns, functools.partial(stream_table, data_dir, name, columns))
+                rows += profile['rows']
+                for col, stats in profile['columns'].items():
+                    nulls[col] = nulls.get(col, 0) + stats['nulls']
             print(f"\n{file} statistics:")
-            print(f"Rows: {len(df):,}")
-            print(f"Columns: {len(df.columns):,}")
-            print("Column names:", ", ".join(df.columns))
+            if len(names) > 1:
+                print(f"Partitions: {len(names):,}")
+            print(f"Rows: {rows:,}")
+            print(f"Columns: {len(nulls):,}")
+            print("Column names:", ", ".join(nulls))
             
             # Check for missing values
-            missing = df.isnull().sum()
-            if missing.any():
+            missing = {col: count for col, count in nulls.items() if count}
+            if missing:
                 print("\nMissing values found:")
-                for col, count in missing[missing > 0].items():
+                for col, count in missing.items():
                     print(f"{col}: {count:,} missing values")
         except Exception as e:
             print(f"Error reading {file}: {str(e)}")
             return False
+    cache.save()
     
     if missing_files:
         print("Missing required files:", missing_files)
@@ -168,7 +185,7 @@ def validate_data_files():
     print("\nAll required data files present and valid")
     return True
 
-def generate_validation_report(results):
+def generate_validation_report(results, report_dir=POWERBI_DIR):
     """Generate validation report."""
     report = []
     report.append("Power BI Configuration Validation Report")
@@ -179,20 +196,20 @@ def generate_validation_report(results):
         report.append(f"\n{component}:")
         report.append("Status: " + ("PASS" if status else "FAIL"))
     
-    report_path = 'data/processed/powerbi/validation_report.txt'
+    report_path = os.path.join(report_dir, 'validation_report.txt')
     with open(report_path, 'w', encoding='utf-8') as f:
         f.write('\n'.join(report))
     
     print("\nValidation report saved to:", report_path)
     print('\n'.join(report))
 
-def main():
-    """Validate Power BI configuration and data model."""
+def validate_config(powerbi_dir=POWERBI_DIR):
+    """Validate the latest report configuration and the export in powerbi_dir; True if all pass."""
     print("Starting Power BI configuration validation...")
     
     try:
         # Load configuration
-        config = load_config()
+        config = load_config(powerbi_dir)
         
         # Validate components
         results = {
@@ -200,11 +217,11 @@ def main():
             'Layout': validate_layout(config['report']),
             'Data Model': validate_data_model(config['dataset']),
             'DAX Measures': validate_measures('dashboard/measures.dax'),
-            'Data Files': validate_data_files()
+            'Data Files': validate_data_files(powerbi_dir)
         }
         
         # Generate report
-        generate_validation_report(results)
+        generate_validation_report(results, powerbi_dir)
         
         # Overall validation result
         if all(results.values()):
@@ -218,5 +235,12 @@ def main():
         print(f"Error during validation: {str(e)}")
         return False
 
+def main():
+    """Validate Power BI configuration and data model."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--powerbi-dir', default=POWERBI_DIR)
+    args = parser.parse_args()
+    return validate_config(args.powerbi_dir)
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
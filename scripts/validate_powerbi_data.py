@@ -1,167 +1,815 @@
 """
 Validate the generated data for Power BI dashboard.
 This script checks data quality, relationships, and completeness.
+
+Checks are declared as rules (see RULES) rather than written as code. The
+engine works out which columns and column statistics the rules need, loads
+each table once with only those columns, profiles each column in a single
+step shared by all of its rules, and validates the tables concurrently.
+Tables are read with the types declared in the dataset schema (see
+dataset_schema.py), so a file with missing, extra or mistyped columns is
+reported as an error before any of its rules run. The metric tables are
+also reconciled against the policy data (see reconcile_metrics.py), and
+the relationships in the dataset schema are checked for orphaned keys (see
+referential_integrity.py).
+
+Table profiles are cached in validation_cache.json next to the data, keyed
+by each file's content hash and by the version of the statistics the rules
+ask for. A file that hasn't changed since the last run isn't read again;
+its rules are evaluated from the stored profile, so a run costs time in
+proportion to the files that changed.
+
+With --stream, files are read in chunks instead and the column statistics
+are merged chunk by chunk, so memory use doesn't grow with the file:
+uniqueness is counted over 64-bit value hashes that spill to
+hash-partitioned files on disk past a memory limit. --fail-fast stops all
+tables at the first rule that fails for good (nulls, out-of-range or
+unexpected values, duplicates).
+
+Usage:
+    python scripts/validate_powerbi_data.py [--data-dir data/processed] [--json]
+    python scripts/validate_powerbi_data.py --stream [--chunk-rows 1000000] [--fail-fast]
+    python scripts/validate_powerbi_data.py --no-cache --no-reconcile --no-integrity
+    python scripts/validate_powerbi_data.py --bloom
 """
 
-import pandas as pd
-import numpy as np
+import argparse
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-def validate_file_existence():
+import numpy as np
+import pandas as pd
+
+from dataset_schema import check_header, load_table, split_file, table_columns
+from reconcile_metrics import METRIC_TABLES, print_reconciliation, reconcile
+from reconcile_metrics import specification_version as reconciliation_version
+from referential_integrity import check_integrity, print_integrity, relationships
+from referential_integrity import specification_version as integrity_version
+
+DATA_DIR = 'data/processed'
+REQUIRED_FILES = ['insurance_data.csv', 'time_metrics.csv', 'customer_metrics.csv', 'region_metrics.csv']
+EXPECTED_CUSTOMERS = 20000
+SEGMENTS = ['Low Risk', 'Medium Risk', 'High Risk', 'Very High Risk']
+POLICY_TYPES = ['Basic', 'Standard', 'Premium', 'Elite']
+REGIONS = ['North', 'South', 'East', 'West', 'Central']
+ALL_COLUMNS = '*'
+CHUNK_ROWS = 1000000
+SPILL_MEMORY_BYTES = 256 * 1024 * 1024
+CACHE_FILE = 'validation_cache.json'
+CACHE_FORMAT = 1
+# Bump when profiling changes in a way that makes stored profiles wrong
+RULESET_VERSION = 1
+HASH_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+class Rule:
+    """One declarative check.
+
+    columns are 'table:column' references ('table:*' for every column, or
+    just 'table' for table-level kinds); expected is the kind's parameter.
+    """
+
+    def __init__(self, name, kind, columns, expected=None):
+        self.name = name
+        self.kind = kind
+        self.columns = [columns] if isinstance(columns, str) else list(columns)
+        self.expected = expected
+
+    def references(self):
+        """(table, column) pairs; column is None for the table itself."""
+        for reference in self.columns:
+            table, _, column = reference.partition(':')
+            yield table, column or None
+
+
+def _no_nulls(profiles, expected):
+    return all(profile['nulls'] == 0 for profile in profiles)
+
+
+def _unique(profiles, expected):
+    return all(profile['nunique'] == profile['rows'] for profile in profiles)
+
+
+def _at_least(profiles, expected):
+    # NaN compares False, so a column with nulls fails, as with (series >= x).all()
+    return all(profile['nulls'] == 0 and (profile['rows'] == 0 or profile['min'] >= expected)
+               for profile in profiles)
+
+
+def _between(profiles, expected):
+    low, high = expected
+    return all(profile['nulls'] == 0 and (profile['rows'] == 0 or low <= profile['min'] and profile['max'] <= high)
+               for profile in profiles)
+
+
+def _in_set(profiles, expected):
+    return all(profile['nulls'] == 0 and profile['distinct'] <= set(expected) for profile in profiles)
+
+
+def _rows_equal(profiles, expected):
+    return all(profile['rows'] == expected for profile in profiles)
+
+
+def _sum_equals(profiles, expected):
+    return all(profile['sum'] == expected for profile in profiles)
+
+
+def _same_values(profiles, expected):
+    first = profiles[0]['distinct']
+    return all(profile['distinct'] == first for profile in profiles[1:])
+
+
+# kind -> (column statistics it needs, evaluation over the referenced profiles,
+#          whether a failure on part of the data is already final)
+RULE_KINDS = {
+    'no_nulls': ({'nulls'}, _no_nulls, True),
+    'unique': ({'nunique'}, _unique, True),
+    'at_least': ({'nulls', 'min'}, _at_least, True),
+    'between': ({'nulls', 'min', 'max'}, _between, True),
+    'in_set': ({'nulls', 'distinct'}, _in_set, True),
+    'rows_equal': (set(), _rows_equal, False),
+    'sum_equals': ({'sum'}, _sum_equals, False),
+    'same_values': ({'distinct'}, _same_values, False),
+}
+
+# Sections of rules, in the order they're reported
+RULES = {
+    'Insurance Data': [
+        Rule('null_check', 'no_nulls', 'insurance_data.csv:*'),
+        Rule('customer_id_unique', 'unique', 'insurance_data.csv:customer_id'),
+        Rule('premium_positive', 'at_least', 'insurance_data.csv:annual_premium', 0),
+        Rule('claim_amount_valid', 'at_least', 'insurance_data.csv:claim_amount', 0),
+        Rule('age_valid', 'between', 'insurance_data.csv:age', (18, 85)),
+        Rule('fraud_binary', 'in_set', 'insurance_data.csv:fraud_reported', [0, 1]),
+        Rule('segments_valid', 'in_set', 'insurance_data.csv:customer_segment', SEGMENTS),
+        Rule('policy_types_valid', 'in_set', 'insurance_data.csv:policy_type', POLICY_TYPES),
+        Rule('regions_valid', 'in_set', 'insurance_data.csv:region', REGIONS),
+    ],
+    'Time Metrics': [
+        Rule('null_check', 'no_nulls', 'time_metrics.csv:*'),
+        Rule('premium_positive', 'at_least', 'time_metrics.csv:monthly_premium', 0),
+        Rule('claims_positive', 'at_least', 'time_metrics.csv:monthly_claims', 0),
+        Rule('fraud_cases_positive', 'at_least', 'time_metrics.csv:monthly_fraud_cases', 0),
+        Rule('new_policies_positive', 'at_least', 'time_metrics.csv:new_policies', 0),
+    ],
+    'Customer Metrics': [
+        Rule('null_check', 'no_nulls', 'customer_metrics.csv:*'),
+        Rule('segments_present', 'rows_equal', 'customer_metrics.csv', len(SEGMENTS)),
+        Rule('metrics_positive', 'at_least', [f'customer_metrics.csv:{column}' for column in
+                                              ('avg_premium', 'total_premium', 'avg_claim', 'total_claims')], 0),
+        Rule('customer_counts_match', 'sum_equals', 'customer_metrics.csv:customer_count', EXPECTED_CUSTOMERS),
+    ],
+    'Region Metrics': [
+        Rule('null_check', 'no_nulls', 'region_metrics.csv:*'),
+        Rule('regions_present', 'rows_equal', 'region_metrics.csv', len(REGIONS)),
+        Rule('metrics_positive', 'at_least', [f'region_metrics.csv:{column}' for column in
+                                              ('total_premium', 'total_claims', 'customer_count')], 0),
+        Rule('customer_counts_match', 'sum_equals', 'region_metrics.csv:customer_count', EXPECTED_CUSTOMERS),
+    ],
+    'Data Relationships': [
+        Rule('customer_segments_match', 'same_values',
+             ['insurance_data.csv:customer_segment', 'customer_metrics.csv:customer_segment']),
+        Rule('regions_match', 'same_values', ['insurance_data.csv:region', 'region_metrics.csv:region']),
+        Rule('customer_totals_match', 'rows_equal', 'insurance_data.csv', EXPECTED_CUSTOMERS),
+        Rule('segment_totals_match', 'sum_equals', 'customer_metrics.csv:customer_count', EXPECTED_CUSTOMERS),
+        Rule('region_totals_match', 'sum_equals', 'region_metrics.csv:customer_count', EXPECTED_CUSTOMERS),
+    ],
+}
+
+# Column statistics for the summary printed after the checks
+SUMMARY_STATS = {
+    'insurance_data.csv': {'annual_premium': {'sum'}, 'claim_amount': {'sum'},
+                           'fraud_reported': {'sum'}, 'customer_segment': {'counts'}},
+}
+
+
+def validate_file_existence(data_dir=DATA_DIR):
     """Check if all required files exist."""
-    required_files = [
-        'data/processed/insurance_data.csv',
-        'data/processed/time_metrics.csv',
-        'data/processed/customer_metrics.csv',
-        'data/processed/region_metrics.csv'
-    ]
-    
-    missing_files = []
-    for file_path in required_files:
-        if not Path(file_path).exists():
-            missing_files.append(file_path)
-    
+    missing_files = [str(Path(data_dir) / name) for name in REQUIRED_FILES
+                     if not (Path(data_dir) / name).exists()]
     return len(missing_files) == 0, missing_files
 
-def validate_insurance_data(df):
-    """Validate main insurance dataset."""
-    checks = {
-        'null_check': df.isnull().sum().sum() == 0,
-        'customer_id_unique': df['customer_id'].nunique() == len(df),
-        'premium_positive': (df['annual_premium'] >= 0).all(),
-        'claim_amount_valid': (df['claim_amount'] >= 0).all(),
-        'age_valid': df['age'].between(18, 85).all(),
-        'fraud_binary': df['fraud_reported'].isin([0, 1]).all(),
-        'segments_valid': df['customer_segment'].isin(['Low Risk', 'Medium Risk', 'High Risk', 'Very High Risk']).all(),
-        'policy_types_valid': df['policy_type'].isin(['Basic', 'Standard', 'Premium', 'Elite']).all(),
-        'regions_valid': df['region'].isin(['North', 'South', 'East', 'West', 'Central']).all()
+
+def plan(rules=RULES, summary_stats=SUMMARY_STATS):
+    """The statistics each table's columns must provide: {table: {column: stats}}."""
+    needed = {}
+    for section in rules.values():
+        for rule in section:
+            stats = RULE_KINDS[rule.kind][0]
+            for table, column in rule.references():
+                columns = needed.setdefault(table, {})
+                if column is not None:
+                    columns.setdefault(column, set()).update(stats)
+    for table, columns in summary_stats.items():
+        for column, stats in columns.items():
+            needed.setdefault(table, {}).setdefault(column, set()).update(stats)
+    return needed
+
+
+def _expand_columns(columns, header):
+    """Replace a '*' entry with every column of the file."""
+    columns = dict(columns)
+    if ALL_COLUMNS in columns:
+        stats = columns.pop(ALL_COLUMNS)
+        for column in header:
+            columns.setdefault(column, set()).update(stats)
+    return columns
+
+
+def _read_header(data_dir, table):
+    """The file's columns, failing fast unless they are exactly the ones its schema declares."""
+    return check_header(os.path.join(data_dir, table), split_file(table)[0])
+
+
+def read_table(data_dir, table, columns, chunk_rows=None):
+    """Read only the given columns, with the types declared in the dataset schema (see dataset_schema.py)."""
+    options = {}
+    if chunk_rows is None:
+        try:
+            import pyarrow  # noqa: F401  multi-threaded parsing when available
+            options['engine'] = 'pyarrow'
+        except ImportError:
+            pass
+    table, partition = split_file(table)
+    return load_table(data_dir, table, usecols=list(columns), chunksize=chunk_rows, partition=partition, **options)
+
+
+def profile_column(series, stats):
+    """Compute all requested statistics of one column together."""
+    profile = {'rows': len(series)}
+    if 'nulls' in stats:
+        profile['nulls'] = int(series.isna().sum())
+    if {'distinct', 'counts'} & stats:
+        counts = series.value_counts(sort=False)
+        counts = counts[counts > 0]
+        profile['distinct'] = set(counts.index.tolist())
+        if 'counts' in stats:
+            profile['counts'] = {key: int(count) for key, count in counts.items()}
+    if 'nunique' in stats:
+        profile['nunique'] = int(series.nunique())
+    if {'min', 'max', 'sum'} & stats:
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = values[~np.isnan(values)]
+        if 'min' in stats:
+            profile['min'] = float(valid.min()) if len(valid) else None
+        if 'max' in stats:
+            profile['max'] = float(valid.max()) if len(valid) else None
+        if 'sum' in stats:
+            profile['sum'] = float(valid.sum())
+    return profile
+
+
+def merge_profiles(profile, other):
+    """Combine the profiles of two disjoint parts of a column."""
+    merged = {'rows': profile['rows'] + other['rows']}
+    for stat, value in other.items():
+        current = profile.get(stat)
+        if stat in ('nulls', 'sum'):
+            merged[stat] = current + value
+        elif stat in ('min', 'max'):
+            pick = min if stat == 'min' else max
+            merged[stat] = value if current is None else current if value is None else pick(current, value)
+        elif stat == 'distinct':
+            merged[stat] = current | value
+        elif stat == 'counts':
+            merged[stat] = {key: current.get(key, 0) + value.get(key, 0) for key in current.keys() | value.keys()}
+    return merged
+
+
+class DistinctCounter:
+    """Count the distinct values of a column chunk by chunk in bounded memory.
+
+    Values are reduced to 64-bit hashes and kept sorted in memory until they
+    pass memory_limit bytes; after that they are merged into hash-partitioned
+    files in spill_dir, each kept sorted and free of duplicates. New hashes
+    are looked up in memory and, by binary search over a memory map, in their
+    partition file, so duplicates are reported as soon as they are seen even
+    when the first occurrence has been spilled.
+    """
+
+    PARTITION_BITS = 6
+
+    def __init__(self, spill_dir, memory_limit=SPILL_MEMORY_BYTES):
+        self.spill_dir = spill_dir
+        self.memory_limit = memory_limit
+        self.seen = np.empty(0, dtype=np.uint64)
+        self.duplicates = 0
+        self.spilled = False
+
+    def add(self, series):
+        hashes = pd.util.hash_pandas_object(series.dropna(), index=False).to_numpy()
+        unique = np.unique(hashes)
+        self.duplicates += len(hashes) - len(unique)
+        if len(self.seen):
+            positions = np.minimum(np.searchsorted(self.seen, unique), len(self.seen) - 1)
+            self.duplicates += int(np.count_nonzero(self.seen[positions] == unique))
+        if self.spilled:
+            on_disk = self._spilled_contains(unique)
+            self.duplicates += int(np.count_nonzero(on_disk))
+            unique = unique[~on_disk]
+        self.seen = np.union1d(self.seen, unique)
+        if self.seen.nbytes > self.memory_limit:
+            self._spill()
+
+    def _partition_path(self, partition):
+        return os.path.join(self.spill_dir, f'partition_{partition}.bin')
+
+    def _partition_bounds(self, values):
+        partitions = (values >> np.uint64(64 - self.PARTITION_BITS)).astype(np.int64)
+        return np.searchsorted(partitions, np.arange((1 << self.PARTITION_BITS) + 1))
+
+    def _read_partition(self, partition, mmap=False):
+        path = self._partition_path(partition)
+        if not os.path.exists(path) or not os.path.getsize(path):
+            return np.empty(0, dtype=np.uint64)
+        return np.memmap(path, dtype=np.uint64, mode='r') if mmap else np.fromfile(path, dtype=np.uint64)
+
+    def _spilled_contains(self, values):
+        """Which of the sorted values are already in a partition file."""
+        found = np.zeros(len(values), dtype=bool)
+        bounds = self._partition_bounds(values)
+        for partition in np.flatnonzero(np.diff(bounds)):
+            stored = self._read_partition(partition, mmap=True)
+            if not len(stored):
+                continue
+            lookup = values[bounds[partition]:bounds[partition + 1]]
+            positions = np.minimum(np.searchsorted(stored, lookup), len(stored) - 1)
+            found[bounds[partition]:bounds[partition + 1]] = stored[positions] == lookup
+        return found
+
+    def _spill(self):
+        # Hashes in memory are never in a partition file yet, so merging keeps each file unique
+        bounds = self._partition_bounds(self.seen)
+        for partition in np.flatnonzero(np.diff(bounds)):
+            merged = np.union1d(self._read_partition(partition),
+                                self.seen[bounds[partition]:bounds[partition + 1]])
+            merged.tofile(self._partition_path(partition))
+        self.seen = np.empty(0, dtype=np.uint64)
+        self.spilled = True
+
+    def count(self):
+        """The number of distinct values added; spilled partitions are removed."""
+        if not self.spilled:
+            return len(self.seen)
+        total = len(self.seen)
+        for partition in range(1 << self.PARTITION_BITS):
+            path = self._partition_path(partition)
+            if os.path.exists(path):
+                total += os.path.getsize(path) // np.dtype(np.uint64).itemsize
+                os.remove(path)
+        return total
+
+
+def profile_table(data_dir, table, columns):
+    """Load one table once and profile the columns its rules use."""
+    began = time.perf_counter()
+    columns = _expand_columns(columns, _read_header(data_dir, table))
+    df = read_table(data_dir, table, columns)
+    loaded = time.perf_counter()
+    profiles = {column: profile_column(df[column], stats) for column, stats in columns.items()}
+    profiled = time.perf_counter()
+    return {
+        'rows': len(df),
+        'columns': profiles,
+        'timings': {'load_seconds': round(loaded - began, 3), 'profile_seconds': round(profiled - loaded, 3)},
+        'complete': True,
     }
-    return checks
-
-def validate_time_metrics(df):
-    """Validate time-based metrics."""
-    checks = {
-        'null_check': df.isnull().sum().sum() == 0,
-        'premium_positive': (df['monthly_premium'] >= 0).all(),
-        'claims_positive': (df['monthly_claims'] >= 0).all(),
-        'fraud_cases_positive': (df['monthly_fraud_cases'] >= 0).all(),
-        'new_policies_positive': (df['new_policies'] >= 0).all()
+
+
+def final_failures(rules, table, profile):
+    """Rules on this table alone that have already failed for good on the rows read so far."""
+    failed = []
+    for section in rules.values():
+        for rule in section:
+            if (RULE_KINDS[rule.kind][2] and all(name == table for name, _ in rule.references())
+                    and not evaluate(rule, {table: profile})):
+                failed.append(rule.name)
+    return failed
+
+
+def stream_table(data_dir, table, columns, chunk_rows=CHUNK_ROWS, memory_limit=SPILL_MEMORY_BYTES,
+                 rules=None, stop=None):
+    """Profile one table chunk by chunk in bounded memory.
+
+    With rules, reading stops at the first of them that fails for good, and
+    stop (a threading.Event) is set so other tables stop too.
+    """
+    began = time.perf_counter()
+    columns = _expand_columns(columns, _read_header(data_dir, table))
+    profiles, failed, complete = None, [], True
+    profiling = 0.0
+    with tempfile.TemporaryDirectory(prefix='validate-') as spill_dir:
+        counters = {}
+        for column, stats in columns.items():
+            if 'nunique' in stats:
+                counters[column] = DistinctCounter(os.path.join(spill_dir, str(len(counters))), memory_limit)
+                os.makedirs(counters[column].spill_dir)
+
+        for chunk in read_table(data_dir, table, columns, chunk_rows):
+            if stop is not None and stop.is_set():
+                complete = False
+                break
+            chunk_began = time.perf_counter()
+            parts = {column: profile_column(chunk[column], stats - {'nunique'})
+                     for column, stats in columns.items()}
+            profiles = parts if profiles is None else {
+                column: merge_profiles(profiles[column], part) for column, part in parts.items()}
+            for column, counter in counters.items():
+                counter.add(chunk[column])
+                profiles[column]['nunique'] = profiles[column]['rows'] - counter.duplicates
+            if rules is not None:
+                failed = final_failures(rules, table, {'rows': profiles_rows(profiles), 'columns': profiles})
+                if failed:
+                    complete = False
+                    if stop is not None:
+                        stop.set()
+            profiling += time.perf_counter() - chunk_began
+            if failed:
+                break
+
+        if profiles is None:
+            profiles = {column: profile_column(pd.Series([], dtype=np.float64), stats)
+                        for column, stats in columns.items()}
+        elif complete:
+            for column, counter in counters.items():
+                profiles[column]['nunique'] = counter.count()
+    finished = time.perf_counter()
+    return {
+        'rows': profiles_rows(profiles),
+        'columns': profiles,
+        'timings': {'load_seconds': round(finished - began - profiling, 3),
+                    'profile_seconds': round(profiling, 3)},
+        'complete': complete,
+        'failed_early': failed,
     }
-    return checks
-
-def validate_customer_metrics(df):
-    """Validate customer segment metrics."""
-    checks = {
-        'null_check': df.isnull().sum().sum() == 0,
-        'segments_present': len(df.index) == 4,  # Should have 4 segments
-        'metrics_positive': all(
-            df[['avg_premium', 'total_premium', 'avg_claim', 'total_claims']].ge(0).all()
-        ),
-        'customer_counts_match': df['customer_count'].sum() == 20000  # Total customers
+
+
+def content_hash(path):
+    """SHA-256 of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def ruleset_version(table, columns):
+    """Version of a table's profile: the statistics requested and the types the schema declares."""
+    declared = {name: column['dataType'] for name, column in table_columns(split_file(table)[0]).items()}
+    payload = json.dumps({'version': RULESET_VERSION, 'schema': declared,
+                          'columns': {column: sorted(stats) for column, stats in columns.items()}},
+                         sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:12]
+
+
+def _plain(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _encode_profile(profile):
+    columns = {}
+    for column, stats in profile['columns'].items():
+        stats = dict(stats)
+        if 'distinct' in stats:
+            stats['distinct'] = sorted((_plain(value) for value in stats['distinct']), key=str)
+        if 'counts' in stats:
+            stats['counts'] = [[_plain(key), count] for key, count in stats['counts'].items()]
+        columns[column] = stats
+    return {'rows': profile['rows'], 'columns': columns}
+
+
+def _decode_profile(stored):
+    columns = {}
+    for column, stats in stored['columns'].items():
+        stats = dict(stats)
+        if 'distinct' in stats:
+            stats['distinct'] = set(stats['distinct'])
+        if 'counts' in stats:
+            stats['counts'] = {key: count for key, count in stats['counts']}
+        columns[column] = stats
+    return {'rows': stored['rows'], 'columns': columns}
+
+
+class ValidationCache:
+    """Results of earlier runs, keyed by the content hashes of the files they read and a version.
+
+    A file's hash is only recomputed when its size or modification time
+    differs from when it was last hashed. Only complete profiles are stored.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, CACHE_FILE)
+        stored = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                stored = json.load(f)
+        if stored.get('format') != CACHE_FORMAT:
+            stored = {}
+        self.files = stored.get('files', {})
+        self.results = stored.get('results', {})
+        self._lock = threading.Lock()
+        self._changed = False
+
+    def content_hash(self, name):
+        """SHA-256 of a data file, hashed again only if it was modified since; None if it doesn't exist."""
+        path = os.path.join(self.data_dir, name)
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        with self._lock:
+            known = self.files.get(name)
+        if known and (known['size'], known['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            return known['content_hash']
+        digest = content_hash(path)
+        with self._lock:
+            self.files[name] = {'content_hash': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            self._changed = True
+        return digest
+
+    def result(self, name, files, version, compute, encode=None, decode=None, keep=None):
+        """(value, cached): the stored value if none of files changed and version matches, else compute().
+
+        A computed value is stored unless keep(value) is false.
+        """
+        digests = {file: self.content_hash(file) for file in files}
+        stored = self.results.get(name)
+        if stored and stored['files'] == digests and stored['version'] == version:
+            return (decode(stored['value']) if decode else stored['value']), True
+
+        value = compute()
+        if keep is None or keep(value):
+            with self._lock:
+                self.results[name] = {'files': digests, 'version': version,
+                                      'value': encode(value) if encode else value}
+                self._changed = True
+        return value, False
+
+    def profile(self, table, columns, compute):
+        """The table's stored profile if neither the file nor its requested statistics changed, else compute()."""
+        began = time.perf_counter()
+        profile, cached = self.result(table, [table], ruleset_version(table, columns), compute,
+                                      _encode_profile, _decode_profile, keep=lambda profile: profile['complete'])
+        if cached:
+            profile.update(complete=True, failed_early=[], cached=True,
+                           timings={'load_seconds': round(time.perf_counter() - began, 3), 'profile_seconds': 0.0})
+        return profile
+
+    def save(self):
+        if not self._changed:
+            return
+        with self._lock:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump({'format': CACHE_FORMAT, 'files': self.files, 'results': self.results}, f)
+            os.replace(self.path + '.tmp', self.path)
+            self._changed = False
+
+
+def profiles_rows(profiles):
+    return next(iter(profiles.values()))['rows'] if profiles else 0
+
+
+def evaluate(rule, tables):
+    """Evaluate a rule over the table profiles."""
+    profiles = []
+    for table, column in rule.references():
+        profile = tables[table]
+        if column == ALL_COLUMNS:
+            profiles.extend(profile['columns'].values())
+        elif column is None:
+            profiles.append({'rows': profile['rows']})
+        else:
+            profiles.append(profile['columns'][column])
+    return bool(RULE_KINDS[rule.kind][1](profiles, rule.expected))
+
+
+def run_validation(data_dir=DATA_DIR, rules=RULES, max_workers=None, stream=False, chunk_rows=CHUNK_ROWS,
+                   memory_limit=SPILL_MEMORY_BYTES, fail_fast=False, cache=True, reconciliation=True,
+                   integrity=True, bloom=False):
+    """Run every rule and return structured results with timings.
+
+    A rule that could not be decided because reading stopped early is
+    reported as None. With cache, unchanged files are not read again (see
+    ValidationCache). With reconciliation, the metric tables are also
+    recomputed from the policy data and compared (see reconcile_metrics.py);
+    with integrity, the schema's relationships are checked for orphans (see
+    referential_integrity.py), holding keys in a Bloom filter with bloom.
+    """
+    began = time.perf_counter()
+    needed = plan(rules)
+    stop = threading.Event()
+    cache = ValidationCache(data_dir) if cache else None
+
+    def profile(table, columns):
+        if stream:
+            compute = functools.partial(stream_table, data_dir, table, columns, chunk_rows, memory_limit,
+                                        rules if fail_fast else None, stop)
+        else:
+            compute = functools.partial(profile_table, data_dir, table, columns)
+        return compute() if cache is None else cache.profile(table, columns, compute)
+
+    # Whole-dataset checks: name -> (compute, files read, version)
+    stages = {}
+    if reconciliation:
+        stages['reconciliation'] = (functools.partial(reconcile, data_dir, chunk_rows),
+                                    [REQUIRED_FILES[0]] + [f'{table}.csv' for table in METRIC_TABLES],
+                                    reconciliation_version())
+    if integrity:
+        files = sorted({f'{relationship[side]}.csv' for relationship in relationships()
+                        for side in ('fromTable', 'toTable')})
+        stages['integrity'] = (functools.partial(check_integrity, data_dir, chunk_rows, bloom), files,
+                               integrity_version(bloom))
+
+    def run_stage(name):
+        compute, files, version = stages[name]
+        if cache is None:
+            return {**compute(), 'cached': False}
+        result, cached = cache.result(name, files, version, compute)
+        return {**result, 'cached': cached}
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(needed) + len(stages)) as pool:
+        futures = {table: pool.submit(profile, table, columns) for table, columns in needed.items()}
+        stage_futures = {name: pool.submit(run_stage, name) for name in stages}
+        tables, stage_results, errors = {}, {}, {}
+        for table, future in futures.items():
+            try:
+                tables[table] = future.result()
+            except Exception as e:
+                errors[table] = str(e)
+        for name, future in stage_futures.items():
+            try:
+                stage_results[name] = future.result()
+            except Exception as e:
+                errors[name] = str(e)
+    if cache is not None:
+        cache.save()
+
+    evaluated = time.perf_counter()
+    sections = {}
+    for section, section_rules in rules.items():
+        results = {}
+        for rule in section_rules:
+            referenced = [table for table, _ in rule.references()]
+            if any(table in errors for table in referenced):
+                results[rule.name] = False
+                continue
+            result = evaluate(rule, tables)
+            if not all(tables[table]['complete'] for table in referenced) and (
+                    result or not RULE_KINDS[rule.kind][2]):
+                result = None
+            results[rule.name] = result
+        sections[section] = results
+    finished = time.perf_counter()
+
+    return {
+        'sections': sections,
+        'tables': {table: {'rows': profile['rows'], 'complete': profile['complete'],
+                           'failed_early': profile.get('failed_early', []), 'cached': profile.get('cached', False),
+                           'timings': profile['timings']}
+                   for table, profile in tables.items()},
+        'summary': summarize(tables) if all(profile['complete'] for profile in tables.values()) else {},
+        'reconciliation': stage_results.get('reconciliation'),
+        'integrity': stage_results.get('integrity'),
+        'errors': errors,
+        'timings': {'tables_seconds': round(evaluated - began, 3),
+                    'rules_seconds': round(finished - evaluated, 3),
+                    'total_seconds': round(finished - began, 3)},
     }
-    return checks
-
-def validate_region_metrics(df):
-    """Validate region-based metrics."""
-    checks = {
-        'null_check': df.isnull().sum().sum() == 0,
-        'regions_present': len(df.index) == 5,  # Should have 5 regions
-        'metrics_positive': all(
-            df[['total_premium', 'total_claims', 'customer_count']].ge(0).all()
-        ),
-        'customer_counts_match': df['customer_count'].sum() == 20000  # Total customers
+
+
+def validation_passed(results):
+    """Whether run_validation() found nothing wrong: no errors and no failed rule or whole-dataset check."""
+    return (not results['errors']
+            and all(result is not False for checks in results['sections'].values() for result in checks.values())
+            and all(results[name] is None or results[name]['passed'] for name in ('reconciliation', 'integrity')))
+
+
+def summarize(tables):
+    """Headline figures for the main dataset from its profile."""
+    insurance = tables.get('insurance_data.csv')
+    if insurance is None:
+        return {}
+    columns, rows = insurance['columns'], insurance['rows']
+    counts = columns['customer_segment']['counts']
+    return {
+        'total_customers': rows,
+        'total_premium': columns['annual_premium']['sum'],
+        'total_claims': columns['claim_amount']['sum'],
+        'fraud_rate': columns['fraud_reported']['sum'] / rows if rows else None,
+        'segment_distribution': {segment: count / rows for segment, count in
+                                 sorted(counts.items(), key=lambda item: (-item[1], item[0]))},
     }
-    return checks
-
-def validate_relationships():
-    """Validate relationships between datasets."""
-    try:
-        # Load all datasets
-        insurance_data = pd.read_csv('data/processed/insurance_data.csv')
-        customer_metrics = pd.read_csv('data/processed/customer_metrics.csv')
-        region_metrics = pd.read_csv('data/processed/region_metrics.csv')
-        
-        # Check relationships
-        checks = {
-            'customer_segments_match': set(insurance_data['customer_segment'].unique()) == \
-                                     set(customer_metrics.index),
-            'regions_match': set(insurance_data['region'].unique()) == \
-                           set(region_metrics.index),
-            'customer_totals_match': len(insurance_data) == 20000,
-            'segment_totals_match': customer_metrics['customer_count'].sum() == 20000,
-            'region_totals_match': region_metrics['customer_count'].sum() == 20000
-        }
-        return checks
-    except Exception as e:
-        return {'error': str(e)}
+
 
 def print_validation_results(results, section):
     """Print validation results in a formatted way."""
     print(f"\n{section} Validation Results:")
     print("-" * 50)
     for check, result in results.items():
-        status = "✓" if result else "✗"
+        status = "–" if result is None else "✓" if result else "✗"
         print(f"{status} {check.replace('_', ' ').title()}")
 
+
+def print_summary(summary):
+    print("\nSummary Statistics:")
+    print("-" * 50)
+    print(f"Total Customers: {summary['total_customers']:,}")
+    print(f"Total Premium: ${summary['total_premium']:,.2f}")
+    print(f"Total Claims: ${summary['total_claims']:,.2f}")
+    print(f"Overall Fraud Rate: {(summary['fraud_rate'] * 100):.2f}%")
+    print("\nCustomer Segments Distribution:")
+    for segment, share in summary['segment_distribution'].items():
+        print(f"{segment:<20}{share * 100:>6.1f}")
+
+
+def print_timings(results):
+    print("\nValidation Timings:")
+    print("-" * 50)
+    for table, entry in results['tables'].items():
+        timings = entry['timings']
+        if entry['cached']:
+            print(f"{table:<24}{entry['rows']:>12,} rows  unchanged, from cache")
+            continue
+        print(f"{table:<24}{entry['rows']:>12,} rows  load {timings['load_seconds']:.3f}s  "
+              f"profile {timings['profile_seconds']:.3f}s")
+    reconciliation = results['reconciliation']
+    if reconciliation is not None:
+        timings = reconciliation['timings']
+        print(f"{'reconciliation':<24}{reconciliation['source_rows']:>12,} rows  " + (
+            "unchanged, from cache" if reconciliation['cached'] else
+            f"aggregate {timings['aggregate_seconds']:.3f}s  compare {timings['compare_seconds']:.3f}s"))
+    integrity = results['integrity']
+    if integrity is not None:
+        print(f"{'integrity':<24}{len(integrity['relationships']):>12,} joins  " + (
+            "unchanged, from cache" if integrity['cached'] else
+            f"check {integrity['timings']['check_seconds']:.3f}s"))
+    print(f"{'total':<24}{results['timings']['total_seconds']:>12.3f}s")
+
+
+def print_results(results):
+    """Print the results of run_validation() section by section."""
+    for table, error in results['errors'].items():
+        print(f"\nError during validation of {table}: {error}")
+    for table, entry in results['tables'].items():
+        if entry['failed_early']:
+            print(f"\nStopped reading {table} after {entry['rows']:,} rows: "
+                  f"{', '.join(entry['failed_early'])} failed")
+    for section, checks in results['sections'].items():
+        print_validation_results(checks, section)
+    if results['reconciliation'] is not None:
+        print_reconciliation(results['reconciliation'])
+    if results['integrity'] is not None:
+        print_integrity(results['integrity'])
+    if results['summary']:
+        print_summary(results['summary'])
+    print_timings(results)
+
+
 def main():
     """Run all validations."""
-    print("Starting Power BI Data Validation...")
-    
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    parser.add_argument('--stream', action='store_true', help='Read files in chunks in bounded memory')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--memory-limit-mb', type=int, default=SPILL_MEMORY_BYTES // (1024 * 1024),
+                        help='Memory for uniqueness checks before they spill to disk')
+    parser.add_argument('--fail-fast', action='store_true',
+                        help='With --stream, stop at the first check that fails for good')
+    parser.add_argument('--no-cache', action='store_true', help='Re-read every file, even if it is unchanged')
+    parser.add_argument('--no-reconcile', action='store_true',
+                        help='Skip recomputing the metric tables from the policy data')
+    parser.add_argument('--no-integrity', action='store_true', help="Skip the schema's relationship checks")
+    parser.add_argument('--bloom', action='store_true',
+                        help='Hold relationship keys in a fixed-size Bloom filter (bounded memory, approximate)')
+    args = parser.parse_args()
+
+    if not args.json:
+        print("Starting Power BI Data Validation...")
+
     # Check file existence
-    files_exist, missing_files = validate_file_existence()
+    files_exist, missing_files = validate_file_existence(args.data_dir)
     if not files_exist:
         print("\nError: Missing required files:")
         for file in missing_files:
             print(f"- {file}")
         return
-    
-    try:
-        # Load and validate main dataset
-        insurance_data = pd.read_csv('data/processed/insurance_data.csv')
-        print_validation_results(
-            validate_insurance_data(insurance_data),
-            "Insurance Data"
-        )
-        
-        # Load and validate time metrics
-        time_metrics = pd.read_csv('data/processed/time_metrics.csv')
-        print_validation_results(
-            validate_time_metrics(time_metrics),
-            "Time Metrics"
-        )
-        
-        # Load and validate customer metrics
-        customer_metrics = pd.read_csv('data/processed/customer_metrics.csv')
-        print_validation_results(
-            validate_customer_metrics(customer_metrics),
-            "Customer Metrics"
-        )
-        
-        # Load and validate region metrics
-        region_metrics = pd.read_csv('data/processed/region_metrics.csv')
-        print_validation_results(
-            validate_region_metrics(region_metrics),
-            "Region Metrics"
-        )
-        
-        # Validate relationships
-        print_validation_results(
-            validate_relationships(),
-            "Data Relationships"
-        )
-        
-        # Print summary statistics
-        print("\nSummary Statistics:")
-        print("-" * 50)
-        print(f"Total Customers: {len(insurance_data):,}")
-        print(f"Total Premium: ${insurance_data['annual_premium'].sum():,.2f}")
-        print(f"Total Claims: ${insurance_data['claim_amount'].sum():,.2f}")
-        print(f"Overall Fraud Rate: {(insurance_data['fraud_reported'].mean() * 100):.2f}%")
-        print("\nCustomer Segments Distribution:")
-        print(insurance_data['customer_segment'].value_counts(normalize=True).round(3) * 100)
-        
-    except Exception as e:
-        print(f"\nError during validation: {str(e)}")
+
+    results = run_validation(args.data_dir, stream=args.stream, chunk_rows=args.chunk_rows,
+                             memory_limit=args.memory_limit_mb * 1024 * 1024, fail_fast=args.fail_fast,
+                             cache=not args.no_cache, reconciliation=not args.no_reconcile,
+                             integrity=not args.no_integrity, bloom=args.bloom)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print_results(results)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()